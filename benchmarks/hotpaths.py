@@ -0,0 +1,209 @@
+"""
+Micro-benchmarks for the parse, ingest & aggregate hot paths
+
+For each size, a synthetic document (see benchmarks.xml_generator) is written to
+a temporary file and timed through:
+
+*   parse: parse_test_results (every record validated into a list)
+*   parse_stream: iter_test_results, as consumed by ingestion
+*   process_insert: process_test_results into empty tables
+*   process_reimport: the same document again (every record a duplicate)
+*   aggregate_numpy / aggregate_sql: calculate_aggregates per test, per backend
+*   aggregate_batch: calculate_aggregates_batch over every test at once
+
+The database steps DROP & recreate every table, so point --database-url at a
+scratch database. Without it the testing database (markrdb_test) is used.
+Use --skip-db to time parsing only.
+
+Results are printed as JSON (or written to --output). Pass a previous run as
+--baseline to exit with status 1 when any timing is slower by more than
+--tolerance.
+
+Run with: python -m benchmarks.hotpaths --sizes 1000,100000,1000000
+"""
+import argparse
+import collections
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from benchmarks.xml_generator import add_generator_arguments, generator_options, write_markr_xml
+
+def _measure(function, repeat):
+    """Call function repeat times, returning the elapsed seconds of each call"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def _result(name, rows, timings, operations=None):
+    """
+    Summarize the timings of one benchmark
+
+    Args:
+        operations (int): Work items per call, for the throughput figure (defaults to rows)
+    """
+    best = min(timings)
+    return {
+        'benchmark': name,
+        'rows': rows,
+        'runs': len(timings),
+        'seconds': best,
+        'median_seconds': statistics.median(timings),
+        'per_second': (operations or rows) / best if best else None,
+    }
+
+def bench_parse(path, rows, repeat):
+    """Time the XML parser over the document at path"""
+    from markr_app.services.xml_parser import iter_test_results, parse_test_results
+
+    def parse():
+        with open(path, 'rb') as file:
+            parse_test_results(file)
+
+    def parse_stream():
+        with open(path, 'rb') as file:
+            collections.deque(iter_test_results(file), maxlen=0)
+
+    return [
+        _result('parse', rows, _measure(parse, repeat)),
+        _result('parse_stream', rows, _measure(parse_stream, repeat)),
+    ]
+
+def bench_database(app, path, rows, repeat):
+    """Time importing the document at path into empty tables, then aggregating it"""
+    from markr_app.database import db
+    from markr_app.models import TestStatistics
+    from markr_app.schema import init_schema
+    from markr_app.services.aggregation import calculate_aggregates, calculate_aggregates_batch
+    from markr_app.services.ingestion import process_test_results
+
+    results = []
+
+    with app.app_context():
+        def process():
+            with open(path, 'rb') as file:
+                process_test_results(file)
+
+        # Every insert run needs empty tables, which isn't part of the timing
+        insert_timings = []
+        for _ in range(repeat):
+            db.session.remove()
+            db.drop_all()
+            init_schema()
+            insert_timings.extend(_measure(process, 1))
+        results.append(_result('process_insert', rows, insert_timings))
+        results.append(_result('process_reimport', rows, _measure(process, repeat)))
+
+        test_ids = db.session.scalars(db.select(TestStatistics.test_id).order_by(TestStatistics.test_id)).all()
+
+        for backend in ('numpy', 'sql'):
+            def aggregate():
+                for test_id in test_ids:
+                    calculate_aggregates(test_id, backend=backend)
+                db.session.rollback()
+            results.append(_result(f'aggregate_{backend}', rows, _measure(aggregate, repeat), len(test_ids)))
+
+        def aggregate_batch():
+            calculate_aggregates_batch(test_ids)
+            db.session.rollback()
+        results.append(_result('aggregate_batch', rows, _measure(aggregate_batch, repeat), len(test_ids)))
+
+        db.session.remove()
+
+    return results
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Compare results against a previous run
+
+    Returns:
+        list: One entry per benchmark that got slower by more than tolerance
+    """
+    previous = {(entry['benchmark'], entry['rows']): entry['seconds'] for entry in baseline['results']}
+    regressions = []
+    for entry in results:
+        before = previous.get((entry['benchmark'], entry['rows']))
+        if before and entry['seconds'] > before * (1 + tolerance):
+            regressions.append({
+                'benchmark': entry['benchmark'],
+                'rows': entry['rows'],
+                'baseline_seconds': before,
+                'seconds': entry['seconds'],
+                'slowdown': entry['seconds'] / before,
+            })
+    return regressions
+
+def create_benchmark_app(database_url):
+    """Build an app against the benchmark database"""
+    os.environ['AGGREGATE_CACHE_LISTEN'] = '0'
+    if database_url:
+        os.environ['DATABASE_URL'] = database_url
+        config_name = 'development'
+    else:
+        config_name = 'testing'
+
+    # Imported late so the environment above is picked up by the config
+    from markr_app.app import create_app
+    return create_app(config_name)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the parse, ingest & aggregate hot paths.')
+    parser.add_argument('--sizes', default='1000,100000,1000000',
+                        help='Comma separated numbers of distinct results.')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per benchmark (best is reported).')
+    parser.add_argument('--database-url', default=None, help='Scratch Postgres database (tables are dropped).')
+    parser.add_argument('--skip-db', action='store_true', help='Only time parsing.')
+    parser.add_argument('--output', default=None, help='Write the JSON results to this file.')
+    parser.add_argument('--baseline', default=None, help='Previous results to check for regressions.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed slowdown over the baseline, as a fraction.')
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+
+    app = None if args.skip_db else create_benchmark_app(args.database_url)
+    options = generator_options(args)
+    results = []
+
+    for rows in [int(size) for size in args.sizes.split(',')]:
+        with tempfile.NamedTemporaryFile(suffix='.xml') as file:
+            size_bytes = write_markr_xml(file, rows=rows, **options)
+            file.flush()
+            print(f"{rows} rows: {size_bytes / 1e6:.1f} MB document", file=sys.stderr)
+
+            results.extend(bench_parse(file.name, rows, args.repeat))
+            if app is not None:
+                results.extend(bench_database(app, file.name, rows, args.repeat))
+
+    report = {
+        'suite': 'hotpaths',
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'document': options,
+        'results': results,
+    }
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            report['regressions'] = find_regressions(results, json.load(file), args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+    if report.get('regressions'):
+        print(f"{len(report['regressions'])} benchmarks regressed", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
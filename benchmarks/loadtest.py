@@ -0,0 +1,245 @@
+"""
+End-to-end load test: grading machines & dashboards against a running app
+
+Simulated grading machines POST synthetic text/xml+markr documents to /import
+(each with its own students, spread over --tests tests), while dashboard clients
+poll GET /results/<test_id>/aggregate for the same tests. Both run concurrently
+against a real server & database, for --duration seconds.
+
+A recorded traffic file can be replayed instead of (or as well as) the
+synthetic load with --replay. Each line is a JSON object:
+
+    {"at": 1.5, "method": "POST", "path": "/import",
+     "headers": {"Content-Type": "text/xml+markr"}, "body": "<mcq-test-results>..."}
+
+"at" (seconds from the start) is optional; without it lines are sent back to
+back. "method" defaults to POST when there is a body and GET otherwise, and
+"path" defaults to /import. Imports default to the text/xml+markr content type.
+
+The report gives, per endpoint: requests, throughput, p50/p95/p99 latency,
+status codes and the error rate (connection failures & 4xx/5xx responses
+other than 404).
+
+Run with: python -m benchmarks.loadtest --url http://localhost:5000 --machines 8 --dashboards 32
+"""
+import argparse
+import itertools
+import json
+import math
+import random
+import threading
+import time
+import requests
+from benchmarks.xml_generator import generate_markr_xml
+
+class EndpointStats:
+    """Latencies & outcomes of the requests made to one endpoint"""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.failures = 0
+        self.rows = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency, status=None, rows=0):
+        """Record one request; status is None when it never got a response"""
+        with self._lock:
+            self.latencies.append(latency)
+            if status is None:
+                self.failures += 1
+            else:
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.rows += rows
+
+    def summary(self, elapsed):
+        """Summarize the recorded requests over a run lasting elapsed seconds"""
+        with self._lock:
+            latencies = sorted(self.latencies)
+            # A 404 just means a dashboard polled a test nothing was imported for yet
+            errors = self.failures + sum(
+                count for status, count in self.statuses.items() if status >= 400 and status != 404
+            )
+            summary = {
+                'requests': len(latencies),
+                'requests_per_second': len(latencies) / elapsed if elapsed else None,
+                'p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+                'p95_ms': percentile(latencies, 95) * 1000 if latencies else None,
+                'p99_ms': percentile(latencies, 99) * 1000 if latencies else None,
+                'max_ms': latencies[-1] * 1000 if latencies else None,
+                'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+                'connection_failures': self.failures,
+                'error_rate': errors / len(latencies) if latencies else 0.0,
+            }
+            if self.rows:
+                summary['rows_per_second'] = self.rows / elapsed
+            return summary
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list"""
+    rank = max(math.ceil(percent / 100 * len(sorted_values)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def timed_request(session, stats, method, url, rows=0, **kwargs):
+    """Send a request, recording its latency & status in stats"""
+    start = time.perf_counter()
+    try:
+        response = session.request(method, url, **kwargs)
+        response.content
+    except requests.RequestException:
+        stats.record(time.perf_counter() - start)
+        return None
+    stats.record(time.perf_counter() - start, response.status_code,
+                 rows if response.status_code < 300 else 0)
+    return response
+
+def run_machine(args, machine, stop_event, stats):
+    """A grading machine posting documents until stopped"""
+    session = requests.Session()
+    headers = {'Content-Type': 'text/xml+markr'}
+    if args.use_async:
+        headers['Prefer'] = 'respond-async'
+
+    for document in itertools.count():
+        if stop_event.is_set():
+            return
+
+        # Every document brings new students, so imports insert rather than skip
+        first_student = (machine * 1_000_000 + document) * args.rows_per_document
+        body = generate_markr_xml(
+            rows=args.rows_per_document, tests=args.tests, answers=args.answers,
+            duplicate_rate=args.duplicate_rate, rescan_rate=args.rescan_rate,
+            seed=first_student, first_student=first_student,
+        )
+        timed_request(session, stats, 'POST', f"{args.url}/import",
+                      rows=args.rows_per_document, data=body, headers=headers, timeout=args.timeout)
+        stop_event.wait(args.import_interval)
+
+def run_dashboard(args, dashboard, stop_event, stats):
+    """A dashboard polling aggregates for random tests until stopped"""
+    session = requests.Session()
+    rng = random.Random(dashboard)
+
+    while not stop_event.is_set():
+        test_id = f"BENCH{rng.randrange(args.tests):05d}"
+        timed_request(session, stats, 'GET', f"{args.url}/results/{test_id}/aggregate", timeout=args.timeout)
+        stop_event.wait(args.poll_interval)
+
+def load_replay(path):
+    """
+    Read a recorded traffic file
+
+    Returns:
+        list: (at, method, path, headers, body) tuples in file order
+    """
+    entries = []
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            body = entry.get('body')
+            method = entry.get('method') or ('POST' if body is not None else 'GET')
+            path = entry.get('path', '/import')
+            headers = entry.get('headers') or {}
+            if path == '/import':
+                headers.setdefault('Content-Type', 'text/xml+markr')
+            entries.append((entry.get('at'), method.upper(), path,
+                            headers, body.encode('utf-8') if isinstance(body, str) else body))
+    return entries
+
+def run_replay(args, entries, stop_event, stats_for, started):
+    """Send recorded requests in order, at their recorded offsets where given"""
+    session = requests.Session()
+
+    for _ in range(args.replay_loops):
+        for at, method, path, headers, body in entries:
+            if stop_event.is_set():
+                return
+            if at is not None:
+                delay = started + at - time.perf_counter()
+                if delay > 0 and stop_event.wait(delay):
+                    return
+            timed_request(session, stats_for(f"replay {method} {path.split('?')[0]}"), method,
+                          f"{args.url}{path}", data=body, headers=headers, timeout=args.timeout)
+        started = time.perf_counter()
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test a running Markr app.')
+    parser.add_argument('--url', default='http://localhost:5000', help='Base URL of the app.')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds to run for.')
+    parser.add_argument('--machines', type=int, default=4, help='Concurrent grading machines.')
+    parser.add_argument('--import-interval', type=float, default=1.0,
+                        help='Seconds each machine waits between documents (0 for back to back).')
+    parser.add_argument('--rows-per-document', type=int, default=100, help='Results per imported document.')
+    parser.add_argument('--tests', type=int, default=10, help='Tests the results are spread over.')
+    parser.add_argument('--answers', type=int, default=20, help='<answer> elements per record.')
+    parser.add_argument('--duplicate-rate', type=float, default=0.05, help='Fraction of results sent twice.')
+    parser.add_argument('--rescan-rate', type=float, default=0.05, help='Fraction of results rescanned.')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='Send Prefer: respond-async with imports.')
+    parser.add_argument('--dashboards', type=int, default=16, help='Concurrent dashboard clients.')
+    parser.add_argument('--poll-interval', type=float, default=0.5,
+                        help='Seconds each dashboard waits between polls (0 for back to back).')
+    parser.add_argument('--replay', default=None, help='JSON lines traffic file to replay.')
+    parser.add_argument('--replay-loops', type=int, default=1, help='Times to replay the traffic file.')
+    parser.add_argument('--timeout', type=float, default=60, help='Per-request timeout in seconds.')
+    parser.add_argument('--output', default=None, help='Write the JSON report to this file.')
+    args = parser.parse_args()
+    args.url = args.url.rstrip('/')
+
+    endpoints = {}
+    endpoints_lock = threading.Lock()
+
+    def stats_for(name):
+        with endpoints_lock:
+            return endpoints.setdefault(name, EndpointStats())
+
+    stop_event = threading.Event()
+    started = time.perf_counter()
+    threads = []
+
+    for machine in range(args.machines):
+        threads.append(threading.Thread(target=run_machine, daemon=True,
+                                        args=(args, machine, stop_event, stats_for('POST /import'))))
+    for dashboard in range(args.dashboards):
+        threads.append(threading.Thread(target=run_dashboard, daemon=True,
+                                        args=(args, dashboard, stop_event,
+                                              stats_for('GET /results/<test_id>/aggregate'))))
+    if args.replay:
+        threads.append(threading.Thread(target=run_replay, daemon=True,
+                                        args=(args, load_replay(args.replay), stop_event, stats_for, started)))
+
+    for thread in threads:
+        thread.start()
+    try:
+        stop_event.wait(args.duration)
+    except KeyboardInterrupt:
+        pass
+    stop_event.set()
+
+    # Let requests in flight finish so their latencies count
+    for thread in threads:
+        thread.join(args.timeout)
+    elapsed = time.perf_counter() - started
+
+    report = {
+        'suite': 'loadtest',
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'url': args.url,
+        'duration_seconds': elapsed,
+        'machines': args.machines,
+        'dashboards': args.dashboards,
+        'rows_per_document': args.rows_per_document,
+        'endpoints': {name: stats.summary(elapsed) for name, stats in sorted(endpoints.items())},
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
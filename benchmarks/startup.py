@@ -0,0 +1,79 @@
+"""
+Cold start benchmark: how long a fresh process takes to become ready to serve
+
+Each sample runs in a new interpreter, as a restarted instance or gunicorn
+worker would, and times:
+
+*   import: importing markr_app.wsgi, i.e. every module plus create_app()
+*   first_request: serving GET /health from the fresh app
+
+It also records which heavy modules the import pulled in. No database is
+needed; create_app() must not connect to one.
+
+Run with: python benchmarks/startup.py [--runs 20]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter
+SAMPLE = r"""
+import json, sys, time
+start = time.perf_counter()
+from markr_app.wsgi import app
+imported = time.perf_counter()
+response = app.test_client().get('/health')
+served = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({
+    'import': imported - start,
+    'first_request': served - imported,
+    'modules': {name: name in sys.modules for name in ('numpy', 'lxml.etree', 'psycopg2')},
+}))
+"""
+
+def run_sample(env):
+    output = subprocess.run(
+        [sys.executable, '-c', SAMPLE], cwd=ROOT, env=env,
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        'min_ms': round(values[0] * 1000, 2),
+        'median_ms': round(statistics.median(values) * 1000, 2),
+        'max_ms': round(values[-1] * 1000, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20, help='Number of fresh processes to time.')
+    args = parser.parse_args()
+
+    # The testing config builds its database URL from parts, so no server is needed
+    env = dict(os.environ)
+    env.setdefault('FLASK_ENV', 'testing')
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+
+    # One untimed run warms the OS file cache & writes the .pyc files
+    run_sample(env)
+    samples = [run_sample(env) for _ in range(args.runs)]
+
+    print(json.dumps({
+        'benchmark': 'startup',
+        'runs': args.runs,
+        'python': sys.version.split()[0],
+        'import': summarize([sample['import'] for sample in samples]),
+        'first_request': summarize([sample['first_request'] for sample in samples]),
+        'modules_loaded': samples[-1]['modules'],
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Synthetic Markr XML documents for benchmarks
+
+Documents look like the ones the scanning machines send: every record carries
+the fields we import plus the "gunk" we ignore (extra fields & per-question
+<answer> elements), and some records are exact duplicates or rescans of an
+earlier record.
+
+Run with: python -m benchmarks.xml_generator --rows 100000 > results.xml
+"""
+import argparse
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+from xml.sax.saxutils import escape
+
+FIRST_NAMES = ['Jane', 'John', 'Aisha', 'Wei', 'Priya', 'Mateo', 'Olivia', 'Noah', 'Sione', 'Mia']
+LAST_NAMES = ['Austen', 'Smith', 'Khan', 'Chen', 'Patel', 'Garcia', 'Brown', 'Nguyen', 'Taufa', 'Wilson']
+
+SCAN_START = datetime(2017, 12, 4, 12, 12, 10, tzinfo=timezone.utc)
+
+def _record(student, test_id, obtained, available, scanned_at, answers, gunk, rng):
+    parts = [
+        f'\t<mcq-test-result scanned-on="{scanned_at.isoformat().replace("+00:00", "Z")}">\n',
+        f'\t\t<first-name>{FIRST_NAMES[student % len(FIRST_NAMES)]}</first-name>\n',
+        f'\t\t<last-name>{LAST_NAMES[student // len(FIRST_NAMES) % len(LAST_NAMES)]}</last-name>\n',
+        f'\t\t<student-number>{student:06d}</student-number>\n',
+        f'\t\t<test-id>{escape(test_id)}</test-id>\n',
+    ]
+    for index in range(gunk):
+        parts.append(f'\t\t<gunk-{index} source="scanner">{rng.getrandbits(32):08x}</gunk-{index}>\n')
+    # With one answer per available mark, the awarded marks add up to the summary
+    correct = set(rng.sample(range(answers), round(answers * obtained / available))) \
+        if answers and available else set()
+    for question in range(answers):
+        choice = 'ABCD'[rng.randrange(4)]
+        parts.append(
+            f'\t\t<answer question="{question + 1}" marks-available="1" '
+            f'marks-awarded="{int(question in correct)}">{choice}</answer>\n'
+        )
+    parts.append(f'\t\t<summary-marks available="{available}" obtained="{obtained}" />\n')
+    parts.append('\t</mcq-test-result>\n')
+    return ''.join(parts)
+
+def iter_markr_xml(rows=1000, tests=1, duplicate_rate=0.0, rescan_rate=0.0,
+                   answers=0, gunk=0, marks_available=20, seed=0, first_student=0):
+    """
+    Generate a Markr XML document in chunks, without holding it in memory
+
+    Args:
+        rows (int): Number of distinct (student, test) results
+        tests (int): Number of tests the results are spread over
+        duplicate_rate (float): Fraction of results sent twice, unchanged
+        rescan_rate (float): Fraction of results sent again with a different score
+        answers (int): <answer> elements per record
+        gunk (int): Extra, ignored fields per record
+        marks_available (int): Marks available on every test
+        seed (int): Seed for the random scores, so documents are reproducible
+        first_student (int): Number of the first student, to give documents distinct students
+
+    Yields:
+        bytes: Consecutive pieces of the UTF-8 encoded document
+    """
+    rng = random.Random(seed)
+    students_per_test = max(rows // max(tests, 1), 1)
+
+    yield b'<?xml version="1.0" encoding="UTF-8" ?>\n<mcq-test-results>\n'
+
+    chunk = []
+    for index in range(rows):
+        # The last test takes any remainder, so there are exactly `tests` tests
+        test_index = min(index // students_per_test, max(tests, 1) - 1)
+        student = first_student + index - test_index * students_per_test
+        test_id = f"BENCH{test_index:05d}"
+        obtained = rng.randint(0, marks_available)
+        scanned_at = SCAN_START + timedelta(seconds=index)
+
+        chunk.append(_record(student, test_id, obtained, marks_available, scanned_at, answers, gunk, rng))
+
+        if rng.random() < duplicate_rate:
+            chunk.append(chunk[-1])
+        if rng.random() < rescan_rate:
+            rescanned = rng.randint(0, marks_available)
+            chunk.append(_record(student, test_id, rescanned, marks_available,
+                                 scanned_at + timedelta(minutes=5), answers, gunk, rng))
+
+        if len(chunk) >= 1000:
+            yield ''.join(chunk).encode('utf-8')
+            chunk = []
+
+    if chunk:
+        yield ''.join(chunk).encode('utf-8')
+    yield b'</mcq-test-results>\n'
+
+def generate_markr_xml(**options):
+    """
+    Generate a whole Markr XML document
+
+    Takes the same options as iter_markr_xml.
+
+    Returns:
+        bytes: The UTF-8 encoded document
+    """
+    return b''.join(iter_markr_xml(**options))
+
+def write_markr_xml(file, **options):
+    """
+    Write a Markr XML document to a binary file object
+
+    Takes the same options as iter_markr_xml.
+
+    Returns:
+        int: Number of bytes written
+    """
+    size = 0
+    for chunk in iter_markr_xml(**options):
+        file.write(chunk)
+        size += len(chunk)
+    return size
+
+def add_generator_arguments(parser):
+    """Add the document shape options to an argparse parser"""
+    parser.add_argument('--tests', type=int, default=10, help='Number of tests.')
+    parser.add_argument('--duplicate-rate', type=float, default=0.05, help='Fraction of results sent twice.')
+    parser.add_argument('--rescan-rate', type=float, default=0.05, help='Fraction of results rescanned.')
+    parser.add_argument('--answers', type=int, default=20, help='<answer> elements per record.')
+    parser.add_argument('--gunk', type=int, default=2, help='Extra ignored fields per record.')
+    parser.add_argument('--marks-available', type=int, default=20, help='Marks available per test.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+
+def generator_options(args):
+    """Pick the iter_markr_xml options out of parsed arguments"""
+    return {
+        'tests': args.tests,
+        'duplicate_rate': args.duplicate_rate,
+        'rescan_rate': args.rescan_rate,
+        'answers': args.answers,
+        'gunk': args.gunk,
+        'marks_available': args.marks_available,
+        'seed': args.seed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic Markr XML document to stdout.')
+    parser.add_argument('--rows', type=int, default=1000, help='Distinct (student, test) results.')
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+
+    write_markr_xml(sys.stdout.buffer, rows=args.rows, **generator_options(args))
+
+if __name__ == '__main__':
+    main()
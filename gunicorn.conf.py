@@ -0,0 +1,86 @@
+"""Gunicorn configuration for serving Markr in production
+
+Run with: gunicorn -c gunicorn.conf.py markr_app.wsgi:app
+Every setting can be overridden with the GUNICORN_* environment variables below.
+"""
+import glob
+import multiprocessing
+import os
+import tempfile
+
+# Serve with ProductionConfig unless told otherwise
+os.environ.setdefault('FLASK_ENV', 'production')
+
+# Workers share their metrics through this directory, so /metrics adds them up
+os.environ.setdefault('METRICS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'markr-metrics'))
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', 5000)}"
+
+# Requests mostly wait on Postgres, so threaded workers let a slow import share
+# a process with dashboard reads. Processes scale the CPU-bound parts (lxml,
+# NumPy) past the GIL.
+cpu_count = multiprocessing.cpu_count()
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8 if cpu_count == 1 else 4))
+# ProductionConfig sizes each worker's connection pool from the thread count
+os.environ['GUNICORN_THREADS'] = str(threads)
+
+def connections_per_worker():
+    """Primary connections one worker may hold: its pool, overflow & the LISTEN thread"""
+    from markr_app.config import config as app_config
+
+    app_settings = app_config.get(os.environ['FLASK_ENV'], app_config['default'])
+    return app_settings.DB_POOL_SIZE + app_settings.DB_MAX_OVERFLOW + 1
+
+# Threads already cover the waiting on Postgres, so one process per CPU (plus
+# one) is enough, and no more than the database's connection budget allows.
+# DB_RESERVED_CONNECTIONS are left for `flask import-worker`, migrations & psql.
+db_connection_budget = (int(os.environ.get('DB_MAX_CONNECTIONS', 100))
+                        - int(os.environ.get('DB_RESERVED_CONNECTIONS', 10)))
+workers = int(os.environ.get(
+    'GUNICORN_WORKERS',
+    max(1, min(cpu_count + 1, db_connection_budget // connections_per_worker())),
+))
+
+# Load the app once in the master, then fork workers from it
+preload_app = True
+
+# Recycle workers periodically to bound memory growth, staggered by the jitter
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# Give in-flight imports time to commit on shutdown or restart
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+def on_starting(server):
+    """Start the metrics from zero rather than from a previous run's files"""
+    for path in glob.glob(os.path.join(os.environ['METRICS_MULTIPROC_DIR'], 'metrics-*.json')):
+        os.remove(path)
+
+def child_exit(server, worker):
+    """Fold an exited worker's metrics into the file shared by all exited workers"""
+    from markr_app.utils.metrics import REGISTRY
+
+    REGISTRY.mark_process_dead(worker.pid, os.environ['METRICS_MULTIPROC_DIR'])
+
+def post_fork(server, worker):
+    """Give each worker its own database connections & log writer
+
+    Connections opened by the master while preloading must not be shared across
+    processes, so drop them from the inherited pools without closing them.
+    """
+    from markr_app.database import db
+    from markr_app.utils.log import restart_logging_after_fork
+    from markr_app.wsgi import app
+
+    # The log writer thread didn't survive the fork
+    restart_logging_after_fork()
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
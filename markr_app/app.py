@@ -1,17 +1,12 @@
 import os
 from flask import Flask
+from markr_app.cli import register_commands
 from markr_app.config import config
-from markr_app.database import db
+from markr_app.database import build_engine_options, build_replica_binds, db
 from markr_app.utils.errors import register_error_handlers
+from markr_app.utils.log import configure_logging
+from markr_app.utils.metrics import init_metrics
 from markr_app.views.api import api_bp
-import time
-import logging
-
-# Configure basic logging
-logging.basicConfig(
-    level=logging.INFO, 
-    format='%(asctime)s %(levelname)s %(name)s: %(message)s'
-)
 
 def create_app(config_name=None):
     """Create & configure the Flask app"""
@@ -23,27 +18,32 @@ def create_app(config_name=None):
 
     # Load config
     app.config.from_object(config[config_name])
+    if not app.config.get('SQLALCHEMY_ENGINE_OPTIONS'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = build_engine_options(app.config)
+    # Replicas are extra binds, with copies of the engine options
+    app.config['SQLALCHEMY_BINDS'] = {**build_replica_binds(app.config), **app.config.get('SQLALCHEMY_BINDS', {})}
     db.init_app(app)
 
+    # Structured logs, written by a background thread
+    configure_logging(app)
+
     # Register API blueprint
     app.register_blueprint(api_bp)
 
     # Register the error handlers
     register_error_handlers(app)
 
-    # Create the DB tables if they don't exist
-    with app.app_context():
-        try:
-            db.create_all()
-            app.logger.info("Database tables created successfully")
-        except Exception as e:
-            app.logger.error(f"Error creating database tables: {str(e)}")
+    # Time requests for /metrics & the Server-Timing header
+    init_metrics(app)
 
-    return app
+    # Register the CLI commands
+    register_commands(app)
 
-app = create_app()
+    # Nothing here may touch the database: the schema is managed by `flask init-db`
+    return app
 
 if __name__ == '__main__':
+    app = create_app()
     app.run(host=app.config['HOST'], port=app.config['PORT'])
 
 
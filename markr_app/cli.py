@@ -0,0 +1,82 @@
+import logging
+import signal
+import threading
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+logger = logging.getLogger(__name__)
+
+@click.command('import-worker')
+@click.option('--threads', type=int, default=None, help='Number of worker threads.')
+@click.option('--poll-interval', type=float, default=None, help='Seconds to wait when the queue is empty.')
+@with_appcontext
+def import_worker_command(threads, poll_interval):
+    """Run background workers for queued import jobs."""
+    from markr_app.services.jobs import start_import_workers
+
+    app = current_app._get_current_object()
+    threads = threads or app.config.get('IMPORT_WORKER_THREADS', 2)
+    poll_interval = poll_interval or app.config.get('IMPORT_WORKER_POLL_INTERVAL', 1.0)
+
+    # Finish the jobs in progress when asked to stop
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+
+    workers = start_import_workers(app, threads, stop_event, poll_interval)
+    logger.info(f"Started {threads} import workers")
+
+    while not stop_event.is_set():
+        stop_event.wait(1.0)
+    for worker in workers:
+        worker.join()
+    logger.info("Import workers stopped")
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create the database tables & apply pending migrations."""
+    from markr_app.schema import init_schema
+
+    applied = init_schema()
+    for name in applied:
+        click.echo(f"Applied migration {name}")
+    click.echo("Database schema is up to date")
+
+@click.command('partition-results')
+@click.option('--partitions', type=int, default=16, show_default=True, help='Number of hash partitions.')
+@click.option('--drop-old', is_flag=True, help='Drop the unpartitioned table once its rows are copied.')
+@click.option('--lock-timeout', type=float, default=None,
+              help="Give up if test_results can't be locked within this many seconds.")
+@with_appcontext
+def partition_results_command(partitions, drop_old, lock_timeout):
+    """Move test_results into a table hash-partitioned on test_id."""
+    from markr_app.schema import partition_test_results
+
+    lock_timeout_ms = int(lock_timeout * 1000) if lock_timeout else None
+    copied = partition_test_results(partitions, drop_old, lock_timeout_ms)
+    if copied is None:
+        click.echo("test_results is already partitioned")
+        return
+    click.echo(f"Copied {copied} results into {partitions} partitions")
+    if not drop_old:
+        click.echo("The old table is kept as test_results_unpartitioned; drop it once you're satisfied")
+
+@click.command('prune-import-documents')
+@click.option('--older-than-days', type=int, default=30, show_default=True,
+              help='Forget documents accepted more than this many days ago.')
+@with_appcontext
+def prune_import_documents_command(older_than_days):
+    """Forget the digests of old import documents."""
+    from markr_app.services.documents import prune_import_documents
+
+    pruned = prune_import_documents(older_than_days)
+    click.echo(f"Pruned {pruned} import documents")
+
+def register_commands(app):
+    """Register the CLI commands for the app"""
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(import_worker_command)
+    app.cli.add_command(partition_results_command)
+    app.cli.add_command(prune_import_documents_command)
@@ -14,7 +14,76 @@ class Config:
     # Database
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Read replicas for the read endpoints (comma separated URLs; none by default)
+    SQLALCHEMY_REPLICA_URIS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+                               if url.strip()]
+    # Replicas further behind than this are skipped in favour of the primary
+    REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5.0))
+    # Seconds a replica's replay position is reused before asking it again
+    REPLICA_STATUS_TTL = float(os.environ.get('REPLICA_STATUS_TTL', 1.0))
+    # Seconds to wait when connecting to a replica before using the primary instead
+    REPLICA_CONNECT_TIMEOUT = int(os.environ.get('REPLICA_CONNECT_TIMEOUT', 2))
+
+    # Connection pool (turned into SQLALCHEMY_ENGINE_OPTIONS by create_app)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))
+
+    # Ingestion
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+    # Reject records whose <answer> marks don't add up to their summary-marks
+    IMPORT_VERIFY_SUMMARY_MARKS = os.environ.get('IMPORT_VERIFY_SUMMARY_MARKS', '0') == '1'
+
+    # Upload limits: the body as sent, & the document after any Content-Encoding is removed
+    IMPORT_MAX_COMPRESSED_BYTES = int(os.environ.get('IMPORT_MAX_COMPRESSED_BYTES', 100 * 1024 * 1024))
+    IMPORT_MAX_DECOMPRESSED_BYTES = int(os.environ.get('IMPORT_MAX_DECOMPRESSED_BYTES', 1024 * 1024 * 1024))
+
+    # Answer re-sent documents (same SHA-256, or same Idempotency-Key) with the original outcome
+    IMPORT_DEDUPLICATE = os.environ.get('IMPORT_DEDUPLICATE', '1') == '1'
+    # Documents are hashed before parsing; larger ones are spooled to a temporary file
+    IMPORT_SPOOL_MAX_MEMORY = int(os.environ.get('IMPORT_SPOOL_MAX_MEMORY', 16 * 1024 * 1024))
+
+    # Asynchronous imports (202 Accepted + background workers)
+    IMPORT_ASYNC = os.environ.get('IMPORT_ASYNC', '0') == '1'
+    IMPORT_WORKER_THREADS = int(os.environ.get('IMPORT_WORKER_THREADS', 2))
+    IMPORT_WORKER_POLL_INTERVAL = float(os.environ.get('IMPORT_WORKER_POLL_INTERVAL', 1.0))
+    IMPORT_JOB_MAX_ATTEMPTS = int(os.environ.get('IMPORT_JOB_MAX_ATTEMPTS', 5))
+
+    # Aggregation ('numpy' reads the summary statistics, 'sql' pushes down to Postgres)
+    AGGREGATION_BACKEND = os.environ.get('AGGREGATION_BACKEND', 'numpy')
+    HISTOGRAM_MAX_MARK = int(os.environ.get('HISTOGRAM_MAX_MARK', 10000))
+
+    # Most test IDs accepted by the batch aggregate endpoint
+    AGGREGATE_BATCH_MAX_TESTS = int(os.environ.get('AGGREGATE_BATCH_MAX_TESTS', 1000))
+    # Most test IDs merged by the rollup endpoint
+    AGGREGATE_ROLLUP_MAX_TESTS = int(os.environ.get('AGGREGATE_ROLLUP_MAX_TESTS', 10000))
+
+    # Results read per keyset page by the streaming export
+    EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', 5000))
+
+    # Aggregate response cache (size 0 disables it)
+    AGGREGATE_CACHE_SIZE = int(os.environ.get('AGGREGATE_CACHE_SIZE', 1024))
+    AGGREGATE_CACHE_TTL = float(os.environ.get('AGGREGATE_CACHE_TTL', 300))
+    AGGREGATE_CACHE_LISTEN = os.environ.get('AGGREGATE_CACHE_LISTEN', '1') == '1'
+
+    # Cache-Control sent with aggregate responses (clients revalidate with ETags)
+    AGGREGATE_CACHE_CONTROL = os.environ.get('AGGREGATE_CACHE_CONTROL', 'no-cache')
     
+    # Logging (queued & written by a background thread)
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # 'json' or 'text'
+    # Fraction of imported rows logged individually at INFO (DEBUG logs every row)
+    LOG_ROW_SAMPLE_RATE = float(os.environ.get('LOG_ROW_SAMPLE_RATE', 0.0))
+
+    # Metrics (/metrics & Server-Timing response headers)
+    SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', '1') == '1'
+    # Shared directory so /metrics adds up every gunicorn worker; unset for a single process
+    METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR')
+
     # Server
     HOST = os.environ.get('HOST', '0.0.0.0')
     PORT = int(os.environ.get('PORT', 5000))
@@ -35,14 +104,33 @@ class TestingConfig(Config):
     DB_HOST = os.environ.get('DB_HOST', 'db')  # 'db' in Docker, 'localhost' otherwise
     DB_PORT = os.environ.get('DB_PORT', '5432')
     TEST_DATABASE_NAME = os.environ.get('TEST_DATABASE_NAME', 'markrdb_test')
+
+    # Each test gets a fresh app, so there's no other worker to hear from
+    AGGREGATE_CACHE_LISTEN = False
     
     SQLALCHEMY_DATABASE_URI = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{DB_HOST}:{DB_PORT}/{TEST_DATABASE_NAME}"
 
+    # A streaming replica of the test database, for the replication tests
+    SQLALCHEMY_REPLICA_URIS = [url for url in [os.environ.get('TEST_REPLICA_DATABASE_URL')] if url]
+
+    # Fail fast rather than hang when a test leaks connections
+    DB_POOL_SIZE = 2
+    DB_MAX_OVERFLOW = 2
+    DB_POOL_TIMEOUT = 5
+
 class ProductionConfig(Config):
     """Production configuration"""
     FLASK_ENV = 'production'
     FLASK_DEBUG = False
 
+    # Threads per gunicorn worker (exported by gunicorn.conf.py, same default)
+    GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 8 if (os.cpu_count() or 1) == 1 else 4))
+
+    # One connection per gunicorn thread plus a spare, with headroom for import spikes
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', GUNICORN_THREADS + 1))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 4))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+
 config = {
     'development': DevelopmentConfig,
     'testing': TestingConfig,
@@ -1,4 +1,298 @@
+from contextlib import contextmanager
+import contextvars
+import logging
+import random
+import threading
+import time
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import exc, text
+from sqlalchemy.pool import QueuePool
 
-# Initialize SQLAlchemy with no app yet
-db = SQLAlchemy()
\ No newline at end of file
+logger = logging.getLogger(__name__)
+
+# Engine the current request's reads are routed to (None for the primary)
+_read_engine = contextvars.ContextVar('markr_read_engine', default=None)
+
+class RoutingSession(Session):
+    """Session that sends reads to the engine chosen by replica_reads()"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = _read_engine.get()
+        # Flushes are writes & must reach the primary
+        if bind is None and engine is not None and not self._flushing:
+            return engine
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+# Initialize SQLAlchemy with no app yet; reads can be routed to replicas
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long callers wait to check out a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkout_count = 0
+        self.timeout_count = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkout_count += 1
+                self.timeout_count += timed_out
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def stats(self):
+        """Snapshot of the pool's current use & checkout wait times"""
+        with self._stats_lock:
+            return {
+                'pool_size': self.size(),
+                'checked_out': self.checkedout(),
+                'checked_in': self.checkedin(),
+                'overflow': max(self.overflow(), 0),
+                'max_overflow': self._max_overflow,
+                'checkouts': self.checkout_count,
+                'timeouts': self.timeout_count,
+                'wait_seconds_total': self.wait_seconds_total,
+                'wait_seconds_avg': self.wait_seconds_total / self.checkout_count if self.checkout_count else 0.0,
+                'wait_seconds_max': self.wait_seconds_max,
+            }
+
+def build_engine_options(config):
+    """
+    Build SQLALCHEMY_ENGINE_OPTIONS from the DB_* pool settings of a config
+
+    Args:
+        config (dict): The app's config
+
+    Returns:
+        dict: Keyword arguments for create_engine
+    """
+    options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+    # Have the server cancel runaway statements
+    if config.get('DB_STATEMENT_TIMEOUT_MS'):
+        options['connect_args'] = {
+            'options': f"-c statement_timeout={int(config['DB_STATEMENT_TIMEOUT_MS'])}"
+        }
+
+    return options
+
+def get_pool_stats():
+    """
+    Collect pool telemetry for every engine of the current app
+
+    Returns:
+        dict: Pool stats keyed by bind name ('default' for the main database)
+    """
+    stats = {}
+    for bind_key, engine in db.engines.items():
+        pool = engine.pool
+        name = bind_key or 'default'
+        if isinstance(pool, InstrumentedQueuePool):
+            stats[name] = pool.stats()
+        else:
+            stats[name] = {'status': pool.status()}
+    return stats
+
+# Bind keys of the read replicas are this prefix plus a number
+REPLICA_BIND_PREFIX = 'replica_'
+
+# Seconds to wait for a replica connection before falling back to the primary
+DEFAULT_REPLICA_CONNECT_TIMEOUT = 2
+
+def build_replica_binds(config):
+    """
+    Build SQLALCHEMY_BINDS entries for the read replicas of a config
+
+    Binds don't inherit SQLALCHEMY_ENGINE_OPTIONS, so each gets a copy of them,
+    with a connect timeout so an unresponsive replica can't hold up reads.
+
+    Args:
+        config (dict): The app's config, with SQLALCHEMY_REPLICA_URIS listing the replicas
+
+    Returns:
+        dict: Replica engine options (with their URL) keyed by bind key
+    """
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    options['connect_args'] = {
+        **options.get('connect_args', {}),
+        'connect_timeout': config.get('REPLICA_CONNECT_TIMEOUT', DEFAULT_REPLICA_CONNECT_TIMEOUT),
+    }
+    return {f"{REPLICA_BIND_PREFIX}{index}": {**options, 'url': uri}
+            for index, uri in enumerate(config.get('SQLALCHEMY_REPLICA_URIS') or [])}
+
+def parse_lsn(lsn):
+    """
+    Convert a Postgres WAL location ('16/B374D848') to a comparable integer
+
+    Raises:
+        ValueError: If the value isn't a WAL location
+    """
+    high, separator, low = lsn.strip().partition('/')
+    if not separator:
+        raise ValueError(f"Invalid LSN: {lsn}")
+    return (int(high, 16) << 32) + int(low, 16)
+
+class ReplicaStatus:
+    """Replay position & lag of one replica, refreshed at most once per interval"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.checked_at = None
+        self.replay_lsn = None
+        self.lag_seconds = None
+        self.error = None
+
+    def refresh(self):
+        """Ask the replica how far it has replayed the primary's WAL"""
+        try:
+            with self.engine.connect() as connection:
+                row = connection.execute(text(
+                    "SELECT CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() "
+                    "ELSE pg_current_wal_lsn() END::text AS replay_lsn, "
+                    # A replica with nothing left to replay isn't lagging, however old its last transaction
+                    "CASE WHEN NOT pg_is_in_recovery() "
+                    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+                    "END::float AS lag_seconds"
+                )).one()
+            self.replay_lsn = parse_lsn(row.replay_lsn) if row.replay_lsn else None
+            self.lag_seconds = row.lag_seconds
+            self.error = None
+        except Exception as e:
+            logger.warning(f"Read replica {self.engine.url.host} is unavailable: {str(e)}")
+            self.replay_lsn = None
+            self.lag_seconds = None
+            self.error = str(e)
+        self.checked_at = time.monotonic()
+
+    def _needs_refresh(self, min_lsn, ttl):
+        if self.checked_at is None or time.monotonic() - self.checked_at >= ttl:
+            return True
+        # A replica behind the requested write may have caught up since
+        return min_lsn is not None and self.error is None \
+            and (self.replay_lsn is None or self.replay_lsn < min_lsn)
+
+    def usable(self, max_lag_seconds, min_lsn, ttl):
+        """
+        Check whether the replica can serve a read
+
+        Only one caller refreshes the status at a time. While it does, the replica
+        counts as unusable for everyone else, so reads go to the primary instead of
+        queueing behind a replica that may have stopped answering.
+
+        Args:
+            max_lag_seconds (float): Most replication lag tolerated
+            min_lsn (int): WAL location the replica must have replayed, if any
+            ttl (float): Seconds a status stays fresh; a stale or behind status is re-checked
+        """
+        if self._needs_refresh(min_lsn, ttl):
+            if not self.lock.acquire(blocking=False):
+                return False
+            try:
+                if self._needs_refresh(min_lsn, ttl):
+                    self.refresh()
+            finally:
+                self.lock.release()
+
+        if self.error is not None or self.replay_lsn is None:
+            return False
+        if min_lsn is not None and self.replay_lsn < min_lsn:
+            return False
+        return self.lag_seconds <= max_lag_seconds
+
+def _replica_statuses():
+    statuses = current_app.extensions.setdefault('markr_replica_status', {})
+    for bind_key, engine in db.engines.items():
+        if bind_key and bind_key.startswith(REPLICA_BIND_PREFIX) and bind_key not in statuses:
+            statuses.setdefault(bind_key, ReplicaStatus(engine))
+    return list(statuses.values())
+
+def choose_read_engine(min_lsn=None):
+    """
+    Pick a replica that can serve a read, in random order to spread the load
+
+    Args:
+        min_lsn (str): WAL location the replica must have replayed (read-your-writes)
+
+    Returns:
+        Engine: A replica engine, or None when only the primary will do
+    """
+    statuses = _replica_statuses()
+    if not statuses:
+        return None
+
+    try:
+        min_lsn = parse_lsn(min_lsn) if min_lsn else None
+    except ValueError:
+        logger.warning(f"Ignoring invalid minimum LSN: {min_lsn}")
+        min_lsn = None
+
+    max_lag_seconds = current_app.config.get('REPLICA_MAX_LAG_SECONDS', 5.0)
+    ttl = current_app.config.get('REPLICA_STATUS_TTL', 1.0)
+    for status in random.sample(statuses, len(statuses)):
+        if status.usable(max_lag_seconds, min_lsn, ttl):
+            return status.engine
+    return None
+
+@contextmanager
+def replica_reads(min_lsn=None):
+    """
+    Route the enclosed block's queries to a read replica
+
+    Falls back to the primary when no replica is configured, reachable, within
+    REPLICA_MAX_LAG_SECONDS, or (when min_lsn is given) caught up with that write.
+
+    Yields:
+        Engine: The replica used, or None for the primary
+    """
+    engine = choose_read_engine(min_lsn)
+    token = _read_engine.set(engine)
+    try:
+        yield engine
+    finally:
+        _read_engine.reset(token)
+
+@contextmanager
+def primary_reads():
+    """Route the enclosed block's queries to the primary, even inside replica_reads()"""
+    token = _read_engine.set(None)
+    try:
+        yield
+    finally:
+        _read_engine.reset(token)
+
+def current_write_lsn():
+    """
+    WAL location of the primary, covering every write committed so far
+
+    Returns:
+        str: The LSN for clients to send back for read-your-writes, or None
+            when no replicas are configured
+    """
+    if not current_app.config.get('SQLALCHEMY_REPLICA_URIS'):
+        return None
+    with primary_reads():
+        return db.session.scalar(text("SELECT pg_current_wal_lsn()::text"))
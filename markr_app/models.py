@@ -13,18 +13,24 @@ class TestResult(db.Model):
     marks_obtained = db.Column(db.Integer, nullable=False)
     marks_available = db.Column(db.Integer, nullable=False)
     scanned_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    # Per-answer marks packed into one value (see services.answers), if the record had answers
+    answers = db.Column(db.LargeBinary, nullable=True)
     created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime(timezone=True), 
                           default=lambda: datetime.now(timezone.utc), 
                           onupdate=lambda: datetime.now(timezone.utc))
     
-    # Ensure uniqueness through student_number + test_id combination
+    # Ensure uniqueness through student_number + test_id combination. Aggregates
+    # filter on test_id alone, & the covering index answers them without heap reads.
+    # Its id column lets exports page through a test in id order.
     __table_args__ = (
         db.UniqueConstraint('student_number', 'test_id', name='uix_student_test'),
+        db.Index('ix_test_results_test_id_covering', 'test_id', 'id',
+                 postgresql_include=['marks_obtained', 'marks_available']),
     )
 
     def __init__(self, student_number, test_id, first_name, last_name, 
-                 marks_obtained, marks_available, scanned_at=None):
+                 marks_obtained, marks_available, scanned_at=None, answers=None):
         self.student_number = student_number
         self.test_id = test_id
         self.first_name = first_name
@@ -32,6 +38,7 @@ class TestResult(db.Model):
         self.marks_obtained = marks_obtained
         self.marks_available = marks_available
         self.scanned_at = scanned_at
+        self.answers = answers
 
     def __repr__(self):
         """String representation of TestResult object"""
@@ -50,4 +57,102 @@ class TestResult(db.Model):
     def find_all_by_test_id(cls, test_id):
         """Find all test results for a specific test ID"""
         return cls.query.filter_by(test_id=test_id).all()
-        
\ No newline at end of file
+        
+
+class TestStatistics(db.Model):
+    """Model for the per-test summary statistics kept up to date by ingestion"""
+    __tablename__ = 'test_statistics'
+
+    test_id = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    sum_obtained = db.Column(db.BigInteger, nullable=False, default=0)
+    sum_squares_obtained = db.Column(db.BigInteger, nullable=False, default=0)
+    min_obtained = db.Column(db.Integer, nullable=True)
+    max_obtained = db.Column(db.Integer, nullable=True)
+    max_available = db.Column(db.Integer, nullable=False, default=0)
+    # Number of students per mark obtained, indexed by mark
+    mark_counts = db.Column(db.ARRAY(db.Integer), nullable=True)
+    # Bumped by every import that touches the test, used to invalidate caches
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime(timezone=True),
+                          default=lambda: datetime.now(timezone.utc),
+                          onupdate=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        """String representation of TestStatistics object"""
+        return f"<TestStatistics(test={self.test_id}, count={self.count})>"
+
+    @classmethod
+    def find_by_test_id(cls, test_id):
+        """Find the summary statistics for a specific test ID"""
+        return db.session.get(cls, test_id)
+
+
+class ImportJob(db.Model):
+    """Model for a queued import document processed by the background workers"""
+    __tablename__ = 'import_jobs'
+
+    STATUS_PENDING = 'pending'
+    STATUS_COMPLETED = 'completed'
+    STATUS_REJECTED = 'rejected'
+    STATUS_FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    status = db.Column(db.String(20), nullable=False, default=STATUS_PENDING)
+    document = db.Column(db.LargeBinary, nullable=False)
+    processed_count = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime(timezone=True),
+                          default=lambda: datetime.now(timezone.utc),
+                          onupdate=lambda: datetime.now(timezone.utc))
+
+    # Workers claim the oldest pending job, so index status + id
+    __table_args__ = (
+        db.Index('ix_import_jobs_status_id', 'status', 'id'),
+    )
+
+    def __repr__(self):
+        """String representation of ImportJob object"""
+        return f"<ImportJob(id={self.id}, status={self.status})>"
+
+    @classmethod
+    def find_by_id(cls, job_id):
+        """Find an import job through its ID"""
+        return db.session.get(cls, job_id)
+
+
+class ImportDocument(db.Model):
+    """Model recording the SHA-256 digest of every accepted import document"""
+    __tablename__ = 'import_documents'
+
+    # Hex SHA-256 of the decompressed document
+    digest = db.Column(db.String(64), primary_key=True)
+    # Idempotency-Key header the document was sent with, if any
+    idempotency_key = db.Column(db.String(255), nullable=True, unique=True)
+    # Results written by a synchronous import, or the job queued for it
+    processed_count = db.Column(db.Integer, nullable=True)
+    job_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+    # Pruning deletes the oldest documents
+    __table_args__ = (
+        db.Index('ix_import_documents_created_at', 'created_at'),
+    )
+
+    def __repr__(self):
+        """String representation of ImportDocument object"""
+        return f"<ImportDocument(digest={self.digest}, key={self.idempotency_key})>"
+
+
+class SchemaMigration(db.Model):
+    """Model recording the schema migrations applied by `flask init-db`"""
+    __tablename__ = 'schema_migrations'
+
+    name = db.Column(db.String(100), primary_key=True)
+    applied_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        """String representation of SchemaMigration object"""
+        return f"<SchemaMigration(name={self.name})>"
@@ -0,0 +1,159 @@
+import logging
+from sqlalchemy import inspect, select, text
+from markr_app.database import db
+from markr_app.models import SchemaMigration
+
+logger = logging.getLogger(__name__)
+
+# Changes to tables that already exist, as (name, [SQL statements]) in the order
+# they must run. Applied migrations are recorded in schema_migrations. New tables
+# (and their indexes) are created from the models, so they need no entry here,
+# and an empty database is created from the models with every migration recorded.
+MIGRATIONS = [
+    ('0001_test_results_answers', [
+        "ALTER TABLE test_results ADD COLUMN IF NOT EXISTS answers BYTEA",
+    ]),
+    # Lets aggregate reads of a test be index-only scans, & exports page through a
+    # test by id. On a large table, create it with CREATE INDEX CONCURRENTLY before
+    # upgrading & this becomes a no-op.
+    ('0002_test_results_test_id_covering_index', [
+        "CREATE INDEX IF NOT EXISTS ix_test_results_test_id_covering ON test_results (test_id, id) "
+        "INCLUDE (marks_obtained, marks_available)",
+    ]),
+]
+
+# Advisory lock key serialising concurrent `flask init-db` runs
+SCHEMA_LOCK_KEY = 7_041_801
+
+def _begin_maintenance(lock_timeout_ms=None):
+    """
+    Take the schema advisory lock & lift the statement timeout for this transaction
+
+    The app's connections carry DB_STATEMENT_TIMEOUT_MS, which would cancel an
+    index build or a table copy on a large table part way through. lock_timeout
+    bounds the wait for locks on the tables instead, if given.
+    """
+    db.session.execute(text("SET LOCAL statement_timeout = 0"))
+    if lock_timeout_ms:
+        db.session.execute(text(f"SET LOCAL lock_timeout = {int(lock_timeout_ms)}"))
+    db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': SCHEMA_LOCK_KEY})
+
+def init_schema():
+    """
+    Create any missing tables & apply pending migrations in one transaction
+
+    The transaction has no statement timeout, so index builds can finish. Safe to
+    run repeatedly, and from several instances at once: the runs queue up behind
+    a Postgres advisory lock.
+
+    Returns:
+        list: Names of the migrations applied by this run
+    """
+    try:
+        _begin_maintenance()
+        connection = db.session.connection()
+        is_empty = not set(inspect(connection).get_table_names()) & set(db.metadata.tables)
+        db.metadata.create_all(bind=connection)
+
+        # Tables just created from the models already have every change
+        if is_empty:
+            db.session.add_all([SchemaMigration(name=name) for name, _ in MIGRATIONS])
+
+        applied = set(db.session.scalars(select(SchemaMigration.name)))
+        pending = [(name, statements) for name, statements in MIGRATIONS if name not in applied]
+
+        for name, statements in pending:
+            logger.info(f"Applying schema migration {name}")
+            for statement in statements:
+                db.session.execute(text(statement))
+            db.session.add(SchemaMigration(name=name))
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return [name for name, _ in pending]
+
+def is_partitioned(table_name):
+    """Check whether a table is a partitioned table"""
+    return bool(db.session.scalar(
+        text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name))"),
+        {'name': table_name}
+    ))
+
+def partition_test_results(partitions, drop_old=False, lock_timeout_ms=None):
+    """
+    Move test_results into a table hash-partitioned on test_id
+
+    The current table is renamed to test_results_unpartitioned, a partitioned
+    table with the same columns, constraints & indexes takes its place, and every
+    row is copied across, all in one transaction with no statement timeout.
+    Writes to test_results wait until it commits, so run it in a maintenance window.
+
+    Partitioned tables need the partition key in every unique constraint, so the
+    primary key becomes (id, test_id). IDs still come from the same sequence.
+
+    Args:
+        partitions (int): Number of hash partitions
+        drop_old (bool): Drop the unpartitioned table once its rows are copied
+        lock_timeout_ms (int): Give up if test_results can't be locked within this time
+
+    Returns:
+        int: Number of rows copied, or None if the table was already partitioned
+    """
+    if partitions < 2:
+        raise ValueError("At least 2 partitions are needed")
+
+    try:
+        _begin_maintenance(lock_timeout_ms)
+        if is_partitioned('test_results'):
+            db.session.rollback()
+            return None
+
+        statements = [
+            "LOCK TABLE test_results IN ACCESS EXCLUSIVE MODE",
+
+            # Keep the old table (& free its constraint & index names) until the copy is done
+            "ALTER TABLE test_results RENAME TO test_results_unpartitioned",
+            "ALTER TABLE test_results_unpartitioned RENAME CONSTRAINT test_results_pkey "
+            "TO test_results_unpartitioned_pkey",
+            "ALTER TABLE test_results_unpartitioned RENAME CONSTRAINT uix_student_test "
+            "TO uix_student_test_unpartitioned",
+            "ALTER INDEX IF EXISTS ix_test_results_student_number "
+            "RENAME TO ix_test_results_unpartitioned_student_number",
+            "ALTER INDEX IF EXISTS ix_test_results_test_id_covering "
+            "RENAME TO ix_test_results_unpartitioned_test_id_covering",
+
+            "CREATE TABLE test_results (LIKE test_results_unpartitioned INCLUDING DEFAULTS) "
+            "PARTITION BY HASH (test_id)",
+            # The sequence would otherwise be dropped along with the old table
+            "ALTER SEQUENCE test_results_id_seq OWNED BY test_results.id",
+            "ALTER TABLE test_results ADD CONSTRAINT test_results_pkey PRIMARY KEY (id, test_id)",
+            "ALTER TABLE test_results ADD CONSTRAINT uix_student_test UNIQUE (student_number, test_id)",
+            "CREATE INDEX ix_test_results_student_number ON test_results (student_number)",
+            "CREATE INDEX ix_test_results_test_id_covering ON test_results (test_id, id) "
+            "INCLUDE (marks_obtained, marks_available)",
+        ]
+        statements += [
+            f"CREATE TABLE test_results_p{remainder} PARTITION OF test_results "
+            f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+            for remainder in range(partitions)
+        ]
+
+        for statement in statements:
+            db.session.execute(text(statement))
+
+        copied = db.session.execute(
+            text("INSERT INTO test_results SELECT * FROM test_results_unpartitioned")
+        ).rowcount
+        if drop_old:
+            db.session.execute(text("DROP TABLE test_results_unpartitioned"))
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    logger.info(f"Partitioned test_results into {partitions} partitions ({copied} rows copied)")
+    return copied
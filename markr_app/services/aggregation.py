@@ -1,66 +1,473 @@
 import logging
-import numpy as np
-from markr_app.models import TestResult
-from markr_app.utils.errors import ZeroMarksError
+import math
+from flask import current_app
+from sqlalchemy import Float, cast, func, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from markr_app.database import db
+from markr_app.models import TestResult, TestStatistics
+from markr_app.services.statistics import (
+    compute_histogram_from_results, compute_statistics_from_results, grouped_percentiles,
+    histogram_percentiles, weighted_percentiles
+)
+from markr_app.utils.errors import ValidationError, ZeroMarksError
+from markr_app.utils.metrics import phase_timer
 
 logger = logging.getLogger(__name__)
 
-def calculate_aggregates(test_id):
+# NumPy is imported lazily, as in services.statistics
+
+def _load_statistics(test_id):
+    """
+    Load the summary statistics for a test
+
+    Falls back to computing them from the stored results when the summary row
+    hasn't been built yet (e.g. results imported before the table existed).
+    """
+    stats = TestStatistics.find_by_test_id(test_id)
+    if stats is not None and stats.count:
+        return {
+            'count': stats.count,
+            'sum_obtained': stats.sum_obtained,
+            'sum_squares_obtained': stats.sum_squares_obtained,
+            'min_obtained': stats.min_obtained,
+            'max_obtained': stats.max_obtained,
+            'max_available': stats.max_available,
+            'mark_counts': stats.mark_counts,
+        }
+
+    stats = compute_statistics_from_results(test_id)
+    stats['mark_counts'] = compute_histogram_from_results(test_id)
+    return stats
+
+def _mean_and_stddev(count, sum_obtained, sum_squares_obtained):
+    """
+    Mean & population standard deviation of a test's marks from their running sums
+
+    Shared by the single-test & batch aggregates so both report the same numbers.
+    The sums are Python integers, so the variance numerator is exact.
+
+    Returns:
+        tuple: (mean, stddev) in marks
+    """
+    mean = sum_obtained / count
+    variance_numerator = count * sum_squares_obtained - sum_obtained ** 2
+    return mean, math.sqrt(max(variance_numerator, 0)) / count
+
+def _numpy_aggregates(test_id):
+    """
+    Aggregate a test's marks from its summary statistics & histogram using NumPy
+
+    Returns:
+        dict: Raw statistics in marks, or None if the test has no results
+    """
+    with phase_timer('aggregate_query'):
+        stats = _load_statistics(test_id)
+    if not stats['count']:
+        return None
+
+    count = stats['count']
+    mean_marks, stddev_marks = _mean_and_stddev(count, stats['sum_obtained'], stats['sum_squares_obtained'])
+
+    # Calculate percentiles from the histogram, or over the marks if there isn't one
+    if stats['mark_counts']:
+        p25, p50, p75 = histogram_percentiles(stats['mark_counts'], [25, 50, 75])
+    else:
+        with phase_timer('aggregate_query'):
+            marks_obtained = db.session.scalars(
+                select(TestResult.marks_obtained).where(TestResult.test_id == test_id)
+            ).all()
+        import numpy as np
+        p25, p50, p75 = np.percentile(marks_obtained, [25, 50, 75])
+
+    return {
+        'count': count,
+        'mean': mean_marks,
+        'stddev': stddev_marks,
+        'min': stats['min_obtained'],
+        'max': stats['max_obtained'],
+        'p25': p25,
+        'p50': p50,
+        'p75': p75,
+        'max_available': stats['max_available'],
+    }
+
+def _sql_aggregates(test_id):
+    """
+    Aggregate a test's marks inside Postgres with a single query
+
+    Only the resulting numbers are transferred; no result rows are loaded.
+
+    Returns:
+        dict: Raw statistics in marks, or None if the test has no results
+    """
+    marks = TestResult.marks_obtained
+    with phase_timer('aggregate_query'):
+        row = db.session.execute(
+            select(
+                func.count(TestResult.id).label('count'),
+                cast(func.avg(marks), Float).label('mean'),
+                cast(func.stddev_pop(marks), Float).label('stddev'),
+                func.min(marks).label('min'),
+                func.max(marks).label('max'),
+                cast(func.percentile_cont(0.25).within_group(marks), Float).label('p25'),
+                cast(func.percentile_cont(0.5).within_group(marks), Float).label('p50'),
+                cast(func.percentile_cont(0.75).within_group(marks), Float).label('p75'),
+                func.max(TestResult.marks_available).label('max_available'),
+            ).where(TestResult.test_id == test_id)
+        ).one()
+
+    if not row.count:
+        return None
+    return dict(row._mapping)
+
+# Aggregation backends selectable through the AGGREGATION_BACKEND setting
+AGGREGATION_BACKENDS = {
+    'numpy': _numpy_aggregates,
+    'sql': _sql_aggregates,
+}
+
+def calculate_aggregates(test_id, backend=None):
     """
-    Calculate aggregate statistics for a given test       
+    Calculate aggregate statistics for a given test
+
+    The default 'numpy' backend reads the per-test summary statistics & histogram
+    maintained by ingestion, so the cost doesn't grow with the number of students.
+    The 'sql' backend pushes the whole calculation down to Postgres instead.
+
     Returns:
         dict: Dictionary containing aggregate statistics
     """
-    
-    # Get all results for the test ID
-    results = TestResult.find_all_by_test_id(test_id)
+    if backend is None:
+        backend = current_app.config.get('AGGREGATION_BACKEND', 'numpy')
+
+    try:
+        aggregate = AGGREGATION_BACKENDS[backend]
+    except KeyError:
+        raise RuntimeError(f"Unknown aggregation backend: {backend}")
+
+    stats = aggregate(test_id)
 
     # Check if any results were found
-    if not results:
+    if stats is None:
         logger.warning(f"No results found for test ID: {test_id}")
         raise ValueError(f"No results found for test ID: {test_id}")
-    
-    # Extract marks obtained
-    marks_obtained = [result.marks_obtained for result in results]
 
-    # Find the max available marks for this test
-    max_marks_available = max(result.marks_available for result in results)
+    # Check if the max available marks is 0 to avoid division by 0
+    if stats['max_available'] == 0:
+        logger.warning(f"Maximum available marks is zero for test ID: {test_id}")
+        raise ZeroMarksError(f"Maximum available marks is zero for test ID: {test_id}")
+
+    return to_percentages(stats)
+
+def calculate_aggregates_batch(test_ids):
+    """
+    Calculate aggregate statistics for many tests in one round trip
+
+    A single grouped query returns each test's sorted marks, and all tests are
+    then aggregated together in one vectorized NumPy pass. Missing or zero-mark
+    tests get an error entry instead of failing the whole batch.
+
+    Args:
+        test_ids (list): Test IDs to aggregate
+
+    Returns:
+        dict: Aggregate statistics (or an error) keyed by test ID
+    """
+    marks = TestResult.marks_obtained
+    with phase_timer('aggregate_query'):
+        rows = db.session.execute(
+            select(
+                TestResult.test_id,
+                func.array_agg(aggregate_order_by(marks, marks)).label('marks'),
+                func.max(TestResult.marks_available).label('max_available'),
+            ).where(TestResult.test_id.in_(test_ids)).group_by(TestResult.test_id)
+        ).all()
+
+    results = {}
+
+    with phase_timer('aggregate_compute'):
+        if rows:
+            import numpy as np
+
+            # Concatenate every test's sorted marks into one array
+            counts = np.array([len(row.marks) for row in rows], dtype=np.int64)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            sorted_marks = np.concatenate([np.asarray(row.marks, dtype=np.int64) for row in rows])
+
+            # Per-test running sums, turned into means & standard deviations as for one test
+            sums = np.add.reduceat(sorted_marks, starts).tolist()
+            sums_of_squares = np.add.reduceat(sorted_marks * sorted_marks, starts).tolist()
+
+            # Sorted groups give min & max for free
+            minimums = sorted_marks[starts]
+            maximums = sorted_marks[starts + counts - 1]
+            percentiles = grouped_percentiles(sorted_marks, starts, counts, [25, 50, 75])
+
+            for index, row in enumerate(rows):
+                if row.max_available == 0:
+                    continue
+                p25, p50, p75 = percentiles[index].tolist()
+                count = int(counts[index])
+                mean, stddev = _mean_and_stddev(count, sums[index], sums_of_squares[index])
+                results[row.test_id] = to_percentages({
+                    'count': count,
+                    'mean': mean,
+                    'stddev': stddev,
+                    'min': int(minimums[index]),
+                    'max': int(maximums[index]),
+                    'p25': p25,
+                    'p50': p50,
+                    'p75': p75,
+                    'max_available': row.max_available,
+                })
+
+    found_test_ids = {row.test_id for row in rows}
+    aggregates = {}
+
+    for test_id in test_ids:
+        if test_id in results:
+            aggregates[test_id] = results[test_id]
+        elif test_id in found_test_ids:
+            logger.warning(f"Maximum available marks is zero for test ID: {test_id}")
+            aggregates[test_id] = {
+                'error': 'Internal Server Error',
+                'message': f"Maximum available marks is zero for test ID: {test_id}"
+            }
+        else:
+            logger.warning(f"No results found for test ID: {test_id}")
+            aggregates[test_id] = {
+                'error': 'Not Found',
+                'message': f"No results found for test ID: {test_id}"
+            }
+
+    return aggregates
+
+def min_bucket_width():
+    """
+    Narrowest percentage bucket a distribution can be asked for
+
+    Bounds the number of buckets by HISTOGRAM_MAX_MARK, like per-mark counts, so a
+    tiny width can't make a response of millions of buckets.
+    """
+    return 100 / current_app.config.get('HISTOGRAM_MAX_MARK', 10000)
+
+def calculate_distribution(test_id, bucket_width=None):
+    """
+    Count a test's students per mark, or per percentage bucket
+
+    Built with np.bincount from the histogram ingestion keeps (or from per-mark
+    counts of the results), & normalised by the test's max marks available as
+    calculate_aggregates does.
+
+    Args:
+        test_id (str): Test to describe
+        bucket_width (float): Width of each bucket in percent, or None for one count per mark
+
+    Returns:
+        dict: The count, max available & counts (indexed by mark, or one per bucket
+            with the bucket edges in percent)
+
+    Raises:
+        ValueError: If the test has no results
+        ZeroMarksError: If the max available marks is zero
+        ValidationError: If per-mark counts are asked for marks too large to index,
+            or the bucket width is outside min_bucket_width() to 100 percent
+    """
+    import numpy as np
+
+    if bucket_width is not None and not min_bucket_width() <= bucket_width <= 100:
+        raise ValidationError(f"Expected a bucket width between {min_bucket_width():g} and 100 percent")
+
+    with phase_timer('aggregate_query'):
+        stats = _load_statistics(test_id)
+        if stats['count'] and stats['mark_counts'] is None:
+            rows = db.session.execute(
+                select(TestResult.marks_obtained, func.count())
+                .where(TestResult.test_id == test_id)
+                .group_by(TestResult.marks_obtained)
+            ).all()
+
+    if not stats['count']:
+        logger.warning(f"No results found for test ID: {test_id}")
+        raise ValueError(f"No results found for test ID: {test_id}")
 
-    # Check if the max_marks_available is 0 to avoid division by 0
-    if max_marks_available == 0:
+    max_available = stats['max_available']
+    if max_available == 0:
         logger.warning(f"Maximum available marks is zero for test ID: {test_id}")
         raise ZeroMarksError(f"Maximum available marks is zero for test ID: {test_id}")
-    
-    # Calculate the aggregate stats
-    count = len(marks_obtained)
 
-    # Calculate mean & percentiles
-    mean_marks = np.mean(marks_obtained)
-    p25 = np.percentile(marks_obtained, 25)
-    p50 = np.percentile(marks_obtained, 50)
-    p75 = np.percentile(marks_obtained, 75)
+    with phase_timer('aggregate_compute'):
+        # Number of students per distinct mark
+        if stats['mark_counts'] is not None:
+            counts = np.asarray(stats['mark_counts'], dtype=np.int64)
+            marks = np.arange(len(counts))
+        else:
+            marks = np.array([row[0] for row in rows], dtype=np.int64)
+            counts = np.array([row[1] for row in rows], dtype=np.int64)
+
+        distribution = {'test_id': test_id, 'count': stats['count'], 'max_available': max_available}
+
+        if bucket_width is None:
+            top_mark = max(max_available, int(marks.max()) if len(marks) else 0)
+            if top_mark > current_app.config.get('HISTOGRAM_MAX_MARK', 10000):
+                raise ValidationError(f"Marks are too large for a per-mark distribution of test ID: {test_id}; "
+                                      f"ask for percentage buckets instead")
+            distribution['counts'] = np.bincount(marks, weights=counts, minlength=top_mark + 1) \
+                .astype(np.int64).tolist()
+            return distribution
+
+        # Bucket by percentage of the max available; 100% falls in the last bucket
+        bucket_count = int(np.ceil(100 / bucket_width))
+        buckets = np.minimum(np.floor(marks * 100 / (max_available * bucket_width)).astype(np.int64),
+                             bucket_count - 1)
+        distribution['bucket_width'] = bucket_width
+        distribution['edges'] = np.minimum(np.arange(bucket_count + 1) * bucket_width, 100).tolist()
+        distribution['counts'] = np.bincount(buckets, weights=counts, minlength=bucket_count) \
+            .astype(np.int64).tolist()
+
+    return distribution
+
+def _load_rollup_histograms(test_ids):
+    """
+    Load the mark histogram & max available of each test
+
+    Histograms come from the summary statistics. Tests without one (very large
+    marks, or no summary row yet) are counted per mark from their results in a
+    single grouped query, which the covering test_id index answers.
+
+    Returns:
+        dict: (marks, counts, max_available) keyed by test ID, for tests with results
+    """
+    import numpy as np
+
+    histograms = {}
+    for stats in TestStatistics.query.filter(TestStatistics.test_id.in_(test_ids)):
+        if stats.count and stats.mark_counts is not None:
+            counts = np.asarray(stats.mark_counts, dtype=np.int64)
+            histograms[stats.test_id] = (np.arange(len(counts)), counts, stats.max_available)
+
+    remaining = [test_id for test_id in test_ids if test_id not in histograms]
+    if remaining:
+        rows = db.session.execute(
+            select(TestResult.test_id, TestResult.marks_obtained, func.count(),
+                   func.max(TestResult.marks_available))
+            .where(TestResult.test_id.in_(remaining))
+            .group_by(TestResult.test_id, TestResult.marks_obtained)
+        ).all()
+        marks, counts, max_available = {}, {}, {}
+        for test_id, mark, count, available in rows:
+            marks.setdefault(test_id, []).append(mark)
+            counts.setdefault(test_id, []).append(count)
+            max_available[test_id] = max(max_available.get(test_id, 0), available)
+        for test_id in marks:
+            histograms[test_id] = (np.asarray(marks[test_id], dtype=np.int64),
+                                   np.asarray(counts[test_id], dtype=np.int64), max_available[test_id])
+
+    return histograms
+
+def calculate_rollup(test_ids):
+    """
+    Calculate aggregate statistics over the students of many tests together
+
+    Each test's per-mark histogram is converted to percentages of that test's
+    marks available, & the histograms are merged. Percentiles of the merged
+    histogram are exactly those np.percentile gives over every student's
+    percentage, so the result has no approximation error. The cost grows with the
+    number of tests & distinct marks, not with the number of students.
+
+    Args:
+        test_ids (list): Test IDs to roll up
+
+    Returns:
+        dict: Aggregate statistics over all included tests, the tests left out &
+            the error bound of the percentiles
+
+    Raises:
+        ValueError: If none of the tests has results with marks available
+    """
+    import numpy as np
+
+    with phase_timer('aggregate_query'):
+        histograms = _load_rollup_histograms(test_ids)
+
+    with phase_timer('aggregate_compute'):
+        included = [test_id for test_id in test_ids
+                    if test_id in histograms and histograms[test_id][2] > 0]
+        if not included:
+            logger.warning(f"No results found for any of {len(test_ids)} test IDs")
+            raise ValueError("No results found for the requested test IDs")
+
+        # Every test's marks as percentages, weighted by the number of students
+        values = np.concatenate([histograms[test_id][0] * (100.0 / histograms[test_id][2])
+                                 for test_id in included])
+        counts = np.concatenate([histograms[test_id][1] for test_id in included])
+        values, counts = values[counts > 0], counts[counts > 0]
+
+        count = int(counts.sum())
+        mean = float(np.dot(values, counts) / count)
+        stddev = float(np.sqrt(np.dot((values - mean) ** 2, counts) / count))
+        p25, p50, p75 = weighted_percentiles(values, counts, [25, 50, 75]).tolist()
+
+    return {
+        'mean': mean,
+        'stddev': stddev,
+        'count': count,
+        'p25': p25,
+        'p50': p50,
+        'p75': p75,
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'tests': len(included),
+        'missing': [test_id for test_id in test_ids if test_id not in histograms],
+        'zero_marks_available': [test_id for test_id in test_ids
+                                 if test_id in histograms and histograms[test_id][2] <= 0],
+        # Merging histograms loses nothing, unlike a KLL or t-digest sketch
+        'error_bound': {'rank': 0, 'value': 0.0, 'method': 'exact merge of per-test mark histograms'},
+    }
 
-    # calculate the min & max
-    min_marks = np.min(marks_obtained)
-    max_marks = np.max(marks_obtained)
+def get_aggregate_validators(test_id):
+    """
+    Look up what identifies the current state of a test's aggregates
+
+    A single primary key read; no aggregation is run.
+
+    Returns:
+        tuple: (version, last_modified), or None if the test has no summary statistics yet
+    """
+    stats = TestStatistics.find_by_test_id(test_id)
+    if stats is None or not stats.count:
+        return None
+    return stats.version, stats.updated_at
+
+def to_percentages(stats):
+    """
+    Convert raw statistics in marks to the percentages returned by the API
+
+    Args:
+        stats (dict): count, mean, stddev, min, max, p25, p50, p75 & a non-zero max_available
+
+    Returns:
+        dict: Dictionary containing aggregate statistics
+    """
+    max_marks_available = stats['max_available']
 
     # Convert to percentages
-    mean_percent = (mean_marks / max_marks_available) * 100.0
-    p25_percent = (p25 / max_marks_available) * 100.0
-    p50_percent = (p50 / max_marks_available) * 100.0
-    p75_percent = (p75 / max_marks_available) * 100.0
-    min_percent = (min_marks / max_marks_available) * 100.0
-    max_percent = (max_marks / max_marks_available) * 100.0
+    mean_percent = (stats['mean'] / max_marks_available) * 100.0
+    stddev_percent = (stats['stddev'] / max_marks_available) * 100.0
+    p25_percent = (stats['p25'] / max_marks_available) * 100.0
+    p50_percent = (stats['p50'] / max_marks_available) * 100.0
+    p75_percent = (stats['p75'] / max_marks_available) * 100.0
+    min_percent = (stats['min'] / max_marks_available) * 100.0
+    max_percent = (stats['max'] / max_marks_available) * 100.0
 
     # Return the aggregate stats
     return {
         "mean": mean_percent,
-        "count": count,
+        "stddev": stddev_percent,
+        "count": stats['count'],
         "p25": p25_percent,
         "p50": p50_percent,
         "p75": p75_percent,
         "min": min_percent,
         "max": max_percent,
     }
-
-
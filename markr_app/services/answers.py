@@ -0,0 +1,130 @@
+import logging
+import struct
+from sqlalchemy import select
+from markr_app.database import db
+from markr_app.models import TestResult
+from markr_app.utils.metrics import phase_timer
+
+logger = logging.getLogger(__name__)
+
+# NumPy is imported lazily, as in services.statistics
+
+# A result's answers are stored in one bytea value: a little-endian int32
+# (question, marks available, marks awarded) triple per answer, in document order.
+# 20 answers take 240 bytes, instead of 20 rows of their own.
+ANSWER_FIELDS = 3
+ANSWER_BYTES = ANSWER_FIELDS * 4
+
+def pack_answers(answers):
+    """
+    Pack a result's answers into the bytes stored in test_results.answers
+
+    Args:
+        answers (list): (question, marks_available, marks_awarded) integer tuples
+
+    Returns:
+        bytes: The packed answers
+
+    Raises:
+        struct.error: If a value doesn't fit in 32 bits
+    """
+    values = [value for answer in answers for value in answer]
+    return struct.pack(f"<{len(values)}i", *values)
+
+def unpack_answers(packed):
+    """
+    Unpack stored answers
+
+    Returns:
+        numpy.ndarray: answers x (question, marks_available, marks_awarded)
+    """
+    import numpy as np
+    return np.frombuffer(packed, dtype='<i4').reshape(-1, ANSWER_FIELDS)
+
+def compute_item_analysis(packed_answers):
+    """
+    Compute per-question statistics over a students x questions matrix
+
+    Difficulty is the mean fraction of a question's marks awarded (the classical
+    p-value, so higher means easier). Discrimination is the correlation between
+    the marks awarded for a question & each student's total over the other
+    questions (the corrected item-total correlation). A question a student didn't
+    answer counts as zero marks awarded.
+
+    Args:
+        packed_answers (list): Packed answers, one bytes value per student
+
+    Returns:
+        list: One dict per question, in question order
+    """
+    import numpy as np
+
+    # Every student's answers in one array, & the student each answer belongs to
+    lengths = np.fromiter((len(packed) // ANSWER_BYTES for packed in packed_answers),
+                          dtype=np.int64, count=len(packed_answers))
+    answers = unpack_answers(b''.join(packed_answers))
+    students = np.repeat(np.arange(len(packed_answers)), lengths)
+
+    # One column per distinct question number
+    questions, columns = np.unique(answers[:, 0], return_inverse=True)
+    awarded = np.zeros((len(packed_answers), len(questions)), dtype=np.float64)
+    awarded[students, columns] = answers[:, 2]
+    answered = np.bincount(columns, minlength=len(questions))
+    available = np.zeros(len(questions), dtype=np.int64)
+    np.maximum.at(available, columns, answers[:, 1])
+
+    mean_awarded = awarded.mean(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        difficulty = mean_awarded / available
+
+        # Correlate each question with the rest of the test, all columns at once
+        rest = awarded.sum(axis=1, keepdims=True) - awarded
+        item_deviations = awarded - mean_awarded
+        rest_deviations = rest - rest.mean(axis=0)
+        covariance = (item_deviations * rest_deviations).sum(axis=0)
+        spread = np.sqrt((item_deviations ** 2).sum(axis=0) * (rest_deviations ** 2).sum(axis=0))
+        discrimination = covariance / spread
+
+    # Undefined values (no marks available, or no variation) are reported as null
+    return [
+        {
+            'question': int(questions[index]),
+            'marks_available': int(available[index]),
+            'answered': int(answered[index]),
+            'mean_awarded': float(mean_awarded[index]),
+            'difficulty': float(difficulty[index]) if np.isfinite(difficulty[index]) else None,
+            'discrimination': float(discrimination[index]) if np.isfinite(discrimination[index]) else None,
+        }
+        for index in range(len(questions))
+    ]
+
+def calculate_item_analysis(test_id):
+    """
+    Calculate per-question difficulty & discrimination for a test
+
+    Only results imported with their answers are included.
+
+    Returns:
+        dict: The test ID, number of students analysed & per-question statistics
+
+    Raises:
+        ValueError: If no results with answers exist for the test
+    """
+    with phase_timer('aggregate_query'):
+        packed_answers = db.session.scalars(
+            select(TestResult.answers)
+            .where(TestResult.test_id == test_id, TestResult.answers.is_not(None))
+        ).all()
+
+    if not packed_answers:
+        logger.warning(f"No answers found for test ID: {test_id}")
+        raise ValueError(f"No answers found for test ID: {test_id}")
+
+    with phase_timer('aggregate_compute'):
+        questions = compute_item_analysis(packed_answers)
+
+    return {
+        'test_id': test_id,
+        'count': len(packed_answers),
+        'questions': questions,
+    }
@@ -0,0 +1,219 @@
+from collections import OrderedDict
+import logging
+import select
+import threading
+import time
+from flask import current_app
+from sqlalchemy import text
+from markr_app.database import db
+
+logger = logging.getLogger(__name__)
+
+# Postgres channel used to tell every worker which tests changed
+INVALIDATION_CHANNEL = 'markr_aggregates'
+
+class _Flight:
+    """A computation in progress that concurrent misses can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class AggregateCache:
+    """
+    Bounded LRU cache of serialized aggregate responses (body & validators)
+
+    Entries are keyed by test ID plus the test's change version, so a new import
+    makes older entries unreachable. Concurrent misses for the same key wait on a
+    single computation instead of all hitting the database.
+    """
+
+    def __init__(self, max_entries, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def version(self, test_id):
+        """Latest change version this process has seen for a test"""
+        with self._lock:
+            return self._versions.get(test_id, 0)
+
+    def peek(self, test_id, namespace='aggregate'):
+        """Return the cached value for a test without computing it on a miss"""
+        with self._lock:
+            key = (namespace, test_id, self._versions.get(test_id, 0))
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry):
+                return None
+            return entry[0]
+
+    def get_or_compute(self, test_id, compute, namespace='aggregate'):
+        """
+        Return the cached bytes for a test, computing them at most once on a miss
+
+        Args:
+            test_id (str): Test the response belongs to
+            compute (callable): Returns the serialized response to store
+            namespace (str): Separates different responses cached for the same test
+
+        Raises:
+            Exception: Whatever compute raised; errors are never cached
+        """
+        with self._lock:
+            key = (namespace, test_id, self._versions.get(test_id, 0))
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry):
+                self._entries.move_to_end(key)
+                return entry[0]
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+                # Only store the result if no import landed while computing it
+                if flight.error is None and key[2] == self._versions.get(test_id, 0):
+                    self._entries[key] = (flight.value, time.monotonic())
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            flight.done.set()
+
+        return flight.value
+
+    def invalidate(self, test_id, version=None):
+        """Move a test to a newer version, dropping its cached entries"""
+        with self._lock:
+            current = self._versions.get(test_id, 0)
+            if version is None:
+                version = current + 1
+            if version <= current:
+                return
+            self._versions[test_id] = version
+            for key in [key for key in self._entries if key[1] == test_id]:
+                del self._entries[key]
+
+    def clear(self):
+        """Drop every cached entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def _expired(self, entry):
+        return self.ttl is not None and time.monotonic() - entry[1] > self.ttl
+
+class InvalidationListener(threading.Thread):
+    """Background thread that LISTENs for aggregate invalidations from other workers"""
+
+    def __init__(self, url, cache, poll_interval=5.0):
+        super().__init__(name='markr-aggregate-invalidation', daemon=True)
+        self.url = url
+        self.cache = cache
+        self.poll_interval = poll_interval
+
+    def run(self):
+        import psycopg2
+
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.url)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {INVALIDATION_CHANNEL}")
+
+                # Anything may have changed while we weren't listening
+                self.cache.clear()
+                logger.info("Listening for aggregate invalidations")
+
+                while True:
+                    if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        test_id, _, version = notify.payload.rpartition(':')
+                        self.cache.invalidate(test_id, int(version))
+            except Exception as e:
+                logger.error(f"Aggregate invalidation listener failed: {str(e)}")
+                self.cache.clear()
+            finally:
+                # Don't leak the failed connection before reconnecting
+                if conn is not None:
+                    conn.close()
+            time.sleep(self.poll_interval)
+
+# Guards creation of the per-app cache & its listener thread
+_setup_lock = threading.Lock()
+
+def get_aggregate_cache(app=None):
+    """
+    Return the app's aggregate cache, creating it on first use
+
+    The LISTEN thread is started lazily so it runs in each worker process rather
+    than in a pre-forking master.
+
+    Returns:
+        AggregateCache: The cache, or None if caching is disabled
+    """
+    app = app or current_app._get_current_object()
+    max_entries = app.config.get('AGGREGATE_CACHE_SIZE', 0)
+    if not max_entries:
+        return None
+
+    cache = app.extensions.get('markr_aggregate_cache')
+    if cache is not None:
+        return cache
+
+    with _setup_lock:
+        cache = app.extensions.get('markr_aggregate_cache')
+        if cache is None:
+            cache = AggregateCache(max_entries, app.config.get('AGGREGATE_CACHE_TTL'))
+            if app.config.get('AGGREGATE_CACHE_LISTEN', False):
+                url = db.engine.url.render_as_string(hide_password=False)
+                InvalidationListener(url, cache).start()
+            app.extensions['markr_aggregate_cache'] = cache
+    return cache
+
+def notify_aggregates_changed(versions):
+    """
+    Queue invalidation notifications for the tests an import changed
+
+    Uses pg_notify inside the current transaction, so other workers are only told
+    once the import commits.
+
+    Args:
+        versions (dict): New change version keyed by test ID
+    """
+    if not versions:
+        return
+    db.session.execute(
+        text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload"),
+        {'channel': INVALIDATION_CHANNEL,
+         'payloads': [f"{test_id}:{version}" for test_id, version in versions.items()]}
+    )
+
+def invalidate_aggregates(versions):
+    """Drop this process's cached aggregates for the tests an import changed"""
+    cache = get_aggregate_cache()
+    if cache is None:
+        return
+    for test_id, version in versions.items():
+        cache.invalidate(test_id, version)
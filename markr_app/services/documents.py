@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta, timezone
+import hashlib
+import logging
+from sqlalchemy import case, delete, or_, update
+from sqlalchemy.dialects.postgresql import insert
+from markr_app.database import db
+from markr_app.models import ImportDocument
+
+logger = logging.getLogger(__name__)
+
+def document_digest(document):
+    """Hex SHA-256 digest of a decompressed import document"""
+    return hashlib.sha256(document).hexdigest()
+
+def find_imported_document(digest=None, idempotency_key=None):
+    """
+    Find an accepted import document through its digest or idempotency key
+
+    When both match different documents, the one sent with the idempotency key
+    wins.
+
+    Returns:
+        ImportDocument: The document, or None if neither has been seen
+    """
+    conditions = []
+    if digest is not None:
+        conditions.append(ImportDocument.digest == digest)
+    if idempotency_key is not None:
+        conditions.append(ImportDocument.idempotency_key == idempotency_key)
+    if not conditions:
+        return None
+
+    query = ImportDocument.query.filter(or_(*conditions))
+    if idempotency_key is not None:
+        query = query.order_by(case((ImportDocument.idempotency_key == idempotency_key, 0), else_=1))
+    return query.first()
+
+def claim_document(digest, idempotency_key=None, job_id=None):
+    """
+    Record an import document in the current transaction, unless it was already accepted
+
+    The row is inserted with ON CONFLICT DO NOTHING, so when an identical document
+    is being imported concurrently this waits for that import to commit (or roll
+    back) and then finds its document. Commit the claim with the import, so a
+    rejected document isn't remembered.
+
+    Args:
+        digest (str): Hex SHA-256 digest of the document
+        idempotency_key (str): Idempotency-Key header of the request, if any
+        job_id (int): Job the document was queued as, for asynchronous imports
+
+    Returns:
+        ImportDocument: The earlier document, or None if this one was recorded
+    """
+    stmt = insert(ImportDocument.__table__).values(
+        digest=digest,
+        idempotency_key=idempotency_key,
+        job_id=job_id,
+        created_at=datetime.now(timezone.utc),
+    ).on_conflict_do_nothing().returning(ImportDocument.digest)
+
+    if db.session.execute(stmt).first() is not None:
+        return None
+    return find_imported_document(digest, idempotency_key)
+
+def record_processed_count(digest, processed_count):
+    """Store the number of results a claimed document's import wrote"""
+    db.session.execute(
+        update(ImportDocument).where(ImportDocument.digest == digest).values(processed_count=processed_count)
+    )
+
+def release_job_document(job_id):
+    """
+    Forget the document of a job that was rejected or given up on, in the current transaction
+
+    Only accepted documents are remembered, so resending the document queues it again.
+    """
+    db.session.execute(delete(ImportDocument).where(ImportDocument.job_id == job_id))
+
+def prune_import_documents(older_than_days):
+    """
+    Forget the documents accepted more than older_than_days ago
+
+    A pruned document sent again is imported again, which changes nothing.
+
+    Returns:
+        int: Number of documents forgotten
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    try:
+        pruned = db.session.execute(
+            delete(ImportDocument).where(ImportDocument.created_at < cutoff)
+        ).rowcount
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    logger.info(f"Pruned {pruned} import documents older than {older_than_days} days")
+    return pruned
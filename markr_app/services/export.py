@@ -0,0 +1,81 @@
+import csv
+import io
+import json
+from sqlalchemy import select
+from markr_app.database import db
+from markr_app.models import TestResult
+
+# Default number of results read per keyset page
+DEFAULT_PAGE_SIZE = 5000
+
+# Columns of an exported result, in CSV column order
+EXPORT_COLUMNS = ('id', 'student_number', 'test_id', 'first_name', 'last_name',
+                  'marks_obtained', 'marks_available', 'scanned_at', 'updated_at')
+
+# Formats the export can be written in, & their media types
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+def iter_result_pages(test_id=None, scanned_from=None, scanned_to=None, after_id=0, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Read matching results in id order, one bounded page at a time
+
+    Each page is a separate keyset query (id > last id seen), so memory use is
+    set by the page size & no transaction or cursor stays open while a slow
+    client reads: the connection goes back to the pool between pages. Results
+    written during the export may or may not be included.
+
+    Args:
+        test_id (str): Only results of this test
+        scanned_from (datetime): Only results scanned at or after this time
+        scanned_to (datetime): Only results scanned before this time
+        after_id (int): Resume after this result ID
+        page_size (int): Results per page
+
+    Yields:
+        list: Rows with the EXPORT_COLUMNS, never empty
+    """
+    table = TestResult.__table__
+    query = select(*[table.c[column] for column in EXPORT_COLUMNS])
+    if test_id is not None:
+        query = query.where(table.c.test_id == test_id)
+    if scanned_from is not None:
+        query = query.where(table.c.scanned_at >= scanned_from)
+    if scanned_to is not None:
+        query = query.where(table.c.scanned_at < scanned_to)
+
+    last_id = after_id
+    while True:
+        rows = db.session.execute(
+            query.where(table.c.id > last_id).order_by(table.c.id).limit(page_size)
+        ).all()
+        # End the read transaction so the connection isn't held while the page is sent
+        db.session.rollback()
+
+        if not rows:
+            return
+        yield rows
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1].id
+
+def _export_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+def format_ndjson(rows):
+    """Format a page of results as newline-delimited JSON objects"""
+    return ''.join(
+        json.dumps({column: _export_value(value) for column, value in zip(EXPORT_COLUMNS, row)}) + '\n'
+        for row in rows
+    )
+
+def format_csv(rows, header=False):
+    """Format a page of results as CSV lines, optionally preceded by the header line"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows([_export_value(value) for value in row] for row in rows)
+    return buffer.getvalue()
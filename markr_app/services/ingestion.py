@@ -1,71 +1,314 @@
 from datetime import datetime, timezone
 import logging
+import random
+import time
+from flask import current_app
+from sqlalchemy import and_, case, func, literal_column, or_, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
 from markr_app.database import db
 from markr_app.models import TestResult
-from markr_app.services.xml_parser import parse_test_results
-from markr_app.utils.errors import ValidationError
+from markr_app.services.cache import invalidate_aggregates, notify_aggregates_changed
+from markr_app.services.documents import claim_document, record_processed_count
+from markr_app.services.statistics import StatisticsDelta, apply_statistics_delta
+from markr_app.services.xml_parser import iter_test_results
+from markr_app.utils.errors import DuplicateDocumentError, ValidationError
+from markr_app.utils.metrics import IMPORTS, phase_timer, record_import_rows, record_phase
 
 logger = logging.getLogger(__name__)
 
-def process_test_results(xml_content):
+# Default number of rows written per INSERT ... ON CONFLICT statement
+DEFAULT_BATCH_SIZE = 1000
+
+def _merge_result(merged, result_data):
+    """
+    Merge a single parsed result into a dict keyed by (student_number, test_id)
+
+    The record with the highest marks obtained is kept, along with the highest
+    marks available seen for that student & test.
+    """
+    key = (result_data['student_number'], result_data['test_id'])
+    existing = merged.get(key)
+
+    if existing is None:
+        merged[key] = dict(result_data)
+        return
+
+    marks_available = max(existing['marks_available'], result_data['marks_available'])
+
+    # A rescan only replaces the earlier record if it scored higher
+    if result_data['marks_obtained'] > existing['marks_obtained']:
+        existing.update(result_data)
+    existing['marks_available'] = marks_available
+
+def _row_logging():
+    """
+    Decide how per-row import events are logged
+
+    Every row is logged at DEBUG. Otherwise a LOG_ROW_SAMPLE_RATE fraction of rows
+    is logged at INFO, and with the default rate of 0 no per-row work is done.
+
+    Returns:
+        tuple: (level, sample rate), or None when per-row events are off
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        return logging.DEBUG, 1.0
+    sample_rate = current_app.config.get('LOG_ROW_SAMPLE_RATE', 0.0)
+    if sample_rate > 0 and logger.isEnabledFor(logging.INFO):
+        return logging.INFO, sample_rate
+    return None
+
+def _log_rows(batch, outcomes, level, sample_rate):
+    """Log what happened to (a sample of) the rows in a batch"""
+    for result_data in batch:
+        if sample_rate < 1.0 and random.random() >= sample_rate:
+            continue
+        key = (result_data['student_number'], result_data['test_id'])
+        outcome = outcomes.get(key, 'skipped')
+        logger.log(level, f"{outcome.capitalize()} result for student {key[0]}, test {key[1]}", extra={
+            'event': 'import_row',
+            'outcome': outcome,
+            'student_number': key[0],
+            'test_id': key[1],
+            'marks_obtained': result_data['marks_obtained'],
+            'sample_rate': sample_rate,
+        })
+
+def _upsert_batch(batch, now, delta):
+    """
+    Write a batch of merged results with a single INSERT ... ON CONFLICT statement
+
+    The stored scores being replaced are read (and locked) first, so the changes
+    to each test's summary statistics can be recorded in the delta.
+
+    Returns:
+        tuple: (inserted_count, updated_count)
+    """
+    table = TestResult.__table__
+
+    # Lock the existing rows for this batch & remember their scores
+    keys = [(result_data['student_number'], result_data['test_id']) for result_data in batch]
+    existing_marks = {
+        (row.student_number, row.test_id): row.marks_obtained
+        for row in db.session.execute(
+            select(table.c.student_number, table.c.test_id, table.c.marks_obtained)
+            .where(tuple_(table.c.student_number, table.c.test_id).in_(keys))
+            .with_for_update()
+        )
+    }
+
+    stmt = insert(table).values([
+        {
+            'student_number': result_data['student_number'],
+            'test_id': result_data['test_id'],
+            'first_name': result_data['first_name'],
+            'last_name': result_data['last_name'],
+            'marks_obtained': result_data['marks_obtained'],
+            'marks_available': result_data['marks_available'],
+            'scanned_at': result_data['scanned_at'],
+            'answers': result_data.get('answers'),
+            'created_at': now,
+            'updated_at': now,
+        }
+        for result_data in batch
+    ])
+    excluded = stmt.excluded
+
+    # The incoming row only replaces the stored details if it scored higher
+    is_higher = excluded.marks_obtained > table.c.marks_obtained
+    # A re-import of the same score can add answers to a row stored without them
+    adds_answers = and_(table.c.answers.is_(None), excluded.answers.is_not(None),
+                        excluded.marks_obtained == table.c.marks_obtained)
+
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['student_number', 'test_id'],
+        set_={
+            'first_name': case((is_higher, excluded.first_name), else_=table.c.first_name),
+            'last_name': case((is_higher, excluded.last_name), else_=table.c.last_name),
+            'scanned_at': case((is_higher, excluded.scanned_at), else_=table.c.scanned_at),
+            # Answers follow the scan they came from, or fill in a row stored without them
+            'answers': case((is_higher, excluded.answers), (adds_answers, excluded.answers),
+                            else_=table.c.answers),
+            'marks_obtained': func.greatest(table.c.marks_obtained, excluded.marks_obtained),
+            'marks_available': func.greatest(table.c.marks_available, excluded.marks_available),
+            'updated_at': excluded.updated_at,
+        },
+        # Leave rows untouched when neither score improves & there are no answers to add
+        where=or_(is_higher, excluded.marks_available > table.c.marks_available, adds_answers),
+    ).returning(
+        table.c.student_number,
+        table.c.test_id,
+        table.c.marks_obtained,
+        table.c.marks_available,
+        literal_column('(xmax = 0)').label('inserted'),
+    )
+
+    inserted_count = 0
+    updated_count = 0
+    row_logging = _row_logging()
+    outcomes = {}
+
+    for row in db.session.execute(stmt):
+        key = (row.student_number, row.test_id)
+        if row_logging is not None:
+            outcomes[key] = 'inserted' if row.inserted else 'updated'
+
+        if row.inserted:
+            delta.add(row.test_id, row.marks_obtained, row.marks_available)
+            inserted_count += 1
+            continue
+
+        updated_count += 1
+        if key in existing_marks:
+            delta.replace(row.test_id, existing_marks[key], row.marks_obtained, row.marks_available)
+        else:
+            # Row was inserted by a concurrent import after our lookup
+            delta.mark_stale(row.test_id)
+
+    if row_logging is not None:
+        _log_rows(batch, outcomes, *row_logging)
+
+    return inserted_count, updated_count
+
+def ingest_test_results(xml_content):
+    """
+    Write the test results from XML content into the current transaction
+
+    Results are streamed out of the parser and upserted in bounded-size batches,
+    with duplicates merged in memory within each batch. The per-test summary
+    statistics are updated alongside them. Nothing is committed, so the caller
+    decides whether the whole document is kept.
+
+    Args:
+        xml_content (str, bytes or file-like): XML document to import
+
+    Returns:
+        dict: Counts of parsed, inserted, updated & skipped results, plus the new
+            change version of every touched test
+
+    Raises:
+        ValidationError: If XML content is invalid
+    """
+    batch_size = current_app.config.get('IMPORT_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    verify_summary_marks = current_app.config.get('IMPORT_VERIFY_SUMMARY_MARKS', False)
+    now = datetime.now(timezone.utc)
+    merged = {}
+    delta = StatisticsDelta()
+    parsed_count = 0
+    inserted_count = 0
+    updated_count = 0
+    upsert_seconds = 0.0
+
+    # Parsing is timed by the parser itself, as it's interleaved with the writes
+    for result_data in iter_test_results(xml_content, verify_summary_marks=verify_summary_marks):
+        parsed_count += 1
+        _merge_result(merged, result_data)
+
+        # Flush once the batch is full. Duplicates spanning batches are
+        # resolved by the ON CONFLICT clause within the same transaction.
+        if len(merged) >= batch_size:
+            start = time.perf_counter()
+            batch_inserted, batch_updated = _upsert_batch(list(merged.values()), now, delta)
+            upsert_seconds += time.perf_counter() - start
+            inserted_count += batch_inserted
+            updated_count += batch_updated
+            merged.clear()
+
+    if merged:
+        start = time.perf_counter()
+        batch_inserted, batch_updated = _upsert_batch(list(merged.values()), now, delta)
+        upsert_seconds += time.perf_counter() - start
+        inserted_count += batch_inserted
+        updated_count += batch_updated
+
+    record_phase('upsert', upsert_seconds)
+
+    with phase_timer('statistics'):
+        # Keep the per-test summary statistics in step with the results
+        versions = apply_statistics_delta(delta, updated_at=now)
+
+        # Tell other workers which cached aggregates are stale once we commit
+        notify_aggregates_changed(versions)
+
+    return {
+        'parsed': parsed_count,
+        'inserted': inserted_count,
+        'updated': updated_count,
+        'skipped': parsed_count - inserted_count - updated_count,
+        'versions': versions,
+    }
+
+def log_import_summary(summary, seconds, message, **fields):
+    """Log one structured event summarizing a whole imported document"""
+    logger.info(f"{message} (inserted={summary['inserted']}, updated={summary['updated']}, "
+                f"skipped={summary['skipped']}, {seconds * 1000:.1f} ms)", extra={
+        'event': 'import_summary',
+        'parsed': summary['parsed'],
+        'inserted': summary['inserted'],
+        'updated': summary['updated'],
+        'skipped': summary['skipped'],
+        'tests': len(summary['versions']),
+        'duration_ms': round(seconds * 1000, 1),
+        **fields,
+    })
+
+def process_test_results(xml_content, digest=None, idempotency_key=None):
     """
     Process test results from XML content
-            
+
+    The whole document is written in a single transaction, so a bad record
+    anywhere in the document rejects the whole document. Given its digest, the
+    document is recorded in the same transaction, & a document that was already
+    accepted isn't parsed at all.
+
+    Args:
+        xml_content (str, bytes or file-like): XML document to import
+        digest (str): Hex SHA-256 digest of the document, to deduplicate it
+        idempotency_key (str): Idempotency-Key header the document was sent with
+
+    Returns:
+        int: Number of results inserted or updated
+
     Raises:
+        DuplicateDocumentError: If the document was already accepted
         ValidationError: If XML content is invalid or processing fails
     """
-    # Parse XML to extract test results
-    parsed_results = parse_test_results(xml_content)
-    
-    # Track how many results were processed
-    processed_count = 0
-    
+    started = time.perf_counter()
+
     try:
-        # Process each result
-        for result_data in parsed_results:
-            student_number = result_data['student_number']
-            test_id = result_data['test_id']
-            
-            # Check if result already exists
-            existing_result = TestResult.find_by_student_and_test(student_number, test_id)
-            
-            if existing_result and hasattr(existing_result, 'marks_obtained'):
-                # If the new result has a higher score, update the existing record
-                if result_data['marks_obtained'] > existing_result.marks_obtained:
-                    existing_result.first_name = result_data['first_name']
-                    existing_result.last_name = result_data['last_name']
-                    existing_result.marks_obtained = result_data['marks_obtained']
-                    existing_result.marks_available = max(existing_result.marks_available, result_data['marks_available'])
-                    existing_result.scanned_at = result_data['scanned_at']
-                    existing_result.updated_at = datetime.now(timezone.utc)
-                    logger.info(f"Updated result for student {student_number}, test {test_id}")
-                    processed_count += 1
-                else:
-                    logger.info(f"Skipped result for student {student_number}, test {test_id}: existing score is higher")
-            else:
-                # Create a new result record
-                new_result = TestResult(
-                    student_number=student_number,
-                    test_id=test_id,
-                    first_name=result_data['first_name'],
-                    last_name=result_data['last_name'],
-                    marks_obtained=result_data['marks_obtained'],
-                    marks_available=result_data['marks_available'],
-                    scanned_at=result_data['scanned_at']
-                )
-                db.session.add(new_result)
-                logger.info(f"Inserted new result for student {student_number}, test {test_id}")
-                processed_count += 1
-        
+        # Claim the document before parsing it: a concurrent import of the same
+        # document holds the claim until it commits, & this one then backs off
+        original = claim_document(digest, idempotency_key) if digest is not None else None
+        if original is not None:
+            db.session.rollback()
+            IMPORTS.inc(outcome='duplicate')
+            logger.info(f"Skipped a duplicate of import document {original.digest}")
+            raise DuplicateDocumentError(original)
+
+        summary = ingest_test_results(xml_content)
+        processed_count = summary['inserted'] + summary['updated']
+        if digest is not None:
+            record_processed_count(digest, processed_count)
+
         # Commit all changes in a single transaction
-        db.session.commit()
-        logger.info(f"Successfully processed {processed_count} test results")
-        return processed_count
-        
+        with phase_timer('commit'):
+            db.session.commit()
+
+    except DuplicateDocumentError:
+        raise
     except Exception as e:
         # Roll back transaction on error
         db.session.rollback()
         logger.error(f"Error processing test results: {str(e)}")
         if isinstance(e, ValidationError):
+            IMPORTS.inc(outcome='rejected')
             raise
-        raise ValidationError(f"Failed to process test results: {str(e)}")
\ No newline at end of file
+        IMPORTS.inc(outcome='failed')
+        raise ValidationError(f"Failed to process test results: {str(e)}")
+
+    IMPORTS.inc(outcome='completed')
+    record_import_rows(summary)
+    invalidate_aggregates(summary['versions'])
+
+    log_import_summary(summary, time.perf_counter() - started,
+                       f"Successfully processed {processed_count} test results")
+    return processed_count
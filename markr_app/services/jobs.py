@@ -0,0 +1,197 @@
+import logging
+import threading
+import time
+from sqlalchemy import case, update
+from sqlalchemy.exc import DataError, IntegrityError
+from markr_app.database import db
+from markr_app.models import ImportJob
+from markr_app.services.cache import invalidate_aggregates
+from markr_app.services.documents import claim_document, release_job_document
+from markr_app.services.ingestion import ingest_test_results, log_import_summary
+from markr_app.utils.errors import DuplicateDocumentError, ValidationError
+from markr_app.utils.metrics import IMPORTS, phase_timer, record_import_rows
+
+logger = logging.getLogger(__name__)
+
+# Jobs failing this many times for reasons other than validation are given up on
+DEFAULT_MAX_ATTEMPTS = 5
+
+def enqueue_import(xml_content, digest=None, idempotency_key=None):
+    """
+    Durably queue an XML document for a background worker to import
+
+    Given its digest, the document is recorded along with the job, & a document
+    that was already accepted isn't queued again.
+
+    Args:
+        xml_content (bytes): XML document to import
+        digest (str): Hex SHA-256 digest of the document, to deduplicate it
+        idempotency_key (str): Idempotency-Key header the document was sent with
+
+    Returns:
+        ImportJob: The committed, pending job
+
+    Raises:
+        DuplicateDocumentError: If the document was already accepted
+    """
+    job = ImportJob(document=bytes(xml_content))
+    db.session.add(job)
+    if digest is not None:
+        # The job's ID is recorded with the document
+        db.session.flush()
+        original = claim_document(digest, idempotency_key, job_id=job.id)
+        if original is not None:
+            db.session.rollback()
+            IMPORTS.inc(outcome='duplicate')
+            logger.info(f"Skipped a duplicate of import document {original.digest}")
+            raise DuplicateDocumentError(original)
+    db.session.commit()
+    logger.info(f"Queued import job {job.id} ({len(job.document)} bytes)")
+    return job
+
+def process_next_import_job(max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Claim the oldest pending import job & run it
+
+    The attempt is counted & committed when the job is claimed, so a document that
+    kills the worker still uses up its attempts. The job row is then locked again
+    with SELECT ... FOR UPDATE SKIP LOCKED for the whole import, and the results
+    are committed in the same transaction as the job's new status. If the worker
+    dies part way through, the transaction is rolled back and the job is claimed
+    again by another worker, until it runs out of attempts.
+
+    Returns:
+        ImportJob: The job that was processed, or None if the queue was empty or
+            another worker took the job
+    """
+    job = ImportJob.query.filter_by(
+        status=ImportJob.STATUS_PENDING
+    ).order_by(ImportJob.id).with_for_update(skip_locked=True).first()
+
+    if job is None:
+        db.session.rollback()
+        return None
+
+    job_id = job.id
+
+    # Earlier attempts that never finished (e.g. the worker was killed) count too
+    if job.attempts >= max_attempts:
+        job.status = ImportJob.STATUS_FAILED
+        job.error = job.error or f"Gave up after {job.attempts} attempts"
+        release_job_document(job_id)
+        db.session.commit()
+        logger.error(f"Gave up on import job {job_id} after {job.attempts} attempts")
+        IMPORTS.inc(outcome='failed')
+        return job
+
+    job.attempts += 1
+    attempt = job.attempts
+    db.session.commit()
+
+    # Lock the job again for the import. A worker that claimed it in between has
+    # counted another attempt, & this one backs off.
+    job = ImportJob.query.filter_by(
+        id=job_id, status=ImportJob.STATUS_PENDING, attempts=attempt
+    ).with_for_update(skip_locked=True).first()
+
+    if job is None:
+        db.session.rollback()
+        return None
+
+    versions = {}
+    started = time.perf_counter()
+
+    try:
+        summary = None
+        try:
+            # Run the import in a savepoint so a rejection keeps the job update
+            with db.session.begin_nested():
+                summary = ingest_test_results(job.document)
+            versions = summary['versions']
+            job.status = ImportJob.STATUS_COMPLETED
+            job.processed_count = summary['inserted'] + summary['updated']
+            job.error = None
+        except ValidationError as e:
+            job.status = ImportJob.STATUS_REJECTED
+            job.error = str(e.message)
+        except (DataError, IntegrityError) as e:
+            # Bad data (e.g. a name too long for its column) fails the same way on every attempt
+            job.status = ImportJob.STATUS_REJECTED
+            job.error = f"Failed to process test results: {str(e)}"
+
+        if job.status == ImportJob.STATUS_REJECTED:
+            release_job_document(job_id)
+
+        with phase_timer('commit'):
+            db.session.commit()
+
+    except Exception as e:
+        # Leave the job queued for a retry, giving up after too many attempts
+        db.session.rollback()
+        logger.error(f"Error running import job {job_id}: {str(e)}")
+        db.session.execute(
+            update(ImportJob).where(ImportJob.id == job_id).values(
+                status=case(
+                    (ImportJob.attempts >= max_attempts, ImportJob.STATUS_FAILED),
+                    else_=ImportJob.status,
+                ),
+                error=str(e),
+            )
+        )
+        job = db.session.get(ImportJob, job_id)
+        if job.status == ImportJob.STATUS_FAILED:
+            release_job_document(job_id)
+        db.session.commit()
+        IMPORTS.inc(outcome='failed')
+        return job
+
+    IMPORTS.inc(outcome=job.status)
+    invalidate_aggregates(versions)
+    if summary is not None:
+        record_import_rows(summary)
+        log_import_summary(summary, time.perf_counter() - started, f"Import job {job_id} {job.status}",
+                           job_id=job_id)
+    else:
+        logger.info(f"Import job {job_id} {job.status}")
+    return job
+
+def run_import_worker(app, stop_event, poll_interval=1.0, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Process import jobs until stop_event is set
+
+    Sleeps for poll_interval seconds whenever the queue is empty.
+    """
+    while not stop_event.is_set():
+        with app.app_context():
+            try:
+                job = process_next_import_job(max_attempts)
+            except Exception as e:
+                # e.g. the database is unreachable; back off & try again
+                logger.error(f"Import worker error: {str(e)}")
+                job = None
+            finally:
+                db.session.remove()
+
+        if job is None:
+            stop_event.wait(poll_interval)
+
+def start_import_workers(app, threads, stop_event, poll_interval=1.0):
+    """
+    Start a pool of import worker threads
+
+    Returns:
+        list: The started threads
+    """
+    max_attempts = app.config.get('IMPORT_JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+    workers = [
+        threading.Thread(
+            target=run_import_worker,
+            args=(app, stop_event, poll_interval, max_attempts),
+            name=f"markr-import-worker-{index}",
+            daemon=True,
+        )
+        for index in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    return workers
@@ -0,0 +1,342 @@
+import logging
+from flask import current_app
+from sqlalchemy import BigInteger, cast, func, select
+from sqlalchemy.dialects.postgresql import insert
+from markr_app.database import db
+from markr_app.models import TestResult, TestStatistics
+
+logger = logging.getLogger(__name__)
+
+# NumPy is imported inside the functions that use it, so starting a worker or
+# running a CLI command doesn't pay for it until the first import or aggregate
+
+# Tests with marks above this keep no histogram (the array is indexed by mark)
+DEFAULT_HISTOGRAM_MAX_MARK = 10000
+
+class StatisticsDelta:
+    """Accumulates the changes an import makes to each test's summary statistics"""
+
+    def __init__(self):
+        # Per-test running changes, keyed by test ID
+        self.tests = {}
+        # Tests whose stored statistics can't be patched & must be rebuilt
+        self.stale_test_ids = set()
+
+    def _entry(self, test_id):
+        entry = self.tests.get(test_id)
+        if entry is None:
+            entry = self.tests[test_id] = {
+                'count': 0,
+                'sum': 0,
+                'sum_squares': 0,
+                'min_added': None,
+                'max_added': None,
+                'min_removed': None,
+                'max_available': 0,
+                # Change in the number of students per mark
+                'mark_changes': {},
+            }
+        return entry
+
+    def add(self, test_id, marks_obtained, marks_available):
+        """Record a new result for a student"""
+        entry = self._entry(test_id)
+        entry['count'] += 1
+        self._add_mark(entry, marks_obtained)
+        entry['max_available'] = max(entry['max_available'], marks_available)
+
+    def replace(self, test_id, old_marks_obtained, marks_obtained, marks_available):
+        """Record a student's stored score being replaced by a rescan"""
+        entry = self._entry(test_id)
+        entry['max_available'] = max(entry['max_available'], marks_available)
+
+        if old_marks_obtained == marks_obtained:
+            return
+
+        entry['sum'] -= old_marks_obtained
+        entry['sum_squares'] -= old_marks_obtained * old_marks_obtained
+        entry['mark_changes'][old_marks_obtained] = entry['mark_changes'].get(old_marks_obtained, 0) - 1
+        if entry['min_removed'] is None or old_marks_obtained < entry['min_removed']:
+            entry['min_removed'] = old_marks_obtained
+        self._add_mark(entry, marks_obtained)
+
+    def mark_stale(self, test_id):
+        """Flag a test whose statistics must be recomputed from its results"""
+        self._entry(test_id)
+        self.stale_test_ids.add(test_id)
+
+    @staticmethod
+    def _add_mark(entry, marks_obtained):
+        entry['sum'] += marks_obtained
+        entry['sum_squares'] += marks_obtained * marks_obtained
+        entry['mark_changes'][marks_obtained] = entry['mark_changes'].get(marks_obtained, 0) + 1
+        if entry['min_added'] is None or marks_obtained < entry['min_added']:
+            entry['min_added'] = marks_obtained
+        if entry['max_added'] is None or marks_obtained > entry['max_added']:
+            entry['max_added'] = marks_obtained
+
+def _histogram_max_mark():
+    return current_app.config.get('HISTOGRAM_MAX_MARK', DEFAULT_HISTOGRAM_MAX_MARK)
+
+def compute_histogram_from_results(test_id):
+    """
+    Count a test's stored results per mark obtained
+
+    Returns:
+        list: Number of students indexed by mark, or None if the marks are too large to index
+    """
+    import numpy as np
+
+    rows = db.session.execute(
+        select(TestResult.marks_obtained, func.count())
+        .where(TestResult.test_id == test_id)
+        .group_by(TestResult.marks_obtained)
+    ).all()
+
+    if not rows:
+        return []
+
+    marks = np.array([row[0] for row in rows], dtype=np.int64)
+    if marks.max() > _histogram_max_mark():
+        return None
+
+    counts = np.array([row[1] for row in rows], dtype=np.int64)
+    return np.bincount(marks, weights=counts).astype(np.int64).tolist()
+
+def compute_statistics_from_results(test_id):
+    """
+    Compute a test's summary statistics directly from its stored results
+
+    Returns:
+        dict: count, sum_obtained, sum_squares_obtained, min_obtained, max_obtained & max_available
+    """
+    # sum() of a bigint is a numeric (a Decimal in Python), so cast the sums back
+    marks = cast(TestResult.marks_obtained, BigInteger)
+    row = db.session.execute(
+        select(
+            func.count(TestResult.id).label('count'),
+            cast(func.coalesce(func.sum(marks), 0), BigInteger).label('sum_obtained'),
+            cast(func.coalesce(func.sum(marks * marks), 0), BigInteger).label('sum_squares_obtained'),
+            func.min(TestResult.marks_obtained).label('min_obtained'),
+            func.max(TestResult.marks_obtained).label('max_obtained'),
+            func.coalesce(func.max(TestResult.marks_available), 0).label('max_available'),
+        ).where(TestResult.test_id == test_id)
+    ).one()
+    return dict(row._mapping)
+
+def _percentile_positions(counts, percentiles):
+    """
+    Locate each percentile between two order statistics, as np.percentile does
+
+    Args:
+        counts (array_like): Sample size(s); broadcast against percentiles
+        percentiles (array_like): Percentiles to locate, from 0 to 100
+
+    Returns:
+        tuple: (previous_indexes, next_indexes, gamma) where each percentile is
+            the value at previous_indexes interpolated towards next_indexes by gamma
+    """
+    import numpy as np
+
+    last_indexes = np.asarray(counts, dtype=np.int64)[..., None] - 1
+
+    # Same virtual index & neighbours as np.percentile(method='linear')
+    virtual_indexes = last_indexes * (np.asarray(percentiles, dtype=np.float64) / 100)
+    previous_indexes = np.floor(virtual_indexes)
+    above_bounds = virtual_indexes >= last_indexes
+    previous_indexes = np.where(above_bounds, last_indexes, previous_indexes)
+    next_indexes = np.where(above_bounds, last_indexes, previous_indexes + 1)
+    gamma = virtual_indexes - previous_indexes
+
+    return previous_indexes.astype(np.intp), next_indexes.astype(np.intp), gamma
+
+def _lerp(lower, upper, gamma):
+    """Linear interpolation with the same rounding behaviour as np.percentile"""
+    import numpy as np
+    diff = upper - lower
+    result = lower + diff * gamma
+    return np.where(gamma >= 0.5, upper - diff * (1 - gamma), result)
+
+def histogram_percentiles(mark_counts, percentiles):
+    """
+    Compute percentiles from a histogram of integer marks
+
+    Walks the cumulative counts to find the order statistics either side of each
+    percentile, matching np.percentile's default linear interpolation exactly.
+
+    Returns:
+        numpy.ndarray: One value per requested percentile
+    """
+    import numpy as np
+
+    cumulative = np.cumsum(np.asarray(mark_counts, dtype=np.int64))
+    previous_indexes, next_indexes, gamma = _percentile_positions(cumulative[-1], percentiles)
+
+    # The k-th smallest mark is the first mark whose cumulative count exceeds k
+    lower = np.searchsorted(cumulative, previous_indexes, side='right')
+    upper = np.searchsorted(cumulative, next_indexes, side='right')
+
+    return _lerp(lower, upper, gamma)
+
+def weighted_percentiles(values, counts, percentiles):
+    """
+    Compute percentiles of values that each occur a number of times
+
+    Matches np.percentile over the values repeated by their counts, without
+    building that array.
+
+    Args:
+        values (array_like): Distinct or repeated values, in any order
+        counts (array_like): Non-negative occurrences of each value, with a non-zero total
+        percentiles (array_like): Percentiles to compute
+
+    Returns:
+        numpy.ndarray: One value per requested percentile
+    """
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(values, kind='stable')
+    values = values[order]
+    cumulative = np.cumsum(np.asarray(counts, dtype=np.int64)[order])
+    previous_indexes, next_indexes, gamma = _percentile_positions(cumulative[-1], percentiles)
+
+    # The k-th smallest value is the first value whose cumulative count exceeds k
+    lower = values[np.searchsorted(cumulative, previous_indexes, side='right')]
+    upper = values[np.searchsorted(cumulative, next_indexes, side='right')]
+
+    return _lerp(lower, upper, gamma)
+
+def grouped_percentiles(sorted_marks, starts, counts, percentiles):
+    """
+    Compute percentiles for many groups of marks at once
+
+    Args:
+        sorted_marks (numpy.ndarray): Marks of every group concatenated, each group sorted
+        starts (numpy.ndarray): Offset of each group within sorted_marks
+        counts (numpy.ndarray): Size of each group (all non-zero)
+        percentiles (array_like): Percentiles to compute
+
+    Returns:
+        numpy.ndarray: groups x percentiles, matching np.percentile per group
+    """
+    import numpy as np
+
+    previous_indexes, next_indexes, gamma = _percentile_positions(counts, percentiles)
+    offsets = np.asarray(starts, dtype=np.intp)[:, None]
+
+    lower = sorted_marks[offsets + previous_indexes]
+    upper = sorted_marks[offsets + next_indexes]
+
+    return _lerp(lower, upper, gamma)
+
+def _rebuild_statistics(stats):
+    """Overwrite a TestStatistics row with values recomputed from its results"""
+    for field, value in compute_statistics_from_results(stats.test_id).items():
+        setattr(stats, field, value)
+    stats.mark_counts = compute_histogram_from_results(stats.test_id)
+
+def _apply_histogram(stats, mark_changes):
+    """
+    Apply per-mark count changes to a test's histogram
+
+    Returns:
+        bool: False if the histogram can no longer be kept & must be dropped
+    """
+    import numpy as np
+
+    marks = np.fromiter(mark_changes.keys(), dtype=np.int64, count=len(mark_changes))
+    changes = np.fromiter(mark_changes.values(), dtype=np.int64, count=len(mark_changes))
+
+    if len(marks) and marks.max() > _histogram_max_mark():
+        return False
+
+    counts = np.asarray(stats.mark_counts, dtype=np.int64)
+    size = max(len(counts), int(marks.max()) + 1 if len(marks) else 0)
+    updated = np.zeros(size, dtype=np.int64)
+    updated[:len(counts)] = counts
+    np.add.at(updated, marks, changes)
+
+    # Trim unused high marks so the array stays as short as possible
+    nonzero = np.flatnonzero(updated)
+    updated = updated[:nonzero[-1] + 1] if len(nonzero) else updated[:0]
+
+    stats.mark_counts = updated.tolist()
+    stats.min_obtained = int(nonzero[0]) if len(nonzero) else None
+    stats.max_obtained = int(nonzero[-1]) if len(nonzero) else None
+    return True
+
+def apply_statistics_delta(delta, updated_at=None):
+    """
+    Apply an import's accumulated changes to the test_statistics table
+
+    Must run inside the ingestion transaction, after the results have been written.
+    Rows are locked in test ID order so concurrent imports can't deadlock.
+
+    Args:
+        delta (StatisticsDelta): Changes accumulated while writing the results
+        updated_at (datetime): Timestamp the import wrote to its results, if any
+
+    Returns:
+        dict: The new change version of every touched test, keyed by test ID
+    """
+    if not delta.tests:
+        return {}
+
+    test_ids = sorted(delta.tests)
+
+    # Create missing rows. A test seen for the first time is built from its
+    # results, which also backfills tests imported before this table existed.
+    created_ids = db.session.scalars(
+        insert(TestStatistics.__table__)
+        .values([{'test_id': test_id, 'count': 0, 'sum_obtained': 0,
+                  'sum_squares_obtained': 0, 'max_available': 0, 'version': 0}
+                 for test_id in test_ids])
+        .on_conflict_do_nothing(index_elements=['test_id'])
+        .returning(TestStatistics.__table__.c.test_id)
+    ).all()
+    stale_test_ids = delta.stale_test_ids.union(created_ids)
+
+    rows = TestStatistics.query.filter(
+        TestStatistics.test_id.in_(test_ids)
+    ).order_by(TestStatistics.test_id).with_for_update().populate_existing().all()
+
+    for stats in rows:
+        stats.version += 1
+        if updated_at is not None:
+            stats.updated_at = updated_at
+
+        if stats.test_id in stale_test_ids:
+            _rebuild_statistics(stats)
+            continue
+
+        entry = delta.tests[stats.test_id]
+
+        stats.count += entry['count']
+        stats.sum_obtained += entry['sum']
+        stats.sum_squares_obtained += entry['sum_squares']
+        stats.max_available = max(stats.max_available, entry['max_available'])
+
+        # The histogram gives the new min & max directly, even after a rescan
+        # replaces the current minimum
+        if stats.mark_counts is not None:
+            if not _apply_histogram(stats, entry['mark_changes']):
+                _rebuild_statistics(stats)
+            continue
+
+        # Without a histogram, removing the current minimum means the new one is unknown
+        if entry['min_removed'] is not None and stats.min_obtained is not None \
+                and entry['min_removed'] <= stats.min_obtained:
+            _rebuild_statistics(stats)
+            continue
+
+        if entry['min_added'] is not None:
+            stats.min_obtained = entry['min_added'] if stats.min_obtained is None \
+                else min(stats.min_obtained, entry['min_added'])
+        if entry['max_added'] is not None:
+            stats.max_obtained = entry['max_added'] if stats.max_obtained is None \
+                else max(stats.max_obtained, entry['max_added'])
+
+    db.session.flush()
+    logger.info(f"Updated statistics for {len(rows)} tests ({len(stale_test_ids)} rebuilt)")
+    return {stats.test_id: stats.version for stats in rows}
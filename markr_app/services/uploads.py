@@ -0,0 +1,161 @@
+import gzip
+import hashlib
+import io
+import tempfile
+import zlib
+from markr_app.utils.errors import PayloadTooLargeError, ValidationError
+
+# Bytes pulled from the request stream at a time
+CHUNK_SIZE = 64 * 1024
+
+# Spooled documents up to this size stay in memory, larger ones go to a temporary file
+DEFAULT_SPOOL_MEMORY = 16 * 1024 * 1024
+
+# zstd is optional: the standard library's module (Python 3.14+) or the zstandard package
+try:
+    from compression import zstd as _zstd_stdlib
+except ImportError:
+    _zstd_stdlib = None
+try:
+    import zstandard as _zstandard
+except ImportError:
+    _zstandard = None
+
+class _CountingReader(io.RawIOBase):
+    """Reads a stream through, rejecting it once more than `limit` bytes have been read"""
+
+    def __init__(self, stream, limit, description):
+        self.stream = stream
+        self.limit = limit
+        self.description = description
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        if not data:
+            return 0
+        self.count += len(data)
+        if self.limit and self.count > self.limit:
+            raise PayloadTooLargeError(f"{self.description} exceeds the limit of {self.limit} bytes")
+        buffer[:len(data)] = data
+        return len(data)
+
+class _DecodingReader(io.RawIOBase):
+    """Turns errors from a decompressing file object into validation errors"""
+
+    def __init__(self, fileobj, encoding):
+        self.fileobj = fileobj
+        self.encoding = encoding
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        try:
+            data = self.fileobj.read(len(buffer))
+        except ValidationError:
+            raise
+        except (OSError, EOFError, zlib.error, ValueError) as e:
+            # Includes the zstd libraries' errors, which derive from these
+            raise ValidationError(f"Invalid {self.encoding}-encoded request body: {str(e)}")
+        buffer[:len(data)] = data
+        return len(data)
+
+def _zstd_reader(fileobj):
+    if _zstd_stdlib is not None:
+        return _zstd_stdlib.ZstdFile(fileobj)
+    return _zstandard.ZstdDecompressor().stream_reader(fileobj, read_size=CHUNK_SIZE)
+
+def supported_content_encodings():
+    """
+    Content-Encodings accepted on uploads
+
+    Returns:
+        set: Encoding names, in lower case
+    """
+    encodings = {'identity', 'gzip', 'x-gzip'}
+    if _zstd_stdlib is not None or _zstandard is not None:
+        encodings.add('zstd')
+    return encodings
+
+def parse_content_encoding(header):
+    """
+    Find the single coding applied to a body from its Content-Encoding header
+
+    Returns:
+        str: The coding ('identity' if none), or None if it isn't supported
+    """
+    codings = [coding.strip().lower() for coding in (header or '').split(',') if coding.strip()]
+    codings = [coding for coding in codings if coding != 'identity'] or ['identity']
+    if len(codings) != 1 or codings[0] not in supported_content_encodings():
+        return None
+    return codings[0]
+
+def open_upload(stream, encoding, max_compressed_bytes=None, max_decompressed_bytes=None):
+    """
+    Wrap a request body stream in a reader that decompresses it on the fly
+
+    Nothing is buffered beyond the chunk being decoded, so the parser can consume
+    documents of any size. Both the bytes received and the bytes produced by
+    decompression are limited, which defuses decompression bombs.
+
+    Args:
+        stream (file-like): The raw request body (e.g. request.stream)
+        encoding (str): A coding returned by parse_content_encoding
+        max_compressed_bytes (int): Limit on the body as sent, if any
+        max_decompressed_bytes (int): Limit on the decompressed document, if any
+
+    Returns:
+        io.BufferedReader: The decompressed document
+
+    Raises:
+        PayloadTooLargeError: While reading, once either limit is exceeded
+        ValidationError: While reading, if the body isn't validly encoded
+    """
+    if encoding == 'identity':
+        # The body is the document, so both limits apply to it
+        limits = [limit for limit in (max_compressed_bytes, max_decompressed_bytes) if limit]
+        return io.BufferedReader(_CountingReader(stream, min(limits, default=None), 'Request body'), CHUNK_SIZE)
+
+    body = _CountingReader(stream, max_compressed_bytes, 'Request body')
+
+    if encoding in ('gzip', 'x-gzip'):
+        decoded = _DecodingReader(gzip.GzipFile(fileobj=io.BufferedReader(body, CHUNK_SIZE), mode='rb'), 'gzip')
+    else:
+        decoded = _DecodingReader(_zstd_reader(io.BufferedReader(body, CHUNK_SIZE)), 'zstd')
+
+    document = _CountingReader(decoded, max_decompressed_bytes, 'Decompressed request body')
+    return io.BufferedReader(document, CHUNK_SIZE)
+
+def spool_upload(document, max_memory=DEFAULT_SPOOL_MEMORY):
+    """
+    Read a whole document into a spooled temporary file, hashing it on the way
+
+    Lets an import check the document's digest before parsing it. Documents
+    larger than max_memory are spooled to disk, so memory use stays bounded.
+
+    Args:
+        document (file-like): The decompressed document, as returned by open_upload
+        max_memory (int): Bytes kept in memory before spooling to disk
+
+    Returns:
+        tuple: (hex SHA-256 digest of the document, file positioned at its start)
+
+    Raises:
+        PayloadTooLargeError: If the document exceeds a limit of its reader
+        ValidationError: If the body isn't validly encoded
+    """
+    digest = hashlib.sha256()
+    spool = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    try:
+        while chunk := document.read(CHUNK_SIZE):
+            digest.update(chunk)
+            spool.write(chunk)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return digest.hexdigest(), spool
@@ -1,109 +1,259 @@
 from datetime import datetime
+import functools
+import io
 import logging
+import struct
+import time
 from lxml import etree
+from markr_app.services.answers import pack_answers
 from markr_app.utils.errors import ValidationError
+from markr_app.utils.metrics import record_phase
 
 logger = logging.getLogger(__name__)
 
-def parse_test_results(xml_content):
+def _text(elem):
+    """Text of an element as findtext returns it: None if missing, '' if empty"""
+    if elem is None:
+        return None
+    return elem.text or ''
+
+# The only children of a record we read; any other gunk is skipped
+_RESULT_FIELDS = ('first-name', 'last-name', 'student-number', 'test-id', 'summary-marks', 'answer')
+
+@functools.lru_cache(maxsize=4096)
+def _parse_timestamp(scanned_on):
     """
-    Parse XML content containing MCQ test results.
-    
+    Parse a scanned-on timestamp
+
+    Cached, as a document usually repeats the same few timestamps.
+
+    Returns:
+        datetime: The timestamp, or None if it isn't valid
+    """
+    try:
+        return datetime.fromisoformat(scanned_on.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+def _extract_answers(answer_elems, student_number):
+    """
+    Read a record's <answer> elements
+
+    Answers aren't required, so a record with an invalid answer is kept without
+    its answers, like an invalid timestamp.
+
+    Returns:
+        list: (question, marks_available, marks_awarded) tuples, or None if any is invalid
+    """
+    answers = []
+    for answer_elem in answer_elems:
+        try:
+            answer = (int(answer_elem.get('question')), int(answer_elem.get('marks-available')),
+                      int(answer_elem.get('marks-awarded')))
+        except (TypeError, ValueError):
+            answer = None
+        if answer is None or answer[1] < 0 or answer[2] < 0:
+            logger.warning(f"Invalid answer for student {student_number}: question={answer_elem.get('question')}, "
+                           f"marks-available={answer_elem.get('marks-available')}, "
+                           f"marks-awarded={answer_elem.get('marks-awarded')}")
+            return None
+        answers.append(answer)
+    return answers
+
+def _extract_result(result_elem, verify_summary_marks=False):
+    """
+    Extract & validate the fields of a single mcq-test-result element
+
     Args:
-        xml_content (str or bytes): XML content to parse
-        
+        result_elem (lxml.etree._Element): The record
+        verify_summary_marks (bool): Reject a record whose answers don't add up to its summary-marks
+
     Raises:
-        ValidationError: If XML is malformed or invalid
+        ValidationError: If required fields are missing or invalid
     """
+    # Extract scanned-on timestamp if available
+    scanned_on = result_elem.get('scanned-on')
+    scanned_at = None
+    if scanned_on:
+        scanned_at = _parse_timestamp(scanned_on)
+        if scanned_at is None:
+            logger.warning(f"Invalid timestamp format: {scanned_on}")
+
+    # Extract required elements
     try:
-        # Parse XML with a secure parser to prevent XXE attacks
-        parser = etree.XMLParser(resolve_entities=False)
-        root = etree.fromstring(xml_content, parser=parser)
-        
-        # Verify root element is mcq-test-results
-        if root.tag != 'mcq-test-results':
-            raise ValidationError(f"Invalid root element: {root.tag}. Expected 'mcq-test-results'")
-        
-        # List to store parsed results
-        results = []
-        
-        # Process each mcq-test-result element
-        for result_elem in root.findall('mcq-test-result'):
-            # Extract scanned-on timestamp if available
-            scanned_on = result_elem.get('scanned-on')
-            scanned_at = None
-            if scanned_on:
-                try:
-                    scanned_at = datetime.fromisoformat(scanned_on.replace('Z', '+00:00'))
-                except ValueError:
-                    logger.warning(f"Invalid timestamp format: {scanned_on}")
-            
-            # Extract required elements
+        # One pass over the record's children, filtered by tag inside lxml. The
+        # first occurrence of each field wins, as with find/findtext.
+        fields = {}
+        answer_elems = []
+        for child in result_elem.iterchildren(*_RESULT_FIELDS):
+            if child.tag == 'answer':
+                answer_elems.append(child)
+            elif child.tag not in fields:
+                fields[child.tag] = child
+
+        first_name = _text(fields.get('first-name'))
+        last_name = _text(fields.get('last-name'))
+        student_number = _text(fields.get('student-number'))
+        test_id = _text(fields.get('test-id'))
+
+        # Check if summary-marks element exists
+        summary_elem = fields.get('summary-marks')
+        if summary_elem is None:
+            raise ValidationError(f"Missing 'summary-marks' element for student {student_number}")
+
+        # Extract marks attributes
+        marks_available = summary_elem.get('available')
+        marks_obtained = summary_elem.get('obtained')
+
+        # All required fields must be present
+        if any(field is None for field in [
+            first_name, last_name, student_number, test_id, marks_available, marks_obtained
+        ]):
+            missing_fields = []
+            if first_name is None: missing_fields.append('first-name')
+            if last_name is None: missing_fields.append('last-name')
+            if student_number is None: missing_fields.append('student-number')
+            if test_id is None: missing_fields.append('test-id')
+            if marks_available is None: missing_fields.append('available attribute')
+            if marks_obtained is None: missing_fields.append('obtained attribute')
+
+            raise ValidationError(f"Missing required fields: {', '.join(missing_fields)}")
+
+        # Try to convert marks to integers
+        try:
+            marks_available = int(marks_available)
+            marks_obtained = int(marks_obtained)
+        except ValueError:
+            raise ValidationError(f"Marks must be integers: available={marks_available}, obtained={marks_obtained}")
+
+        # Validate marks if non-negative
+        if marks_available < 0 or marks_obtained < 0:
+            raise ValidationError(f"Marks cannot be negative: available={marks_available}, obtained={marks_obtained}")
+
+        # Answers are stored packed, see services.answers
+        answers = _extract_answers(answer_elems, student_number) if answer_elems else None
+        packed_answers = None
+        if answers:
             try:
-                first_name = result_elem.findtext('first-name')
-                last_name = result_elem.findtext('last-name')
-                student_number = result_elem.findtext('student-number')
-                test_id = result_elem.findtext('test-id')
-                
-                # Check if summary-marks element exists
-                summary_elem = result_elem.find('summary-marks')
-                if summary_elem is None:
-                    raise ValidationError(f"Missing 'summary-marks' element for student {student_number}")
-                
-                # Extract marks attributes
-                marks_available = summary_elem.get('available')
-                marks_obtained = summary_elem.get('obtained')
-                
-                # All required fields must be present
-                if any(field is None for field in [
-                    first_name, last_name, student_number, test_id, marks_available, marks_obtained
-                ]):
-                    missing_fields = []
-                    if first_name is None: missing_fields.append('first-name')
-                    if last_name is None: missing_fields.append('last-name')
-                    if student_number is None: missing_fields.append('student-number')
-                    if test_id is None: missing_fields.append('test-id')
-                    if marks_available is None: missing_fields.append('available attribute')
-                    if marks_obtained is None: missing_fields.append('obtained attribute')
-                    
-                    raise ValidationError(f"Missing required fields: {', '.join(missing_fields)}")
-                
-                # Try to convert marks to integers
-                try:
-                    marks_available = int(marks_available)
-                    marks_obtained = int(marks_obtained)
-                except ValueError:
-                    raise ValidationError(f"Marks must be integers: available={marks_available}, obtained={marks_obtained}")
-                
-                # Validate marks if non-negative
-                if marks_available < 0 or marks_obtained < 0:
-                    raise ValidationError(f"Marks cannot be negative: available={marks_available}, obtained={marks_obtained}")
-                
-                # Add parsed result to list
-                results.append({
-                    'first_name': first_name,
-                    'last_name': last_name,
-                    'student_number': student_number,
-                    'test_id': test_id,
-                    'marks_available': marks_available,
-                    'marks_obtained': marks_obtained,
-                    'scanned_at': scanned_at
-                })
-                
-            except Exception as e:
-                if isinstance(e, ValidationError):
-                    raise
-                raise ValidationError(f"Error extracting test result data: {str(e)}")
-        
+                packed_answers = pack_answers(answers)
+            except struct.error:
+                logger.warning(f"Answer marks out of range for student {student_number}")
+                answers = None
+
+        # Optionally check the summary against the answers
+        if verify_summary_marks and answers:
+            answers_available = sum(answer[1] for answer in answers)
+            answers_awarded = sum(answer[2] for answer in answers)
+            if answers_available != marks_available or answers_awarded != marks_obtained:
+                raise ValidationError(
+                    f"Summary marks do not match the answers for student {student_number}: "
+                    f"available={marks_available}, obtained={marks_obtained}, "
+                    f"answers available={answers_available}, answers awarded={answers_awarded}"
+                )
+
+        return {
+            'first_name': first_name,
+            'last_name': last_name,
+            'student_number': student_number,
+            'test_id': test_id,
+            'marks_available': marks_available,
+            'marks_obtained': marks_obtained,
+            'scanned_at': scanned_at,
+            'answers': packed_answers
+        }
+
+    except Exception as e:
+        if isinstance(e, ValidationError):
+            raise
+        raise ValidationError(f"Error extracting test result data: {str(e)}")
+
+def iter_test_results(xml_source, verify_summary_marks=False):
+    """
+    Stream MCQ test results out of an XML document.
+
+    Built on lxml's iterparse, so each mcq-test-result element is cleared as soon
+    as it has been validated and memory use stays flat regardless of document size.
+
+    Args:
+        xml_source (str, bytes or file-like): XML content to parse
+        verify_summary_marks (bool): Reject records whose answers don't add up to their summary-marks
+
+    Yields:
+        dict: One validated test result at a time
+
+    Raises:
+        ValidationError: If XML is malformed or invalid. Records yielded before the
+            error must be discarded by the caller.
+    """
+    if isinstance(xml_source, str):
+        xml_source = xml_source.encode('utf-8')
+    if isinstance(xml_source, (bytes, bytearray)):
+        xml_source = io.BytesIO(xml_source)
+
+    # Only the time spent inside the parser counts, not the caller's work between records
+    parse_seconds = 0.0
+    resumed = time.perf_counter()
+
+    try:
+        # Parse XML with a secure parser to prevent XXE attacks. Only record end
+        # events reach Python; lxml filters out every other element in C.
+        events = etree.iterparse(xml_source, events=('end',), tag='mcq-test-result', resolve_entities=False)
+
+        root = None
+        result_count = 0
+
+        for _, elem in events:
+            parent = elem.getparent()
+
+            # Verify root element is mcq-test-results
+            if root is None:
+                root = elem.getroottree().getroot()
+                if root.tag != 'mcq-test-results':
+                    raise ValidationError(f"Invalid root element: {root.tag}. Expected 'mcq-test-results'")
+
+            # Only direct children of the root are complete records
+            if parent is not root:
+                continue
+
+            result = _extract_result(elem, verify_summary_marks)
+            result_count += 1
+            parse_seconds += time.perf_counter() - resumed
+            resumed = None
+            yield result
+            resumed = time.perf_counter()
+
+            # Free the processed record & anything before it
+            elem.clear(keep_tail=False)
+            while elem.getprevious() is not None:
+                del parent[0]
+
+        # Verify root element is mcq-test-results, even if it had no records
+        if root is None and events.root is not None and events.root.tag != 'mcq-test-results':
+            raise ValidationError(f"Invalid root element: {events.root.tag}. Expected 'mcq-test-results'")
+
         # Ensure we found at least one result
-        if not results:
+        if not result_count:
             raise ValidationError("No valid test results found in XML document")
-            
-        return results
-        
+
     except etree.XMLSyntaxError as e:
         raise ValidationError(f"Invalid XML syntax: {str(e)}")
     except Exception as e:
         if isinstance(e, ValidationError):
             raise
-        raise ValidationError(f"Error parsing XML: {str(e)}")
\ No newline at end of file
+        raise ValidationError(f"Error parsing XML: {str(e)}")
+    finally:
+        if resumed is not None:
+            parse_seconds += time.perf_counter() - resumed
+        record_phase('parse', parse_seconds)
+
+def parse_test_results(xml_content):
+    """
+    Parse XML content containing MCQ test results.
+
+    Args:
+        xml_content (str or bytes): XML content to parse
+
+    Raises:
+        ValidationError: If XML is malformed or invalid
+    """
+    return list(iter_test_results(xml_content))
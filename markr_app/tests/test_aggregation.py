@@ -1,6 +1,10 @@
+import numpy as np
 import pytest
 from datetime import datetime, timezone
-from markr_app.models import TestResult
+from markr_app.app import create_app
+from markr_app.models import TestResult, TestStatistics
+from markr_app.services import aggregation
+from markr_app.utils.errors import ValidationError
 
 class TestAggregation:
     def test_aggregation_multiple_results(self, client, session):
@@ -52,6 +56,7 @@ class TestAggregation:
         assert aggregates['count'] == 5
         assert aggregates['min'] == 50.0  
         assert aggregates['max'] == 100.0  
+        assert aggregates['stddev'] == pytest.approx(18.439088914585774)
         
         # Percentiles
         assert aggregates['p25'] == 60.0  
@@ -120,4 +125,232 @@ class TestAggregation:
         
         # Check response
         assert response.status_code == 404
-        assert 'Not Found' in response.json['error']
\ No newline at end of file
+        assert 'Not Found' in response.json['error']
+
+    def test_aggregation_statistics_maintained_by_import(self, client, valid_xml_multiple, session):
+        """Test that imports keep the summary statistics in step, including higher rescans."""
+        # Sample generated by AI
+        xml_rescan = b'''<?xml version="1.0" encoding="UTF-8" ?>
+        <mcq-test-results>
+            <mcq-test-result scanned-on="2022-10-12T09:00:00Z">
+                <first-name>Alice</first-name>
+                <last-name>Johnson</last-name>
+                <student-number>S24680</student-number>
+                <test-id>TEST001</test-id>
+                <summary-marks available="20" obtained="16" />
+            </mcq-test-result>
+        </mcq-test-results>
+        '''
+
+        # Import [15, 18, 12] then replace the 12 with a rescanned 16
+        for document in (valid_xml_multiple, xml_rescan):
+            response = client.post('/import',
+                                  data=document,
+                                  headers={'Content-Type': 'text/xml+markr'})
+            assert response.status_code == 200
+
+        stats = TestStatistics.query.filter_by(test_id='TEST001').first()
+        assert stats is not None
+        assert stats.count == 3
+        assert stats.sum_obtained == 49
+        assert stats.sum_squares_obtained == 15 ** 2 + 18 ** 2 + 16 ** 2
+        assert stats.min_obtained == 15
+        assert stats.max_obtained == 18
+        assert stats.max_available == 20
+        assert stats.mark_counts == [0] * 15 + [1, 1, 0, 1]
+
+        response = client.get('/results/TEST001/aggregate')
+        assert response.status_code == 200
+
+        aggregates = response.json
+        assert aggregates['count'] == 3
+        assert aggregates['mean'] == pytest.approx(49 / 3 / 20 * 100)
+        assert aggregates['min'] == 75.0
+        assert aggregates['max'] == 90.0
+        assert aggregates['p50'] == 80.0
+
+    def test_aggregation_backends_agree(self, app, client, valid_xml_multiple, session):
+        """Test that the NumPy & SQL pushdown backends give the same aggregates."""
+        from markr_app.services.aggregation import calculate_aggregates
+
+        response = client.post('/import',
+                              data=valid_xml_multiple,
+                              headers={'Content-Type': 'text/xml+markr'})
+        assert response.status_code == 200
+
+        numpy_aggregates = calculate_aggregates('TEST001', backend='numpy')
+        sql_aggregates = calculate_aggregates('TEST001', backend='sql')
+
+        assert numpy_aggregates.keys() == sql_aggregates.keys()
+        for field, value in numpy_aggregates.items():
+            assert sql_aggregates[field] == pytest.approx(value)
+
+        # The configured backend is used by the endpoint
+        app.config['AGGREGATION_BACKEND'] = 'sql'
+        response = client.get('/results/TEST001/aggregate')
+        assert response.status_code == 200
+        assert response.json['p50'] == pytest.approx(numpy_aggregates['p50'])
+
+    def test_aggregation_cache_invalidated_by_import(self, client, valid_xml_single, valid_xml_multiple, session):
+        """Test that a cached aggregate is replaced once an import touches the test."""
+        response = client.post('/import',
+                              data=valid_xml_single,
+                              headers={'Content-Type': 'text/xml+markr'})
+        assert response.status_code == 200
+
+        response = client.get('/results/TEST001/aggregate')
+        assert response.json['count'] == 1
+
+        response = client.post('/import',
+                              data=valid_xml_multiple,
+                              headers={'Content-Type': 'text/xml+markr'})
+        assert response.status_code == 200
+
+        response = client.get('/results/TEST001/aggregate')
+        assert response.json['count'] == 3
+
+    def test_aggregation_conditional_get(self, client, valid_xml_single, valid_xml_multiple, session):
+        """Test ETag & Last-Modified revalidation of aggregate results."""
+        response = client.post('/import',
+                              data=valid_xml_single,
+                              headers={'Content-Type': 'text/xml+markr'})
+        assert response.status_code == 200
+
+        response = client.get('/results/TEST001/aggregate')
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        assert 'Cache-Control' in response.headers
+
+        # Matching validators get an empty 304
+        response = client.get('/results/TEST001/aggregate', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+
+        response = client.get('/results/TEST001/aggregate', headers={'If-Modified-Since': last_modified})
+        assert response.status_code == 304
+
+        # A new import changes the ETag
+        response = client.post('/import',
+                              data=valid_xml_multiple,
+                              headers={'Content-Type': 'text/xml+markr'})
+        assert response.status_code == 200
+
+        response = client.get('/results/TEST001/aggregate', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+        assert response.json['count'] == 3
+
+    def test_batch_aggregation(self, client, valid_xml_multiple, session):
+        """Test aggregating several tests at once, with per-entry errors."""
+        response = client.post('/import',
+                              data=valid_xml_multiple,
+                              headers={'Content-Type': 'text/xml+markr'})
+        assert response.status_code == 200
+
+        session.add(TestResult(student_number='S12345', test_id='TEST003', first_name='John', last_name='Doe',
+                               marks_obtained=0, marks_available=0))
+        session.commit()
+
+        response = client.post('/results/aggregate', json={'test_ids': ['TEST001', 'TEST003', 'NAN']})
+        assert response.status_code == 200
+
+        results = response.json
+        assert results['TEST001'] == client.get('/results/TEST001/aggregate').json
+        assert 'Maximum available marks is zero' in results['TEST003']['message']
+        assert results['NAN']['error'] == 'Not Found'
+
+    def test_batch_aggregation_bad_request(self, client, session):
+        """Test the batch endpoint rejects malformed bodies."""
+        response = client.post('/results/aggregate', json={'test_ids': []})
+        assert response.status_code == 400
+
+        response = client.post('/results/aggregate', json={'test_ids': 'TEST001'})
+        assert response.status_code == 400
+
+    def test_rollup(self, client, valid_xml_multiple, session):
+        """Test that a rollup over several tests matches the aggregates of all their students."""
+        response = client.post('/import',
+                              data=valid_xml_multiple,
+                              headers={'Content-Type': 'text/xml+markr'})
+        assert response.status_code == 200
+
+        # A second test out of a different total, without a histogram
+        session.add_all([
+            TestResult(student_number='S1', test_id='TEST002', first_name='A', last_name='A',
+                       marks_obtained=3, marks_available=10),
+            TestResult(student_number='S2', test_id='TEST002', first_name='B', last_name='B',
+                       marks_obtained=9, marks_available=10),
+        ])
+        session.commit()
+
+        response = client.post('/results/rollup', json={'test_ids': ['TEST001', 'TEST002', 'NAN']})
+        assert response.status_code == 200
+
+        percentages = [result.marks_obtained * 100 / 20 for result in TestResult.find_all_by_test_id('TEST001')]
+        percentages += [30.0, 90.0]
+        rollup = response.json
+        assert rollup['count'] == len(percentages)
+        assert rollup['mean'] == pytest.approx(np.mean(percentages))
+        assert [rollup['p25'], rollup['p50'], rollup['p75']] == pytest.approx(
+            np.percentile(percentages, [25, 50, 75]).tolist())
+        assert rollup['tests'] == 2
+        assert rollup['missing'] == ['NAN']
+        assert rollup['error_bound']['rank'] == 0
+
+        response = client.post('/results/rollup', json={'test_ids': ['NAN']})
+        assert response.status_code == 404
+
+    def test_distribution(self, client, valid_xml_multiple, session):
+        """Test per-mark & per-bucket distributions, and that they are cached per bucket width."""
+        response = client.post('/import',
+                              data=valid_xml_multiple,
+                              headers={'Content-Type': 'text/xml+markr'})
+        assert response.status_code == 200
+        marks = [result.marks_obtained for result in TestResult.find_all_by_test_id('TEST001')]
+
+        response = client.get('/results/TEST001/distribution')
+        assert response.status_code == 200
+        distribution = response.json
+        assert distribution['counts'] == np.bincount(marks, minlength=21).tolist()
+        assert distribution['max_available'] == 20
+
+        response = client.get('/results/TEST001/distribution?bucket=25')
+        assert response.status_code == 200
+        assert response.json['edges'] == [0, 25, 50, 75, 100]
+        assert sum(response.json['counts']) == len(marks)
+
+        # Revalidation works per bucket width
+        etag = response.headers['ETag']
+        response = client.get('/results/TEST001/distribution?bucket=25', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+        assert client.get('/results/TEST001/distribution?bucket=0').status_code == 400
+        assert client.get('/results/TEST001/distribution?bucket=1e-6').status_code == 400
+        assert client.get('/results/NAN/distribution').status_code == 404
+
+    def test_distribution_bucket_count_bounded(self, monkeypatch):
+        """Test that buckets narrower than 100 / HISTOGRAM_MAX_MARK percent are rejected."""
+        monkeypatch.setattr(aggregation, '_load_statistics', lambda test_id: {
+            'count': 1, 'max_available': 8, 'mark_counts': [0, 1],
+        })
+        app = create_app('testing')
+        app.config['HISTOGRAM_MAX_MARK'] = 1000
+
+        with app.app_context():
+            with pytest.raises(ValidationError, match='between 0.1 and 100'):
+                aggregation.calculate_distribution('TEST001', bucket_width=1e-5)
+            assert len(aggregation.calculate_distribution('TEST001', bucket_width=0.1)['counts']) == 1000
+
+    def test_distribution_buckets(self, monkeypatch):
+        """Test that marks fall in percentage buckets of the max available, with 100% in the last one."""
+        monkeypatch.setattr(aggregation, '_load_statistics', lambda test_id: {
+            'count': 6, 'max_available': 8, 'mark_counts': [1, 0, 1, 1, 0, 0, 1, 0, 2],
+        })
+
+        with create_app('testing').app_context():
+            distribution = aggregation.calculate_distribution('TEST001', bucket_width=30)
+
+        # 0%, 25%, 37.5%, 75% & twice 100%
+        assert distribution['edges'] == [0, 30, 60, 90, 100]
+        assert distribution['counts'] == [2, 1, 1, 2]
@@ -0,0 +1,94 @@
+import pytest
+import numpy as np
+from markr_app.models import TestResult
+from markr_app.services.answers import compute_item_analysis, pack_answers, unpack_answers
+
+class TestAnswerPacking:
+    def test_pack_round_trip(self):
+        """Test that packed answers unpack to the same triples."""
+        answers = [(1, 1, 0), (2, 2, 2), (10, 3, 1)]
+
+        packed = pack_answers(answers)
+
+        assert len(packed) == 12 * len(answers)
+        assert unpack_answers(packed).tolist() == [list(answer) for answer in answers]
+
+class TestItemAnalysis:
+    def test_matches_reference(self):
+        """Test difficulty & discrimination against a straightforward per-question calculation."""
+        rng = np.random.default_rng(0)
+        awarded = rng.integers(0, 3, size=(50, 6))
+        packed = [pack_answers([(question + 1, 2, int(marks)) for question, marks in enumerate(row)])
+                  for row in awarded]
+
+        questions = compute_item_analysis(packed)
+
+        totals = awarded.sum(axis=1)
+        for question, item in enumerate(questions):
+            assert item['question'] == question + 1
+            assert item['marks_available'] == 2
+            assert item['answered'] == 50
+            assert item['difficulty'] == pytest.approx(awarded[:, question].mean() / 2)
+            expected = np.corrcoef(awarded[:, question], totals - awarded[:, question])[0, 1]
+            assert item['discrimination'] == pytest.approx(expected)
+
+    def test_unanswered_and_constant_questions(self):
+        """Test that missing answers count as zero and undefined statistics are None."""
+        packed = [
+            pack_answers([(1, 1, 1), (2, 1, 1), (3, 0, 0)]),
+            pack_answers([(1, 1, 1), (3, 0, 0)]),
+            pack_answers([(1, 1, 1), (2, 1, 0), (3, 0, 0)]),
+        ]
+
+        questions = {item['question']: item for item in compute_item_analysis(packed)}
+
+        assert questions[2]['answered'] == 2
+        assert questions[2]['difficulty'] == pytest.approx(1 / 3)
+        # Everyone got question 1 right, & question 3 has no marks
+        assert questions[1]['discrimination'] is None
+        assert questions[3]['difficulty'] is None
+
+    def test_item_analysis_endpoint(self, client, session):
+        """Test the item analysis endpoint over stored answers."""
+        session.add_all([
+            TestResult(student_number='S1', test_id='TEST001', first_name='A', last_name='A',
+                       marks_obtained=2, marks_available=2, answers=pack_answers([(1, 1, 1), (2, 1, 1)])),
+            TestResult(student_number='S2', test_id='TEST001', first_name='B', last_name='B',
+                       marks_obtained=1, marks_available=2, answers=pack_answers([(1, 1, 1), (2, 1, 0)])),
+            TestResult(student_number='S3', test_id='TEST001', first_name='C', last_name='C',
+                       marks_obtained=0, marks_available=2),
+        ])
+        session.commit()
+
+        response = client.get('/results/TEST001/items')
+
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['count'] == 2
+        assert [item['difficulty'] for item in data['questions']] == [1.0, 0.5]
+
+    def test_item_analysis_without_answers(self, client, session):
+        """Test that a test without stored answers gets a 404."""
+        response = client.get('/results/NOPE/items')
+
+        assert response.status_code == 404
+
+    def test_import_stores_answers(self, client, session):
+        """Test that importing a document stores each result's answers."""
+        xml = b'''<mcq-test-results>
+            <mcq-test-result>
+                <first-name>Jane</first-name>
+                <last-name>Austen</last-name>
+                <student-number>521585128</student-number>
+                <test-id>1234</test-id>
+                <answer question="1" marks-available="1" marks-awarded="1">A</answer>
+                <answer question="2" marks-available="1" marks-awarded="0">B</answer>
+                <summary-marks available="2" obtained="1" />
+            </mcq-test-result>
+        </mcq-test-results>'''
+
+        response = client.post('/import', data=xml, headers={'Content-Type': 'text/xml+markr'})
+
+        assert response.status_code == 200
+        result = TestResult.find_by_student_and_test('521585128', '1234')
+        assert unpack_answers(result.answers).tolist() == [[1, 1, 1], [2, 1, 0]]
@@ -0,0 +1,93 @@
+import json
+from benchmarks.hotpaths import find_regressions
+from benchmarks.loadtest import EndpointStats, load_replay, percentile
+from benchmarks.xml_generator import generate_markr_xml
+from markr_app.services.xml_parser import parse_test_results
+
+class TestXMLGenerator:
+    def test_generated_document_parses(self):
+        """Test that generated documents are valid Markr XML with the requested shape."""
+        xml = generate_markr_xml(rows=200, tests=4, answers=20, gunk=3, marks_available=20)
+        results = parse_test_results(xml)
+
+        assert len(results) == 200
+        assert len({result['test_id'] for result in results}) == 4
+        assert all(result['marks_available'] == 20 for result in results)
+        assert xml.count(b'<answer ') == 200 * 20
+
+    def test_duplicates_and_rescans(self):
+        """Test that duplicates & rescans repeat an existing (student, test) pair."""
+        results = parse_test_results(generate_markr_xml(rows=500, tests=5, duplicate_rate=0.2, rescan_rate=0.2))
+
+        keys = {(result['student_number'], result['test_id']) for result in results}
+        assert len(keys) == 500
+        assert len(results) > 600
+
+    def test_generation_is_reproducible(self):
+        """Test that the same seed gives the same document."""
+        assert generate_markr_xml(rows=50, seed=7) == generate_markr_xml(rows=50, seed=7)
+        assert generate_markr_xml(rows=50, seed=7) != generate_markr_xml(rows=50, seed=8)
+
+
+class TestRegressionCheck:
+    def test_find_regressions(self):
+        """Test that only timings slower than the tolerance are reported."""
+        baseline = {'results': [
+            {'benchmark': 'parse', 'rows': 1000, 'seconds': 1.0},
+            {'benchmark': 'process_insert', 'rows': 1000, 'seconds': 2.0},
+        ]}
+        results = [
+            {'benchmark': 'parse', 'rows': 1000, 'seconds': 1.1},
+            {'benchmark': 'process_insert', 'rows': 1000, 'seconds': 3.0},
+            {'benchmark': 'aggregate_sql', 'rows': 1000, 'seconds': 9.0},
+        ]
+
+        regressions = find_regressions(results, baseline, tolerance=0.25)
+
+        assert [entry['benchmark'] for entry in regressions] == ['process_insert']
+        assert regressions[0]['slowdown'] == 1.5
+
+
+class TestLoadTest:
+    def test_endpoint_summary(self):
+        """Test the latency percentiles & error rate of a load test endpoint."""
+        stats = EndpointStats()
+        for latency in range(1, 101):
+            stats.record(latency / 1000, 200)
+        stats.record(0.5, 404)
+        stats.record(0.5, 503)
+        stats.record(0.5)
+
+        summary = stats.summary(elapsed=2.0)
+
+        assert summary['requests'] == 103
+        assert summary['requests_per_second'] == 51.5
+        assert summary['p50_ms'] == 52
+        assert summary['statuses'] == {'200': 100, '404': 1, '503': 1}
+        assert summary['connection_failures'] == 1
+        assert summary['error_rate'] == 2 / 103
+
+    def test_percentile(self):
+        """Test the nearest-rank percentile."""
+        values = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+
+        assert percentile(values, 50) == 5
+        assert percentile(values, 95) == 10
+        assert percentile(values, 0) == 1
+        assert percentile([7], 99) == 7
+
+    def test_load_replay(self, tmp_path):
+        """Test reading a recorded traffic file."""
+        path = tmp_path / 'traffic.jsonl'
+        path.write_text('\n'.join([
+            json.dumps({'at': 0.5, 'method': 'get', 'path': '/results/T1/aggregate'}),
+            '',
+            json.dumps({'body': '<mcq-test-results/>'}),
+        ]))
+
+        entries = load_replay(str(path))
+
+        assert entries == [
+            (0.5, 'GET', '/results/T1/aggregate', {}, None),
+            (None, 'POST', '/import', {'Content-Type': 'text/xml+markr'}, b'<mcq-test-results/>'),
+        ]
@@ -0,0 +1,122 @@
+import threading
+import time
+import pytest
+from markr_app.services import cache as cache_module
+from markr_app.services.cache import AggregateCache, InvalidationListener
+
+class TestAggregateCache:
+    def test_cache_hit_until_invalidated(self):
+        """Test that entries are reused until the test's version moves on."""
+        cache = AggregateCache(max_entries=10)
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return b'{"count": %d}' % len(calls)
+
+        assert cache.get_or_compute('TEST001', compute) == b'{"count": 1}'
+        assert cache.get_or_compute('TEST001', compute) == b'{"count": 1}'
+        assert len(calls) == 1
+
+        # A newer version makes the old entry unreachable
+        cache.invalidate('TEST001', 3)
+        assert cache.get_or_compute('TEST001', compute) == b'{"count": 2}'
+
+        # Stale notifications are ignored
+        cache.invalidate('TEST001', 2)
+        assert cache.get_or_compute('TEST001', compute) == b'{"count": 2}'
+        assert cache.version('TEST001') == 3
+
+    def test_cache_evicts_least_recently_used(self):
+        """Test that the cache stays within its bound."""
+        cache = AggregateCache(max_entries=2)
+
+        cache.get_or_compute('A', lambda: b'a')
+        cache.get_or_compute('B', lambda: b'b')
+        cache.get_or_compute('A', lambda: b'unused')
+        cache.get_or_compute('C', lambda: b'c')
+
+        # B was the least recently used entry
+        assert cache.get_or_compute('A', lambda: b'recomputed') == b'a'
+        assert cache.get_or_compute('B', lambda: b'recomputed') == b'recomputed'
+
+    def test_cache_does_not_store_errors(self):
+        """Test that a failed computation is retried on the next request."""
+        cache = AggregateCache(max_entries=10)
+
+        def fail():
+            raise ValueError("No results found for test ID: NAN")
+
+        with pytest.raises(ValueError):
+            cache.get_or_compute('NAN', fail)
+        assert cache.get_or_compute('NAN', lambda: b'ok') == b'ok'
+
+    def test_cache_single_flight(self):
+        """Test that concurrent misses for the same test share one computation."""
+        cache = AggregateCache(max_entries=10)
+        calls = []
+        results = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return b'shared'
+
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get_or_compute('TEST001', compute)))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+        assert results == [b'shared'] * 8
+
+class TestInvalidationListener:
+    def test_failed_connection_closed_before_reconnect(self, monkeypatch):
+        """Test that a connection whose LISTEN fails is closed before the listener retries."""
+        import psycopg2
+
+        class StopListener(Exception):
+            pass
+
+        class FailingCursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                return False
+
+            def execute(self, sql):
+                raise psycopg2.OperationalError('connection lost')
+
+        class FakeConnection:
+            closed = False
+
+            def cursor(self):
+                return FailingCursor()
+
+            def close(self):
+                self.closed = True
+
+        connections = []
+
+        def connect(url):
+            connections.append(FakeConnection())
+            return connections[-1]
+
+        def sleep(seconds):
+            # Stop after the first retry so the thread body returns
+            raise StopListener()
+
+        monkeypatch.setattr(psycopg2, 'connect', connect)
+        monkeypatch.setattr(cache_module.time, 'sleep', sleep)
+
+        listener = InvalidationListener('postgresql://unused', AggregateCache(max_entries=10))
+        with pytest.raises(StopListener):
+            listener.run()
+
+        assert len(connections) == 1
+        assert connections[0].closed
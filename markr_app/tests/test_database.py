@@ -0,0 +1,196 @@
+import os
+import pytest
+from sqlalchemy import create_engine, exc, text
+from markr_app.app import create_app
+from markr_app.config import TestingConfig
+from markr_app.database import (
+    REPLICA_BIND_PREFIX, InstrumentedQueuePool, ReplicaStatus, build_engine_options, build_replica_binds,
+    choose_read_engine, db, parse_lsn, replica_reads
+)
+from markr_app.models import TestResult
+
+class TestConnectionPool:
+    def test_engine_options_from_config(self):
+        """Test that the DB_* settings are turned into engine options."""
+        options = build_engine_options({
+            'DB_POOL_SIZE': 4,
+            'DB_MAX_OVERFLOW': 2,
+            'DB_POOL_TIMEOUT': 3,
+            'DB_POOL_RECYCLE': 600,
+            'DB_POOL_PRE_PING': True,
+            'DB_STATEMENT_TIMEOUT_MS': 1500,
+        })
+
+        assert options['poolclass'] is InstrumentedQueuePool
+        assert options['pool_size'] == 4
+        assert options['max_overflow'] == 2
+        assert options['pool_timeout'] == 3
+        assert options['pool_recycle'] == 600
+        assert options['pool_pre_ping'] is True
+        assert options['connect_args'] == {'options': '-c statement_timeout=1500'}
+
+    def test_statement_timeout_is_optional(self):
+        """Test that a zero statement timeout leaves the server default alone."""
+        options = build_engine_options({
+            'DB_POOL_SIZE': 1,
+            'DB_MAX_OVERFLOW': 0,
+            'DB_POOL_TIMEOUT': 1,
+            'DB_POOL_RECYCLE': -1,
+            'DB_POOL_PRE_PING': False,
+            'DB_STATEMENT_TIMEOUT_MS': 0,
+        })
+
+        assert 'connect_args' not in options
+
+    def test_pool_records_checkouts_and_timeouts(self):
+        """Test that the pool counts checkouts, waits and timeouts."""
+        engine = create_engine('sqlite://', poolclass=InstrumentedQueuePool,
+                               pool_size=1, max_overflow=0, pool_timeout=0.05)
+
+        with engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+
+            # The only connection is in use, so a second checkout times out
+            with pytest.raises(exc.TimeoutError):
+                engine.connect()
+
+            stats = engine.pool.stats()
+            assert stats['checked_out'] == 1
+
+        stats = engine.pool.stats()
+        assert stats['pool_size'] == 1
+        assert stats['checked_out'] == 0
+        assert stats['checkouts'] == 2
+        assert stats['timeouts'] == 1
+        assert stats['wait_seconds_max'] >= 0.05
+        engine.dispose()
+
+
+class TestPoolDiagnostics:
+    def test_pool_endpoint(self, client):
+        """Test that the pool diagnostics endpoint reports the default engine."""
+        response = client.get('/health/pool')
+
+        assert response.status_code == 200
+        pool = response.json['pools']['default']
+        assert pool['pool_size'] == 2
+        assert pool['timeouts'] == 0
+
+
+@pytest.fixture
+def replica_app(monkeypatch):
+    """An app whose 'replica' is the test database itself, unless a real one is configured"""
+    replicas = TestingConfig.SQLALCHEMY_REPLICA_URIS or [TestingConfig.SQLALCHEMY_DATABASE_URI]
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_REPLICA_URIS', replicas)
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+    # init_app registers a metadata per bind on the shared db, which later apps
+    # without replicas would otherwise try to create & drop
+    for bind_key in list(db.metadatas):
+        if bind_key and bind_key.startswith(REPLICA_BIND_PREFIX):
+            del db.metadatas[bind_key]
+
+
+class TestReadReplicas:
+    def test_replica_binds_from_config(self):
+        """Test that each replica URL becomes a numbered bind."""
+        binds = build_replica_binds({
+            'SQLALCHEMY_REPLICA_URIS': ['postgresql://a/db', 'postgresql://b/db'],
+            'SQLALCHEMY_ENGINE_OPTIONS': {'pool_size': 3, 'connect_args': {'options': '-c statement_timeout=1500'}},
+            'REPLICA_CONNECT_TIMEOUT': 4,
+        })
+
+        assert sorted(binds) == ['replica_0', 'replica_1']
+        assert binds['replica_1']['url'] == 'postgresql://b/db'
+        assert binds['replica_0']['pool_size'] == 3
+        assert binds['replica_0']['connect_args'] == {'options': '-c statement_timeout=1500', 'connect_timeout': 4}
+        assert build_replica_binds({}) == {}
+
+    def test_parse_lsn(self):
+        """Test that WAL locations compare in replay order."""
+        assert parse_lsn('0/16B3748') < parse_lsn('0/16B3750') < parse_lsn('1/0')
+        with pytest.raises(ValueError):
+            parse_lsn('16B3748')
+
+    def test_replica_status_checks(self, monkeypatch):
+        """Test that lagging, behind or unreachable replicas are not used."""
+        status = ReplicaStatus(engine=None)
+        refreshes = []
+
+        def refresh(replay_lsn, lag_seconds, error=None):
+            def apply():
+                refreshes.append(replay_lsn)
+                status.replay_lsn, status.lag_seconds, status.error = replay_lsn, lag_seconds, error
+                status.checked_at = 0 if error else float('inf')
+            monkeypatch.setattr(status, 'refresh', apply)
+
+        refresh(100, 0.5)
+        assert status.usable(max_lag_seconds=1, min_lsn=None, ttl=1)
+        assert status.usable(max_lag_seconds=1, min_lsn=50, ttl=1)
+        assert not status.usable(max_lag_seconds=0.1, min_lsn=None, ttl=1)
+        assert refreshes == [100]
+
+        # A replica behind the requested write is asked again before giving up
+        refresh(200, 0.5)
+        assert status.usable(max_lag_seconds=1, min_lsn=150, ttl=1)
+        assert refreshes == [100, 200]
+
+        refresh(None, None, error='connection refused')
+        status.checked_at = None
+        assert not status.usable(max_lag_seconds=1, min_lsn=None, ttl=1)
+
+    def test_replica_status_refresh_does_not_block(self, monkeypatch):
+        """Test that a replica being refreshed by another thread counts as unusable."""
+        status = ReplicaStatus(engine=None)
+        status.replay_lsn, status.lag_seconds, status.error, status.checked_at = 100, 0.0, None, 0
+        monkeypatch.setattr(status, 'refresh', lambda: pytest.fail("Refreshed while another refresh ran"))
+
+        status.lock.acquire()
+        try:
+            assert not status.usable(max_lag_seconds=1, min_lsn=None, ttl=1)
+        finally:
+            status.lock.release()
+
+    def test_reads_use_replica(self, replica_app):
+        """Test that reads inside replica_reads go to the replica engine."""
+        replica = db.engines['replica_0']
+
+        with replica_reads() as engine:
+            assert engine is replica
+            assert db.session.get_bind() is replica
+        assert db.session.get_bind() is db.engine
+
+    def test_read_your_writes(self, replica_app):
+        """Test that an import's X-Write-LSN lets the client read its own results."""
+        client = replica_app.test_client()
+        xml = b'''<mcq-test-results><mcq-test-result>
+            <first-name>Jane</first-name><last-name>Austen</last-name>
+            <student-number>521585128</student-number><test-id>1234</test-id>
+            <summary-marks available="20" obtained="13" />
+        </mcq-test-result></mcq-test-results>'''
+
+        response = client.post('/import', data=xml, headers={'Content-Type': 'text/xml+markr'})
+        lsn = response.headers['X-Write-LSN']
+
+        assert choose_read_engine(lsn) in (db.engines['replica_0'], None)
+        response = client.get('/results/1234/aggregate', headers={'X-Min-LSN': lsn})
+        assert response.status_code == 200
+        assert response.get_json()['count'] == 1
+
+    @pytest.mark.skipif(not os.environ.get('TEST_REPLICA_DATABASE_URL'),
+                        reason='Needs a streaming replica of the test database in TEST_REPLICA_DATABASE_URL')
+    def test_streaming_replica_catches_up(self, replica_app):
+        """Test that a real replica serves reads once it has replayed the write."""
+        TestResult.query.delete()
+        db.session.add(TestResult('S1', 'TEST001', 'A', 'B', 10, 20))
+        db.session.commit()
+        lsn = db.session.scalar(text("SELECT pg_current_wal_lsn()::text"))
+
+        with replica_reads(lsn) as engine:
+            if engine is not None:
+                assert TestResult.query.filter_by(test_id='TEST001').count() == 1
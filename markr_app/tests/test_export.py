@@ -0,0 +1,77 @@
+import csv
+import io
+import json
+from datetime import datetime, timezone
+from markr_app.models import TestResult
+from markr_app.services.export import EXPORT_COLUMNS, format_csv, format_ndjson
+
+def _add_results(session):
+    """Store five results over two tests & two scan days"""
+    for index in range(5):
+        session.add(TestResult(
+            student_number=f"S{index}", test_id='TEST001' if index < 3 else 'TEST002',
+            first_name='Jane', last_name='Austen, Jr' if index == 0 else 'Doe',
+            marks_obtained=index, marks_available=20,
+            scanned_at=datetime(2022, 10, 1 + index % 2, 12, 0, tzinfo=timezone.utc),
+        ))
+    session.commit()
+
+class TestExportFormats:
+    def test_format_ndjson(self):
+        """Test that each row becomes one JSON object per line."""
+        row = (1, 'S1', 'TEST001', 'Jane', 'Austen', 13, 20,
+               datetime(2022, 10, 1, 12, 0, tzinfo=timezone.utc), None)
+
+        lines = format_ndjson([row, row]).splitlines()
+
+        assert len(lines) == 2
+        assert json.loads(lines[0])['scanned_at'] == '2022-10-01T12:00:00+00:00'
+        assert list(json.loads(lines[0])) == list(EXPORT_COLUMNS)
+
+    def test_format_csv(self):
+        """Test that CSV output has an optional header and quotes awkward values."""
+        row = (1, 'S1', 'TEST001', 'Jane', 'Austen, Jr', 13, 20, None, None)
+
+        assert format_csv([], header=True) == ','.join(EXPORT_COLUMNS) + '\r\n'
+        assert list(csv.reader(io.StringIO(format_csv([row]))))[0][4] == 'Austen, Jr'
+
+class TestExportEndpoint:
+    def test_export_test_ndjson(self, app, client, session):
+        """Test that a test's results stream across several keyset pages."""
+        _add_results(session)
+        app.config['EXPORT_PAGE_SIZE'] = 2
+
+        response = client.get('/results/export?test_id=TEST001')
+
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert [result['student_number'] for result in results] == ['S0', 'S1', 'S2']
+
+    def test_export_date_range_csv(self, client, session):
+        """Test exporting a scan date range as CSV, chosen through the Accept header."""
+        _add_results(session)
+
+        response = client.get('/results/export?from=2022-10-02&to=2022-10-03', headers={'Accept': 'text/csv'})
+
+        assert response.status_code == 200
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+        assert [row['student_number'] for row in rows] == ['S1', 'S3']
+
+    def test_export_resumes_after_id(self, client, session):
+        """Test that after_id resumes an export where it stopped."""
+        _add_results(session)
+        first = json.loads(client.get('/results/export?test_id=TEST001').get_data(as_text=True).splitlines()[0])
+
+        response = client.get(f"/results/export?test_id=TEST001&after_id={first['id']}&format=csv")
+
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+        assert [row['student_number'] for row in rows] == ['S1', 'S2']
+
+    def test_export_bad_requests(self, client, session):
+        """Test that exports need a filter, valid timestamps & after_id, and a known format."""
+        assert client.get('/results/export').status_code == 400
+        assert client.get('/results/export?from=yesterday').status_code == 400
+        assert client.get('/results/export?test_id=TEST001&format=xml').status_code == 400
+        assert client.get('/results/export?test_id=TEST001&after_id=abc').status_code == 400
+        assert client.get('/results/export?test_id=TEST001&after_id=-5').status_code == 400
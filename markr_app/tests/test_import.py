@@ -1,5 +1,7 @@
+import gzip
 import pytest
-from markr_app.models import TestResult
+from markr_app.models import ImportDocument, TestResult
+from markr_app.services import ingestion
 
 class TestImport:
     def test_successful_import_single(self, client, valid_xml_single, session):
@@ -115,4 +117,89 @@ class TestImport:
         
         # Verify no data was saved to the database
         results = TestResult.query.all()
-        assert len(results) == 0
\ No newline at end of file
+        assert len(results) == 0
+
+    def test_import_rescan_across_requests(self, client, xml_with_duplicates, session):
+        """Test that a later, higher rescan replaces the stored result and a lower one is skipped."""
+        # Sample generated by AI
+        xml_lower = b'''<?xml version="1.0" encoding="UTF-8" ?>
+        <mcq-test-results>
+            <mcq-test-result scanned-on="2022-10-12T09:00:00Z">
+                <first-name>Johnny</first-name>
+                <last-name>Doe</last-name>
+                <student-number>S12345</student-number>
+                <test-id>TEST001</test-id>
+                <summary-marks available="25" obtained="10" />
+            </mcq-test-result>
+        </mcq-test-results>
+        '''
+
+        # Import the document holding the higher score first
+        response = client.post('/import',
+                              data=xml_with_duplicates,
+                              headers={'Content-Type': 'text/xml+markr'})
+        assert response.status_code == 200
+
+        # A lower score keeps the stored details but raises the available marks
+        response = client.post('/import',
+                              data=xml_lower,
+                              headers={'Content-Type': 'text/xml+markr'})
+        assert response.status_code == 200
+
+        results = TestResult.query.filter_by(student_number='S12345', test_id='TEST001').all()
+        assert len(results) == 1
+        assert results[0].first_name == 'John'
+        assert results[0].marks_obtained == 18
+        assert results[0].marks_available == 25
+
+class TestImportDeduplication:
+    def test_identical_document_replayed(self, client, valid_xml_multiple, session, monkeypatch):
+        """Test that a re-sent document gets the original response without being parsed."""
+        first = client.post('/import', data=valid_xml_multiple, headers={'Content-Type': 'text/xml+markr'})
+        assert first.status_code == 200
+        assert 'Idempotent-Replayed' not in first.headers
+
+        def fail(xml_content):
+            raise AssertionError("A duplicate document was parsed")
+        monkeypatch.setattr(ingestion, 'ingest_test_results', fail)
+
+        # The same document, compressed this time
+        second = client.post('/import', data=gzip.compress(valid_xml_multiple),
+                             headers={'Content-Type': 'text/xml+markr', 'Content-Encoding': 'gzip'})
+
+        assert second.status_code == 200
+        assert second.headers['Idempotent-Replayed'] == 'true'
+        assert second.json == first.json
+        assert ImportDocument.query.count() == 1
+
+    def test_idempotency_key_replayed(self, client, valid_xml_single, invalid_xml_syntax, session):
+        """Test that a known Idempotency-Key is answered without reading the body."""
+        headers = {'Content-Type': 'text/xml+markr', 'Idempotency-Key': 'scanner-7/batch-42'}
+        first = client.post('/import', data=valid_xml_single, headers=headers)
+
+        second = client.post('/import', data=invalid_xml_syntax, headers=headers)
+
+        assert second.status_code == 200
+        assert second.json == first.json
+        assert ImportDocument.query.one().idempotency_key == 'scanner-7/batch-42'
+
+    def test_rejected_document_not_remembered(self, client, invalid_xml_missing_fields, session):
+        """Test that only accepted documents are recorded, so a rejection is repeated."""
+        for _ in range(2):
+            response = client.post('/import', data=invalid_xml_missing_fields,
+                                   headers={'Content-Type': 'text/xml+markr'})
+            assert response.status_code == 400
+            assert 'Idempotent-Replayed' not in response.headers
+
+        assert ImportDocument.query.count() == 0
+
+    def test_async_duplicate_replayed(self, client, valid_xml_multiple, session):
+        """Test that a re-sent asynchronous document points at the original job."""
+        headers = {'Content-Type': 'text/xml+markr', 'Prefer': 'respond-async'}
+        first = client.post('/import', data=valid_xml_multiple, headers=headers)
+
+        second = client.post('/import', data=valid_xml_multiple, headers=headers)
+
+        assert second.status_code == 202
+        assert second.json['job_id'] == first.json['job_id']
+        assert second.headers['Location'] == first.headers['Location']
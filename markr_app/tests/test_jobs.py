@@ -0,0 +1,127 @@
+import pytest
+from markr_app.database import db
+from markr_app.models import ImportJob, TestResult
+from markr_app.services import jobs
+from markr_app.services.jobs import enqueue_import, process_next_import_job
+
+class TestImportJobs:
+    def test_async_import_accepted(self, client, valid_xml_multiple, session):
+        """Test that an asynchronous import is queued and processed by a worker."""
+        response = client.post('/import',
+                              data=valid_xml_multiple,
+                              headers={'Content-Type': 'text/xml+markr', 'Prefer': 'respond-async'})
+
+        # The document is queued, not imported
+        assert response.status_code == 202
+        job_id = response.json['job_id']
+        assert response.headers['Location'].endswith(f'/import/{job_id}')
+        assert TestResult.query.count() == 0
+
+        response = client.get(f'/import/{job_id}')
+        assert response.status_code == 200
+        assert response.json['status'] == 'pending'
+
+        # A worker claims & completes the job
+        job = process_next_import_job()
+        assert job.id == job_id
+        assert job.status == ImportJob.STATUS_COMPLETED
+        assert TestResult.query.filter_by(test_id='TEST001').count() == 3
+
+        response = client.get(f'/import/{job_id}')
+        assert response.json['status'] == 'completed'
+        assert response.json['processed_count'] == 3
+
+        # Nothing is left to claim
+        assert process_next_import_job() is None
+
+    def test_async_import_rejected(self, app, client, invalid_xml_missing_fields, session):
+        """Test that a rejected asynchronous import reports why."""
+        app.config['IMPORT_ASYNC'] = True
+
+        response = client.post('/import',
+                              data=invalid_xml_missing_fields,
+                              headers={'Content-Type': 'text/xml+markr'})
+        assert response.status_code == 202
+        job_id = response.json['job_id']
+
+        job = process_next_import_job()
+        assert job.status == ImportJob.STATUS_REJECTED
+
+        response = client.get(f'/import/{job_id}')
+        assert response.json['status'] == 'rejected'
+        assert 'Missing required fields' in response.json['message']
+        assert TestResult.query.count() == 0
+
+    def test_import_job_not_found(self, client, session):
+        """Test the status endpoint for an unknown job."""
+        response = client.get('/import/999999')
+
+        assert response.status_code == 404
+        assert 'Not Found' in response.json['error']
+
+    def test_async_import_data_error_rejected(self, session):
+        """Test that a database data error rejects a job instead of retrying it."""
+        xml = b'''<mcq-test-results>
+            <mcq-test-result>
+                <first-name>''' + b'J' * 200 + b'''</first-name>
+                <last-name>Doe</last-name>
+                <student-number>S1</student-number>
+                <test-id>TEST001</test-id>
+                <summary-marks available="20" obtained="15" />
+            </mcq-test-result>
+        </mcq-test-results>'''
+        job_id = enqueue_import(xml).id
+
+        job = process_next_import_job()
+
+        assert job.id == job_id
+        assert job.status == ImportJob.STATUS_REJECTED
+        assert job.attempts == 1
+        assert 'Failed to process test results' in job.error
+
+    def test_attempt_counted_before_import(self, session, valid_xml_single, monkeypatch):
+        """Test that an import killing the worker still uses up the job's attempts."""
+        job_id = enqueue_import(valid_xml_single).id
+
+        def crash(document):
+            raise SystemExit(1)
+        monkeypatch.setattr(jobs, 'ingest_test_results', crash)
+
+        with pytest.raises(SystemExit):
+            process_next_import_job(max_attempts=1)
+        db.session.rollback()
+        assert db.session.get(ImportJob, job_id).attempts == 1
+
+        # The next claim gives up without running the import again
+        job = process_next_import_job(max_attempts=1)
+        assert job.status == ImportJob.STATUS_FAILED
+        assert 'Gave up after 1 attempts' in job.error
+
+    def test_resend_after_failed_job(self, client, valid_xml_single, session, monkeypatch):
+        """Test that a document whose job failed is queued again when it's resent."""
+        headers = {'Content-Type': 'text/xml+markr', 'Prefer': 'respond-async'}
+        first_job_id = client.post('/import', data=valid_xml_single, headers=headers).json['job_id']
+
+        def outage(document):
+            raise RuntimeError("database unavailable")
+        monkeypatch.setattr(jobs, 'ingest_test_results', outage)
+        assert process_next_import_job(max_attempts=1).status == ImportJob.STATUS_FAILED
+        monkeypatch.undo()
+
+        response = client.post('/import', data=valid_xml_single, headers=headers)
+
+        assert response.status_code == 202
+        assert 'Idempotent-Replayed' not in response.headers
+        assert response.json['job_id'] != first_job_id
+        assert process_next_import_job().status == ImportJob.STATUS_COMPLETED
+
+    def test_resend_after_rejected_job(self, client, invalid_xml_missing_fields, session):
+        """Test that a rejected document isn't remembered, as for synchronous imports."""
+        headers = {'Content-Type': 'text/xml+markr', 'Prefer': 'respond-async'}
+        first_job_id = client.post('/import', data=invalid_xml_missing_fields, headers=headers).json['job_id']
+        assert process_next_import_job().status == ImportJob.STATUS_REJECTED
+
+        response = client.post('/import', data=invalid_xml_missing_fields, headers=headers)
+
+        assert response.status_code == 202
+        assert response.json['job_id'] != first_job_id
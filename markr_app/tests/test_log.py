@@ -0,0 +1,63 @@
+import json
+import logging
+import sys
+from markr_app.utils.log import JsonFormatter
+
+class TestJsonFormatter:
+    def test_format_includes_extra_fields(self):
+        """Test that records become one JSON object including their extra fields."""
+        record = logging.LogRecord('markr_app.services.ingestion', logging.INFO, __file__, 1,
+                                   'Processed %d test results', (3,), None)
+        record.event = 'import_summary'
+        record.inserted = 3
+
+        entry = json.loads(JsonFormatter().format(record))
+
+        assert entry['level'] == 'INFO'
+        assert entry['logger'] == 'markr_app.services.ingestion'
+        assert entry['message'] == 'Processed 3 test results'
+        assert entry['event'] == 'import_summary'
+        assert entry['inserted'] == 3
+        assert 'args' not in entry and 'msg' not in entry
+
+    def test_format_exception(self):
+        """Test that exceptions are included in the JSON object."""
+        try:
+            raise RuntimeError('boom')
+        except RuntimeError:
+            record = logging.LogRecord('markr_app', logging.ERROR, __file__, 1, 'Failed', (), None)
+            record.exc_info = sys.exc_info()
+
+        entry = json.loads(JsonFormatter().format(record))
+
+        assert 'RuntimeError: boom' in entry['exc_info']
+
+
+class TestImportLogging:
+    def test_one_summary_per_document(self, client, xml_with_duplicates, session, caplog):
+        """Test that an import logs a single summary event and no per-row events."""
+        caplog.set_level(logging.INFO, logger='markr_app.services.ingestion')
+
+        response = client.post('/import', data=xml_with_duplicates, headers={'Content-Type': 'text/xml+markr'})
+
+        assert response.status_code == 200
+        summaries = [record for record in caplog.records if getattr(record, 'event', None) == 'import_summary']
+        assert len(summaries) == 1
+        assert summaries[0].parsed > summaries[0].inserted > 0
+        assert summaries[0].duration_ms >= 0
+        assert not [record for record in caplog.records if getattr(record, 'event', None) == 'import_row']
+
+    def test_rows_logged_at_debug(self, app, client, xml_with_duplicates, session, caplog):
+        """Test that DEBUG logging adds an event for every distinct row."""
+        caplog.set_level(logging.DEBUG, logger='markr_app.services.ingestion')
+        # Import the document twice, rather than have the second request deduplicated
+        app.config['IMPORT_DEDUPLICATE'] = False
+
+        client.post('/import', data=xml_with_duplicates, headers={'Content-Type': 'text/xml+markr'})
+        client.post('/import', data=xml_with_duplicates, headers={'Content-Type': 'text/xml+markr'})
+
+        rows = [record for record in caplog.records if getattr(record, 'event', None) == 'import_row']
+        outcomes = [record.outcome for record in rows]
+        assert 'inserted' in outcomes
+        assert 'skipped' in outcomes
+        assert all(record.levelno == logging.DEBUG for record in rows)
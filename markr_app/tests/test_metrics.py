@@ -0,0 +1,134 @@
+import json
+import os
+from markr_app.app import create_app
+from markr_app.utils.metrics import (
+    REGISTRY, ROWS_PARSED, ROWS_WRITTEN, MetricsRegistry, record_phase
+)
+
+class TestMetricsRegistry:
+    def test_render_counter_and_histogram(self):
+        """Test the Prometheus text format of counters & histograms."""
+        registry = MetricsRegistry()
+        requests = registry.counter('demo_requests_total', 'Requests', ('endpoint',))
+        latency = registry.histogram('demo_seconds', 'Latency', buckets=(0.1, 1))
+
+        requests.inc(endpoint='/import')
+        requests.inc(2, endpoint='/import')
+        requests.inc(endpoint='/say "hi"')
+        latency.observe(0.05)
+        latency.observe(0.5)
+        latency.observe(5)
+
+        lines = registry.render().splitlines()
+
+        assert '# TYPE demo_requests_total counter' in lines
+        assert 'demo_requests_total{endpoint="/import"} 3' in lines
+        assert 'demo_requests_total{endpoint="/say \\"hi\\""} 1' in lines
+        assert '# TYPE demo_seconds histogram' in lines
+        assert 'demo_seconds_bucket{le="0.1"} 1' in lines
+        assert 'demo_seconds_bucket{le="1"} 2' in lines
+        assert 'demo_seconds_bucket{le="+Inf"} 3' in lines
+        assert 'demo_seconds_sum 5.55' in lines
+        assert 'demo_seconds_count 3' in lines
+
+    def test_multiprocess_totals(self, tmp_path):
+        """Test that every process's values are added up, including exited processes."""
+        registry = MetricsRegistry()
+        registry.multiprocess_dir = str(tmp_path)
+        rows = registry.counter('demo_rows_total', 'Rows', ('outcome',))
+        latency = registry.histogram('demo_seconds', 'Latency', buckets=(1,))
+
+        rows.inc(5, outcome='inserted')
+        latency.observe(0.5)
+
+        # Values written by another (possibly exited) worker
+        (tmp_path / 'metrics-1.json').write_text(json.dumps({
+            'demo_rows_total': {'["inserted"]': 2, '["skipped"]': 1},
+            'demo_seconds': {'[]': {'buckets': [0], 'sum': 2.0, 'count': 1}},
+        }))
+
+        lines = registry.render().splitlines()
+
+        assert 'demo_rows_total{outcome="inserted"} 7' in lines
+        assert 'demo_rows_total{outcome="skipped"} 1' in lines
+        assert 'demo_seconds_bucket{le="1"} 1' in lines
+        assert 'demo_seconds_count 2' in lines
+
+    def test_mark_process_dead(self, tmp_path):
+        """Test that exited processes are folded into one file without changing the totals."""
+        registry = MetricsRegistry()
+        registry.multiprocess_dir = str(tmp_path)
+        registry.counter('demo_rows_total', 'Rows', ('outcome',))
+        registry.histogram('demo_seconds', 'Latency', buckets=(1,))
+
+        for pid in (1, 2):
+            (tmp_path / f'metrics-{pid}.json').write_text(json.dumps({
+                'demo_rows_total': {'["inserted"]': pid},
+                'demo_seconds': {'[]': {'buckets': [1], 'sum': 0.5, 'count': 1}},
+            }))
+        before = registry.render()
+
+        registry.mark_process_dead(1)
+        registry.mark_process_dead(2)
+
+        assert {path.name for path in tmp_path.iterdir()} == {'metrics-dead.json', f'metrics-{os.getpid()}.json'}
+        assert registry.render() == before
+        assert 'demo_rows_total{outcome="inserted"} 3' in before.splitlines()
+
+class TestServerTiming:
+    def test_server_timing_header(self):
+        """Test that phases recorded during a request end up in its Server-Timing header."""
+        app = create_app('testing')
+
+        @app.route('/timed')
+        def timed():
+            record_phase('parse', 0.012)
+            record_phase('upsert', 0.5)
+            record_phase('upsert', 0.25)
+            return 'OK'
+
+        response = app.test_client().get('/timed')
+        entries = [entry.strip() for entry in response.headers['Server-Timing'].split(',')]
+
+        assert entries[:2] == ['parse;dur=12.00', 'upsert;dur=750.00']
+        assert entries[2].startswith('total;dur=')
+
+    def test_server_timing_can_be_disabled(self):
+        """Test that SERVER_TIMING_ENABLED turns the header off."""
+        app = create_app('testing')
+        app.config['SERVER_TIMING_ENABLED'] = False
+
+        response = app.test_client().get('/health')
+
+        assert 'Server-Timing' not in response.headers
+
+    def test_metrics_endpoint(self):
+        """Test that /metrics serves the request counters."""
+        client = create_app('testing').test_client()
+        client.get('/health')
+
+        response = client.get('/metrics')
+
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain; version=0.0.4')
+        assert 'markr_http_requests_total{method="GET",endpoint="/health",status="200"}' \
+            in response.get_data(as_text=True)
+
+
+class TestImportMetrics:
+    def test_import_counts_rows(self, client, xml_with_duplicates, session):
+        """Test that imports count rows parsed, inserted, updated & skipped."""
+        def count(metric, **labels):
+            key = json.dumps([str(labels[name]) for name in metric.labelnames])
+            return REGISTRY._collect()[metric.name].get(key, 0)
+
+        parsed = count(ROWS_PARSED)
+        inserted = count(ROWS_WRITTEN, outcome='inserted')
+
+        response = client.post('/import', data=xml_with_duplicates,
+                               headers={'Content-Type': 'text/xml+markr'})
+
+        assert response.status_code == 200
+        assert 'upsert;dur=' in response.headers['Server-Timing']
+        assert 'commit;dur=' in response.headers['Server-Timing']
+        assert count(ROWS_PARSED) - parsed > count(ROWS_WRITTEN, outcome='inserted') - inserted > 0
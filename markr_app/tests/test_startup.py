@@ -0,0 +1,75 @@
+import os
+import subprocess
+import sys
+from sqlalchemy import inspect, text
+from markr_app.database import db
+from markr_app.models import TestResult
+from markr_app.schema import MIGRATIONS, init_schema, is_partitioned, partition_test_results
+
+class TestStartup:
+    def test_app_import_has_no_side_effects(self):
+        """Test that building the WSGI app neither touches the database nor loads NumPy."""
+        env = dict(os.environ, FLASK_ENV='testing', DB_HOST='invalid.invalid')
+        script = (
+            "import sys\n"
+            "from markr_app.wsgi import app\n"
+            "assert app.test_client().get('/health').status_code == 200\n"
+            "print('numpy' in sys.modules)\n"
+        )
+        output = subprocess.run(
+            [sys.executable, '-c', script], env=env,
+            capture_output=True, text=True, check=True,
+        ).stdout
+
+        assert output.strip() == 'False'
+
+
+class TestInitSchema:
+    def test_init_schema_is_idempotent(self, app):
+        """Test that init-db creates every table and can be run again safely."""
+        db.drop_all()
+
+        assert init_schema() == []
+        assert init_schema() == []
+
+        tables = set(inspect(db.engine).get_table_names())
+        assert {'test_results', 'test_statistics', 'import_jobs', 'schema_migrations'} <= tables
+
+    def test_init_db_command(self, app):
+        """Test the flask init-db command."""
+        result = app.test_cli_runner().invoke(args=['init-db'])
+
+        assert result.exit_code == 0
+        assert 'Database schema is up to date' in result.output
+
+    def test_init_schema_migrates_existing_tables(self, app):
+        """Test that pending migrations are applied to tables that already exist."""
+        init_schema()
+        db.session.execute(text("DROP INDEX ix_test_results_test_id_covering"))
+        db.session.execute(text("ALTER TABLE test_results DROP COLUMN answers"))
+        db.session.execute(text("DELETE FROM schema_migrations"))
+        db.session.commit()
+
+        assert init_schema() == [name for name, _ in MIGRATIONS]
+
+        columns = {column['name'] for column in inspect(db.engine).get_columns('test_results')}
+        indexes = {index['name'] for index in inspect(db.engine).get_indexes('test_results')}
+        assert 'answers' in columns
+        assert 'ix_test_results_test_id_covering' in indexes
+
+
+class TestPartitionResults:
+    def test_partition_results(self, app, client, valid_xml_multiple):
+        """Test that test_results can be moved into hash partitions & still be imported into."""
+        client.post('/import', data=valid_xml_multiple, headers={'Content-Type': 'text/xml+markr'})
+
+        assert partition_test_results(4, drop_old=True) == 3
+        assert is_partitioned('test_results')
+        assert partition_test_results(4) is None
+
+        # Rescans & new results still go through ON CONFLICT
+        app.config['IMPORT_DEDUPLICATE'] = False
+        response = client.post('/import', data=valid_xml_multiple, headers={'Content-Type': 'text/xml+markr'})
+        assert response.status_code == 200
+        assert TestResult.query.count() == 3
+        assert client.get('/results/TEST001/aggregate').status_code == 200
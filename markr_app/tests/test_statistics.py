@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from markr_app.services.statistics import (
+    StatisticsDelta, grouped_percentiles, histogram_percentiles, weighted_percentiles
+)
+
+class TestStatistics:
+    @pytest.mark.parametrize('marks', [
+        [15],
+        [15, 18, 12, 20, 10],
+        [0, 0, 0, 7],
+        [3, 3, 9, 9, 9, 1, 0, 20, 20, 4],
+    ])
+    def test_histogram_percentiles_match_numpy(self, marks):
+        """Test that histogram percentiles are identical to np.percentile over the raw marks."""
+        expected = np.percentile(marks, [25, 50, 75])
+        actual = histogram_percentiles(np.bincount(marks), [25, 50, 75])
+
+        assert actual.tolist() == expected.tolist()
+
+    def test_histogram_percentiles_random_samples(self):
+        """Test histogram percentiles against np.percentile over many random samples."""
+        rng = np.random.default_rng(1234)
+
+        for _ in range(500):
+            marks = rng.integers(0, rng.integers(1, 40), size=rng.integers(1, 200))
+            expected = np.percentile(marks, [25, 50, 75])
+            actual = histogram_percentiles(np.bincount(marks), [25, 50, 75])
+
+            assert actual.tolist() == expected.tolist()
+
+    def test_delta_tracks_rescans(self):
+        """Test that a rescan moves a student between marks without changing the count."""
+        delta = StatisticsDelta()
+        delta.add('TEST001', 12, 20)
+        delta.replace('TEST001', 12, 16, 20)
+
+        entry = delta.tests['TEST001']
+        assert entry['count'] == 1
+        assert entry['sum'] == 16
+        assert entry['sum_squares'] == 16 ** 2
+        assert entry['mark_changes'] == {12: 0, 16: 1}
+        assert entry['min_removed'] == 12
+
+    def test_grouped_percentiles_match_numpy(self):
+        """Test that vectorized per-group percentiles match np.percentile on each group."""
+        rng = np.random.default_rng(4321)
+        groups = [np.sort(rng.integers(0, 30, size=size)) for size in (1, 2, 5, 17, 64)]
+
+        counts = np.array([len(group) for group in groups])
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        actual = grouped_percentiles(np.concatenate(groups), starts, counts, [25, 50, 75])
+
+        for group, row in zip(groups, actual):
+            assert row.tolist() == np.percentile(group, [25, 50, 75]).tolist()
+
+    def test_weighted_percentiles_match_numpy(self):
+        """Test that percentiles of counted values match np.percentile over the repeated values."""
+        rng = np.random.default_rng(2468)
+
+        for _ in range(300):
+            # Percentages of tests with different marks available, some with no students
+            values = rng.integers(0, 30, size=rng.integers(1, 40)) * (100 / rng.integers(1, 30))
+            counts = rng.integers(0, 4, size=len(values))
+            counts[0] += 1
+            expected = np.percentile(np.repeat(values, counts), [25, 50, 75])
+            actual = weighted_percentiles(values, counts, [25, 50, 75])
+
+            assert actual.tolist() == expected.tolist()
@@ -0,0 +1,120 @@
+import gzip
+import hashlib
+import io
+import pytest
+from benchmarks.xml_generator import generate_markr_xml
+from markr_app.app import create_app
+from markr_app.models import TestResult
+from markr_app.services.uploads import open_upload, parse_content_encoding, spool_upload
+from markr_app.services.xml_parser import iter_test_results
+from markr_app.utils.errors import PayloadTooLargeError, ValidationError
+
+class TestOpenUpload:
+    def test_gzip_streams_into_parser(self):
+        """Test that a gzip body is decompressed incrementally into the parser."""
+        xml = generate_markr_xml(rows=2000, tests=2, answers=20)
+        upload = open_upload(io.BytesIO(gzip.compress(xml)), 'gzip')
+
+        assert sum(1 for _ in iter_test_results(upload)) == 2000
+
+    def test_multi_member_gzip(self):
+        """Test that concatenated gzip members are read as one document."""
+        upload = open_upload(io.BytesIO(gzip.compress(b'<mcq-') + gzip.compress(b'test-results/>')), 'gzip')
+
+        assert upload.read() == b'<mcq-test-results/>'
+
+    def test_identity_limit(self):
+        """Test that an unencoded body is held to the smaller of the two limits."""
+        upload = open_upload(io.BytesIO(b'x' * 100), 'identity', max_compressed_bytes=1000, max_decompressed_bytes=50)
+
+        with pytest.raises(PayloadTooLargeError):
+            upload.read()
+
+    def test_decompression_bomb(self):
+        """Test that decompression stops once the decompressed limit is exceeded."""
+        bomb = gzip.compress(b'\0' * 50_000_000)
+        upload = open_upload(io.BytesIO(bomb), 'gzip', max_compressed_bytes=len(bomb),
+                             max_decompressed_bytes=1_000_000)
+
+        with pytest.raises(PayloadTooLargeError, match='Decompressed request body'):
+            while upload.read(65536):
+                pass
+
+    def test_compressed_limit(self):
+        """Test that the body as sent is limited too."""
+        body = gzip.compress(generate_markr_xml(rows=500))
+        upload = open_upload(io.BytesIO(body), 'gzip', max_compressed_bytes=len(body) // 2)
+
+        with pytest.raises(PayloadTooLargeError, match='Request body exceeds'):
+            upload.read()
+
+    def test_corrupt_gzip(self):
+        """Test that truncated gzip data is a validation error."""
+        upload = open_upload(io.BytesIO(gzip.compress(b'<mcq-test-results/>')[:-6]), 'gzip')
+
+        with pytest.raises(ValidationError, match='Invalid gzip-encoded request body'):
+            upload.read()
+
+    def test_zstd(self):
+        """Test zstd bodies when a zstd library is installed."""
+        zstandard = pytest.importorskip('zstandard')
+        upload = open_upload(io.BytesIO(zstandard.ZstdCompressor().compress(b'<mcq-test-results/>')), 'zstd')
+
+        assert upload.read() == b'<mcq-test-results/>'
+
+    def test_spool_upload(self):
+        """Test that spooling hashes the decompressed document & spills large ones to disk."""
+        xml = generate_markr_xml(rows=500)
+        upload = open_upload(io.BytesIO(gzip.compress(xml)), 'gzip')
+
+        digest, spool = spool_upload(upload, max_memory=1024)
+
+        assert digest == hashlib.sha256(xml).hexdigest()
+        assert spool._rolled
+        assert sum(1 for _ in iter_test_results(spool)) == 500
+
+    def test_parse_content_encoding(self):
+        """Test reading the coding out of a Content-Encoding header."""
+        assert parse_content_encoding(None) == 'identity'
+        assert parse_content_encoding('GZip') == 'gzip'
+        assert parse_content_encoding('identity, gzip') == 'gzip'
+        assert parse_content_encoding('br') is None
+        assert parse_content_encoding('gzip, gzip') is None
+
+
+class TestCompressedImportEndpoint:
+    def _post(self, client, body, **headers):
+        return client.post('/import', data=body, headers={'Content-Type': 'text/xml+markr', **headers})
+
+    def test_unsupported_encoding(self):
+        """Test that an unknown Content-Encoding is rejected with a 415."""
+        response = self._post(create_app('testing').test_client(), b'...', **{'Content-Encoding': 'br'})
+
+        assert response.status_code == 415
+        assert 'gzip' in response.json['message']
+
+    def test_payload_too_large(self):
+        """Test that a body over the decompressed limit gets a 413."""
+        app = create_app('testing')
+        app.config['IMPORT_MAX_DECOMPRESSED_BYTES'] = 1000
+
+        response = self._post(app.test_client(), gzip.compress(b'<mcq-test-results>' + b' ' * 100_000),
+                              **{'Content-Encoding': 'gzip'})
+
+        assert response.status_code == 413
+        assert response.json['error'] == 'Payload Too Large'
+
+    def test_empty_compressed_body(self):
+        """Test that a body that decompresses to nothing is empty."""
+        response = self._post(create_app('testing').test_client(), gzip.compress(b''),
+                              **{'Content-Encoding': 'gzip'})
+
+        assert response.status_code == 400
+        assert response.json['message'] == 'Request body is empty'
+
+    def test_gzip_import(self, client, valid_xml_multiple, session):
+        """Test importing a gzip-encoded document."""
+        response = self._post(client, gzip.compress(valid_xml_multiple), **{'Content-Encoding': 'gzip'})
+
+        assert response.status_code == 200
+        assert TestResult.query.filter_by(test_id='TEST001').count() == 3
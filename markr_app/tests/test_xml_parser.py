@@ -1,6 +1,9 @@
 import pytest
 from datetime import datetime, timezone
-from markr_app.services.xml_parser import parse_test_results
+import io
+import types
+from markr_app.services.answers import unpack_answers
+from markr_app.services.xml_parser import iter_test_results, parse_test_results
 from markr_app.utils.errors import ValidationError
 
 class TestXmlParser:
@@ -77,6 +80,13 @@ class TestXmlParser:
         
         assert 'Invalid root element' in str(excinfo.value)
     
+    def test_parse_wrong_root_element_without_records(self):
+        """Test that a wrong root element is reported even when it holds no records"""
+        with pytest.raises(ValidationError) as excinfo:
+            parse_test_results(b'<wrong-root><other /></wrong-root>')
+
+        assert 'Invalid root element: wrong-root' in str(excinfo.value)
+
     def test_parse_negative_marks(self):
         """Test parsing XML with negative marks."""
         
@@ -115,4 +125,159 @@ class TestXmlParser:
         with pytest.raises(ValidationError) as excinfo:
             parse_test_results(xml_non_integer_marks)
         
-        assert 'Marks must be integers' in str(excinfo.value) 
\ No newline at end of file
+        assert 'Marks must be integers' in str(excinfo.value) 
+
+    def test_iter_results_streams_records(self, valid_xml_multiple):
+        """Test that the streaming parser yields records lazily from a file-like object."""
+        results = iter_test_results(io.BytesIO(valid_xml_multiple))
+
+        # Records are produced by a generator rather than a list
+        assert isinstance(results, types.GeneratorType)
+
+        first = next(results)
+        assert first['student_number'] == 'S12345'
+        assert [result['student_number'] for result in results] == ['S67890', 'S24680']
+
+    def test_iter_results_ignores_gunk(self):
+        """Test that answers & unknown elements do not affect the streamed records."""
+
+        # Sample generated by AI
+        xml_with_gunk = b'''<?xml version="1.0" encoding="UTF-8" ?>
+        <mcq-test-results>
+            <reporting-gunk><mcq-test-result /></reporting-gunk>
+            <mcq-test-result scanned-on="2017-12-04T12:12:10+11:00">
+                <first-name>Jane</first-name>
+                <last-name>Austen</last-name>
+                <student-number>521585128</student-number>
+                <test-id>1234</test-id>
+                <summary-marks available="20" obtained="13" />
+                <answer question="1" marks-available="1" marks-awarded="1">A</answer>
+            </mcq-test-result>
+        </mcq-test-results>
+        '''
+
+        results = list(iter_test_results(xml_with_gunk))
+
+        assert len(results) == 1
+        assert results[0]['test_id'] == '1234'
+        assert results[0]['marks_obtained'] == 13
+
+    def test_iter_results_bad_record_after_valid_ones(self, valid_xml_multiple):
+        """Test that a bad record late in the document still raises from the stream."""
+        xml_bad_tail = valid_xml_multiple.replace(
+            b'<summary-marks available="20" obtained="12" />',
+            b'<summary-marks available="20" />'
+        )
+
+        with pytest.raises(ValidationError) as excinfo:
+            list(iter_test_results(xml_bad_tail))
+
+        assert 'Missing required fields' in str(excinfo.value)
+
+    def test_iter_results_skips_nested_records(self):
+        """Test that a record nested below the top level is not read as a result."""
+        xml_nested = b'''<?xml version="1.0" encoding="UTF-8" ?>
+        <mcq-test-results>
+            <mcq-test-result>
+                <first-name>Jane</first-name>
+                <last-name>Austen</last-name>
+                <student-number>521585128</student-number>
+                <test-id>1234</test-id>
+                <summary-marks available="20" obtained="13" />
+                <reporting-gunk>
+                    <mcq-test-result><test-id>9999</test-id></mcq-test-result>
+                </reporting-gunk>
+            </mcq-test-result>
+        </mcq-test-results>
+        '''
+
+        results = list(iter_test_results(xml_nested))
+
+        assert [result['test_id'] for result in results] == ['1234']
+
+    def test_parse_first_field_occurrence_wins(self):
+        """Test that a repeated field takes its first value, and an empty one is ''."""
+        xml_repeated = b'''<?xml version="1.0" encoding="UTF-8" ?>
+        <mcq-test-results>
+            <mcq-test-result>
+                <first-name />
+                <last-name>Austen</last-name>
+                <student-number>521585128</student-number>
+                <test-id>1234</test-id>
+                <test-id>5678</test-id>
+                <summary-marks available="20" obtained="13" />
+                <summary-marks available="10" obtained="1" />
+            </mcq-test-result>
+        </mcq-test-results>
+        '''
+
+        results = parse_test_results(xml_repeated)
+
+        assert results[0]['first_name'] == ''
+        assert results[0]['test_id'] == '1234'
+        assert results[0]['marks_obtained'] == 13
+
+    def test_parse_repeated_timestamps(self, caplog):
+        """Test that repeated timestamps parse alike, and each invalid one is still logged."""
+        record = '''
+            <mcq-test-result scanned-on="{}">
+                <first-name>Jane</first-name>
+                <last-name>Austen</last-name>
+                <student-number>{}</student-number>
+                <test-id>1234</test-id>
+                <summary-marks available="20" obtained="13" />
+            </mcq-test-result>'''
+        xml_timestamps = ('<mcq-test-results>' + ''.join([
+            record.format('2017-12-04T12:12:10+11:00', 1),
+            record.format('2017-12-04T12:12:10+11:00', 2),
+            record.format('not-a-date', 3),
+            record.format('not-a-date', 4),
+        ]) + '</mcq-test-results>').encode()
+
+        results = parse_test_results(xml_timestamps)
+
+        assert results[0]['scanned_at'] == results[1]['scanned_at']
+        assert results[0]['scanned_at'].utcoffset().total_seconds() == 11 * 3600
+        assert results[2]['scanned_at'] is None and results[3]['scanned_at'] is None
+        assert caplog.text.count('Invalid timestamp format: not-a-date') == 2
+
+    def test_parse_answers(self, caplog):
+        """Test that answers are packed with each record, and invalid ones are dropped."""
+        record = '''
+            <mcq-test-result>
+                <first-name>Jane</first-name>
+                <last-name>Austen</last-name>
+                <student-number>{}</student-number>
+                <test-id>1234</test-id>
+                <answer question="1" marks-available="1" marks-awarded="1">A</answer>
+                <answer question="2" marks-available="1" marks-awarded="{}">B</answer>
+                <summary-marks available="2" obtained="1" />
+            </mcq-test-result>'''
+        xml_answers = ('<mcq-test-results>' + record.format(1, 0) + record.format(2, 'x')
+                       + '</mcq-test-results>').encode()
+
+        results = parse_test_results(xml_answers)
+
+        assert unpack_answers(results[0]['answers']).tolist() == [[1, 1, 1], [2, 1, 0]]
+        assert results[1]['answers'] is None
+        assert 'Invalid answer for student 2' in caplog.text
+
+    def test_verify_summary_marks(self):
+        """Test that summary marks are only checked against the answers when asked."""
+        xml_mismatch = b'''<mcq-test-results>
+            <mcq-test-result>
+                <first-name>Jane</first-name>
+                <last-name>Austen</last-name>
+                <student-number>521585128</student-number>
+                <test-id>1234</test-id>
+                <answer question="1" marks-available="1" marks-awarded="1">A</answer>
+                <summary-marks available="1" obtained="0" />
+            </mcq-test-result>
+        </mcq-test-results>'''
+
+        assert len(list(iter_test_results(xml_mismatch))) == 1
+
+        with pytest.raises(ValidationError) as excinfo:
+            list(iter_test_results(xml_mismatch, verify_summary_marks=True))
+
+        assert 'Summary marks do not match the answers for student 521585128' in str(excinfo.value)
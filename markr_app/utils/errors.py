@@ -6,6 +6,15 @@ class ValidationError(ValueError):
         self.message = message
         super().__init__(self.message)
 
+class PayloadTooLargeError(ValidationError):
+    """Exception raised when an upload exceeds a size limit"""
+
+class DuplicateDocumentError(Exception):
+    """Exception raised when an import document was already accepted"""
+    def __init__(self, document):
+        self.document = document
+        super().__init__(f"Document {document.digest} was already imported")
+
 class ZeroMarksError(Exception):
     """Exception raised when marks_available is zero"""
     def __init__(self, message):
@@ -21,6 +30,12 @@ def register_error_handlers(app):
         response.status_code = 400
         return response
     
+    @app.errorhandler(PayloadTooLargeError)
+    def handle_payload_too_large(error):
+        response = jsonify({'error': 'Payload Too Large', 'message': str(error.message)})
+        response.status_code = 413
+        return response
+
     @app.errorhandler(404)
     def handle_not_found(error):
         response = jsonify({'error': 'Not Found', 'message': 'The requested resource was not found.'})
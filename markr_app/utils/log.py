@@ -0,0 +1,104 @@
+from datetime import datetime, timezone
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line, including any `extra` fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+# The process's background writer, & the lock guarding its setup
+_listener = None
+_listener_lock = threading.Lock()
+
+def _build_handler(log_format):
+    handler = logging.StreamHandler(sys.stderr)
+    if log_format == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    return handler
+
+def configure_logging(app):
+    """
+    Send the process's logs through a queue to a background writer thread
+
+    Request & import threads only put records on an in-memory queue, so a slow
+    stderr or log collector never stalls them. Only the first app of a process
+    sets this up; LOG_LEVEL & LOG_FORMAT ('json' or 'text') come from its config.
+    """
+    global _listener
+
+    with _listener_lock:
+        if _listener is not None:
+            return
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        root.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+
+        _listener = logging.handlers.QueueListener(
+            log_queue, _build_handler(app.config.get('LOG_FORMAT', 'json')), respect_handler_level=True
+        )
+        _listener.start()
+        _listener.pid = os.getpid()
+        atexit.register(stop_logging)
+
+def restart_logging_after_fork():
+    """
+    Start a writer thread in a forked child (e.g. a gunicorn worker)
+
+    Threads don't survive fork, so without this a preloaded app's workers would
+    queue their records forever.
+    """
+    global _listener
+
+    with _listener_lock:
+        if _listener is None or _listener.pid == os.getpid():
+            return
+
+        # A fresh queue, so records the parent hadn't written yet aren't written twice
+        log_queue = queue.SimpleQueue()
+        for handler in logging.getLogger().handlers:
+            if isinstance(handler, logging.handlers.QueueHandler) and handler.queue is _listener.queue:
+                handler.queue = log_queue
+
+        _listener = logging.handlers.QueueListener(
+            log_queue, *_listener.handlers, respect_handler_level=True
+        )
+        _listener.start()
+        _listener.pid = os.getpid()
+
+def stop_logging():
+    """Write out any queued records & stop the writer thread"""
+    global _listener
+
+    with _listener_lock:
+        if _listener is None or _listener.pid != os.getpid():
+            return
+        _listener.stop()
+        _listener = None
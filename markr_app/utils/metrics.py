@@ -0,0 +1,317 @@
+import atexit
+from contextlib import contextmanager
+import glob
+import json
+import math
+import os
+import threading
+import time
+from flask import g, has_request_context, request
+
+# Latency buckets in seconds, from sub-millisecond lookups to very large imports
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + pairs + '}'
+
+class Counter:
+    """Monotonically increasing count, per combination of label values"""
+    type_name = 'counter'
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        """Add amount to the count for the given label values"""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.registry.lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self.registry.updated()
+
+    def snapshot(self):
+        with self.registry.lock:
+            return {json.dumps(key): value for key, value in self._values.items()}
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            labels = list(zip(self.labelnames, json.loads(key)))
+            yield self.name, labels, value
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets, per combination of label values"""
+    type_name = 'histogram'
+
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, value, **labels):
+        """Record one observation for the given label values"""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.registry.lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['buckets'][index] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+        self.registry.updated()
+
+    def snapshot(self):
+        with self.registry.lock:
+            return {json.dumps(key): {'buckets': list(entry['buckets']), 'sum': entry['sum'],
+                                      'count': entry['count']}
+                    for key, entry in self._values.items()}
+
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return {'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']}
+        total['buckets'] = [a + b for a, b in zip(total['buckets'], value['buckets'])]
+        total['sum'] += value['sum']
+        total['count'] += value['count']
+        return total
+
+    def samples(self, values):
+        for key, entry in sorted(values.items()):
+            labels = list(zip(self.labelnames, json.loads(key)))
+            for bound, count in zip(self.buckets, entry['buckets']):
+                yield f"{self.name}_bucket", labels + [('le', _format_value(bound))], count
+            yield f"{self.name}_bucket", labels + [('le', '+Inf')], entry['count']
+            yield f"{self.name}_sum", labels, entry['sum']
+            yield f"{self.name}_count", labels, entry['count']
+
+# Values of exited processes, merged into one file (matched by the metrics-*.json glob)
+DEAD_PROCESSES_FILE = 'metrics-dead.json'
+
+def _read_snapshot(path):
+    """Load a process's values from the multiprocess directory, or None if unreadable"""
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+class MetricsRegistry:
+    """
+    Process-wide set of metrics, rendered in the Prometheus text format
+
+    Gunicorn runs several worker processes and a scrape reaches only one of them.
+    With a multiprocess directory set, every process periodically writes its
+    values to its own file there, and rendering adds up the files of all
+    processes. Exited processes are folded into one file by mark_process_dead,
+    so counters never go backwards.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.metrics = {}
+        self.multiprocess_dir = None
+        self.flush_interval = 1.0
+        self._last_flush = 0.0
+
+    def counter(self, name, help_text, labelnames=()):
+        """Define a counter"""
+        return self._register(Counter(self, name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """Define a histogram"""
+        return self._register(Histogram(self, name, help_text, labelnames, buckets))
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def updated(self):
+        """Write this process's values out, at most once per flush_interval"""
+        if self.multiprocess_dir and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write this process's values to the multiprocess directory"""
+        if not self.multiprocess_dir:
+            return
+        with self.lock:
+            self._last_flush = time.monotonic()
+            path = os.path.join(self.multiprocess_dir, f"metrics-{os.getpid()}.json")
+            with open(f"{path}.tmp", 'w') as file:
+                json.dump(self._snapshot(), file)
+            os.replace(f"{path}.tmp", path)
+
+    def _snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def _merge_snapshot(self, totals, snapshot):
+        """Add a process's snapshot into totals, keyed by metric name"""
+        for name, values in snapshot.items():
+            metric = self.metrics.get(name)
+            if metric is None:
+                continue
+            merged = totals.setdefault(name, {})
+            for key, value in values.items():
+                merged[key] = metric.merge(merged.get(key), value)
+
+    def _collect(self):
+        """Values of every metric, summed over all processes in multiprocess mode"""
+        if not self.multiprocess_dir:
+            return self._snapshot()
+
+        self.flush()
+        totals = {name: {} for name in self.metrics}
+        for path in glob.glob(os.path.join(self.multiprocess_dir, 'metrics-*.json')):
+            snapshot = _read_snapshot(path)
+            if snapshot is not None:
+                self._merge_snapshot(totals, snapshot)
+        return totals
+
+    def mark_process_dead(self, pid, multiprocess_dir=None):
+        """
+        Fold an exited process's values into the shared file of all exited processes
+
+        Keeps the multiprocess directory from growing as workers are recycled, and
+        stops a new process reusing the PID from overwriting the old one's totals.
+        Call it from the process manager (gunicorn's child_exit hook).
+
+        Args:
+            pid (int): PID of the exited process
+            multiprocess_dir (str): Directory the processes write to, if not this registry's
+        """
+        directory = multiprocess_dir or self.multiprocess_dir
+        if not directory:
+            return
+        path = os.path.join(directory, f"metrics-{pid}.json")
+        snapshot = _read_snapshot(path)
+        if snapshot is None:
+            return
+
+        dead_path = os.path.join(directory, DEAD_PROCESSES_FILE)
+        with self.lock:
+            totals = _read_snapshot(dead_path) or {}
+            self._merge_snapshot(totals, snapshot)
+            with open(f"{dead_path}.tmp", 'w') as file:
+                json.dump(totals, file)
+            os.replace(f"{dead_path}.tmp", dead_path)
+            os.remove(path)
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text exposition format (version 0.0.4)
+
+        Returns:
+            str: The metrics page
+        """
+        values = self._collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help_text}")
+            lines.append(f"# TYPE {name} {metric.type_name}")
+            for sample_name, labels, value in metric.samples(values.get(name, {})):
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+# The registry & metrics shared by the whole process
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    'markr_http_requests_total', 'HTTP requests served', ('method', 'endpoint', 'status'))
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    'markr_http_request_duration_seconds', 'Time spent serving HTTP requests', ('method', 'endpoint'))
+PHASE_DURATION = REGISTRY.histogram(
+    'markr_phase_duration_seconds', 'Time spent in each phase of an import or aggregation', ('phase',))
+IMPORTS = REGISTRY.counter(
+    'markr_imports_total', 'Documents imported, by outcome', ('outcome',))
+ROWS_PARSED = REGISTRY.counter(
+    'markr_import_rows_parsed_total', 'Test results parsed out of imported documents')
+ROWS_WRITTEN = REGISTRY.counter(
+    'markr_import_rows_total', 'Parsed test results by what the import did with them', ('outcome',))
+
+def record_phase(phase, seconds):
+    """
+    Record the time spent in a phase of the current unit of work
+
+    Observed by the phase histogram, and added to the request's Server-Timing
+    header when called while serving a request.
+    """
+    PHASE_DURATION.observe(seconds, phase=phase)
+    if has_request_context():
+        timings = g.setdefault('server_timings', {})
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+@contextmanager
+def phase_timer(phase):
+    """Time the enclosed block as a phase (see record_phase)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - start)
+
+def record_import_rows(summary):
+    """Count the rows of a committed import by outcome"""
+    ROWS_PARSED.inc(summary['parsed'])
+    for outcome in ('inserted', 'updated', 'skipped'):
+        ROWS_WRITTEN.inc(summary[outcome], outcome=outcome)
+
+def _server_timing_header(timings, total):
+    entries = [f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ', '.join(entries)
+
+def init_metrics(app):
+    """
+    Record request metrics for the app, and emit Server-Timing headers
+
+    Response headers are controlled by SERVER_TIMING_ENABLED, and cross-process
+    aggregation by METRICS_MULTIPROC_DIR.
+    """
+    if app.config.get('METRICS_MULTIPROC_DIR'):
+        REGISTRY.multiprocess_dir = app.config['METRICS_MULTIPROC_DIR']
+        os.makedirs(REGISTRY.multiprocess_dir, exist_ok=True)
+        # Don't lose the last updates of a worker that is shutting down
+        atexit.register(REGISTRY.flush)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+
+        total = time.perf_counter() - started
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_REQUESTS.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+        HTTP_REQUEST_DURATION.observe(total, method=request.method, endpoint=endpoint)
+
+        if app.config.get('SERVER_TIMING_ENABLED', True):
+            response.headers['Server-Timing'] = _server_timing_header(g.get('server_timings', {}), total)
+        return response
@@ -1,10 +1,87 @@
-from flask import Blueprint, request, jsonify
-from markr_app.utils.errors import ValidationError, ZeroMarksError
+from datetime import datetime, timezone
+import functools
+import hashlib
+import logging
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context, url_for
+from markr_app.utils.errors import DuplicateDocumentError, PayloadTooLargeError, ValidationError, ZeroMarksError
 from markr_app.services.ingestion import process_test_results
-from markr_app.services.aggregation import calculate_aggregates
+from markr_app.services.aggregation import (
+    calculate_aggregates, calculate_aggregates_batch, calculate_distribution, calculate_rollup,
+    get_aggregate_validators, min_bucket_width
+)
+from markr_app.database import current_write_lsn, get_pool_stats, primary_reads, replica_reads
+from markr_app.models import ImportJob
+from markr_app.services.answers import calculate_item_analysis
+from markr_app.services.cache import get_aggregate_cache
+from markr_app.services.documents import document_digest, find_imported_document
+from markr_app.services.export import EXPORT_FORMATS, format_csv, format_ndjson, iter_result_pages
+from markr_app.services.jobs import enqueue_import
+from markr_app.services.uploads import (
+    DEFAULT_SPOOL_MEMORY, open_upload, parse_content_encoding, spool_upload, supported_content_encodings
+)
+from markr_app.utils.metrics import IMPORTS, REGISTRY, phase_timer
+
+logger = logging.getLogger(__name__)
 
 api_bp = Blueprint('api', __name__)
 
+def _upload_error(error):
+    """Response for an upload that couldn't be read: too large, or badly encoded"""
+    if isinstance(error, PayloadTooLargeError):
+        return jsonify({
+            'error': 'Payload Too Large',
+            'message': str(error)
+        }), 413
+    return jsonify({
+        'error': 'Validation Error',
+        'message': str(error)
+    }), 400
+
+def _read_from_replica(view):
+    """
+    Serve a read-only endpoint from a read replica when one is usable
+
+    A client that needs to see its own import sends the X-Write-LSN header of the
+    import's response back as X-Min-LSN, & only a replica that has replayed that
+    far (or else the primary) serves it.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with replica_reads(request.headers.get('X-Min-LSN')):
+            return view(*args, **kwargs)
+    return wrapper
+
+def _set_write_lsn(response):
+    """Tell the client the WAL location its reads must wait for, when replicas are in use"""
+    lsn = current_write_lsn()
+    if lsn is not None:
+        response.headers['X-Write-LSN'] = lsn
+    return response
+
+def _replay_import(document):
+    """
+    Response repeating the outcome of an import document that was already accepted
+
+    The write LSN is the current one, which is never behind the original import's.
+    """
+    if document.job_id is not None:
+        job = ImportJob.find_by_id(document.job_id)
+        response = jsonify({
+            'success': True,
+            'job_id': document.job_id,
+            'status': job.status if job is not None else None,
+            'message': f"Test results queued for import as job {document.job_id}"
+        })
+        response.status_code = 202
+        response.headers['Location'] = url_for('api.get_import_job', job_id=document.job_id)
+    else:
+        response = _set_write_lsn(jsonify({
+            'success': True,
+            'message': f"Successfully processed {document.processed_count} test results"
+        }))
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
 @api_bp.route('/import', methods=['POST'])
 def import_results():
     """Import XML test results Endpoint"""
@@ -17,22 +94,95 @@ def import_results():
             'message': 'Expected Content-Type: text/xml+markr'
         }), 415
     
-    # Get XML content from the request body
-    xml_content = request.data
-    if not xml_content:
+    encoding = parse_content_encoding(request.headers.get('Content-Encoding'))
+    if encoding is None:
+        return jsonify({
+            'error': 'Unsupported Media Type',
+            'message': f"Supported Content-Encodings: {', '.join(sorted(supported_content_encodings()))}"
+        }), 415
+
+    idempotency_key = request.headers.get('Idempotency-Key') or None
+    if idempotency_key is not None and len(idempotency_key) > 255:
+        return jsonify({
+            'error': 'Bad Request',
+            'message': 'Idempotency-Key must be at most 255 characters'
+        }), 400
+
+    # Retries are answered with the original outcome. A known Idempotency-Key is
+    # answered without reading the body at all.
+    deduplicate = current_app.config.get('IMPORT_DEDUPLICATE', True)
+    if deduplicate and idempotency_key is not None:
+        original = find_imported_document(idempotency_key=idempotency_key)
+        if original is not None:
+            IMPORTS.inc(outcome='duplicate')
+            return _replay_import(original)
+
+    # Stream the XML content from the request body, decompressing it on the fly
+    xml_content = open_upload(
+        request.stream, encoding,
+        max_compressed_bytes=current_app.config.get('IMPORT_MAX_COMPRESSED_BYTES'),
+        max_decompressed_bytes=current_app.config.get('IMPORT_MAX_DECOMPRESSED_BYTES'),
+    )
+    try:
+        is_empty = not xml_content.peek(1)
+    except ValidationError as e:
+        return _upload_error(e)
+    if is_empty:
         return jsonify({
             'error': 'Bad Request',
             'message': 'Request body is empty'
         }), 400
     
+    # Queue the document for the background workers when running asynchronously
+    if current_app.config.get('IMPORT_ASYNC', False) or 'respond-async' in request.headers.get('Prefer', ''):
+        try:
+            # Jobs store the decompressed document
+            document = xml_content.read()
+            digest = document_digest(document) if deduplicate else None
+            job = enqueue_import(document, digest=digest, idempotency_key=idempotency_key)
+        except DuplicateDocumentError as e:
+            return _replay_import(e.document)
+        except ValidationError as e:
+            return _upload_error(e)
+        except Exception as e:
+            return jsonify({
+                'error': 'Internal Server Error',
+                'message': 'An unexpected error occured while queueing the test results'
+            }), 500
+
+        response = jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'message': f"Test results queued for import as job {job.id}"
+        })
+        response.status_code = 202
+        response.headers['Location'] = url_for('api.get_import_job', job_id=job.id)
+        return response
+
+    digest = None
+    if deduplicate:
+        # Hash the whole document before parsing it, so a duplicate is never parsed
+        try:
+            with phase_timer('spool'):
+                digest, xml_content = spool_upload(
+                    xml_content, current_app.config.get('IMPORT_SPOOL_MAX_MEMORY', DEFAULT_SPOOL_MEMORY)
+                )
+        except ValidationError as e:
+            return _upload_error(e)
+
     try:
         # Process the XML test results
-        processed_count = process_test_results(xml_content)
+        processed_count = process_test_results(xml_content, digest=digest, idempotency_key=idempotency_key)
 
-        return jsonify({
+        return _set_write_lsn(jsonify({
             'success': True,
             'message': f"Successfully processed {processed_count} test results"
-        }), 200
+        })), 200
+    except DuplicateDocumentError as e:
+        return _replay_import(e.document)
+    except PayloadTooLargeError as e:
+        return _upload_error(e)
     except ValidationError as e:
         # Return validation error
         return jsonify({
@@ -45,19 +195,135 @@ def import_results():
             'error': 'Internal Server Error',
             'message': 'An unexpected error occured while processing the test results'
         }), 500
+    finally:
+        if digest is not None:
+            xml_content.close()
+
+@api_bp.route('/import/<int:job_id>', methods=['GET'])
+def get_import_job(job_id):
+    """Get the status of a queued import job
+
+    Rejected jobs report the validation error that caused the rejection. Read
+    from the primary, so a job's status is never behind; completed jobs carry an
+    X-Write-LSN for reading their results back from a replica.
+    """
+    job = ImportJob.find_by_id(job_id)
+    if job is None:
+        return jsonify({
+            'error': 'Not Found',
+            'message': f"No import job found with ID: {job_id}"
+        }), 404
+
+    response = jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'processed_count': job.processed_count,
+        'attempts': job.attempts,
+        'message': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'updated_at': job.updated_at.isoformat() if job.updated_at else None,
+    })
+    if job.status == ImportJob.STATUS_COMPLETED:
+        _set_write_lsn(response)
+    return response, 200
+
+def _make_etag(test_id, version):
+    """Strong ETag for a test's aggregates at a given change version"""
+    return hashlib.sha256(f"{test_id}:{version}".encode('utf-8')).hexdigest()[:32]
+
+def _is_not_modified(etag, last_modified):
+    """Check the request's conditional headers against a test's validators"""
+    # If-None-Match takes precedence over If-Modified-Since
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+def _set_validators(response, etag, last_modified):
+    """Attach caching & validator headers to an aggregate response"""
+    if etag is not None:
+        response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = current_app.config.get('AGGREGATE_CACHE_CONTROL', 'no-cache')
+    return response
+
+def _cached_test_response(test_id, namespace, calculate, phase=None):
+    """
+    Serve a JSON document calculated for a test, with caching & validators
+
+    Conditional requests matching the test's ETag or Last-Modified get a 304
+    without the document being calculated. Otherwise the serialized document is
+    served from the aggregate cache, under its own namespace.
+
+    Args:
+        test_id (str): Test the document describes
+        namespace (str): Cache namespace, also the phase name of the calculation by default
+        calculate (callable): Calculates the document from the test ID
+        phase (str): Phase name of the calculation, when the namespace has parameters in it
+
+    Raises:
+        Exception: Whatever calculate raised
+    """
+
+    def load_validators():
+        with phase_timer('validators'):
+            validators = get_aggregate_validators(test_id)
+        if validators is None:
+            return None, None, None
+        version, last_modified = validators
+        return version, _make_etag(test_id, version), last_modified
+
+    def calculate_body(check_version):
+        # Read the validators first, so they can never be newer than the body
+        version, etag, last_modified = load_validators()
+
+        # A lagging replica may not have replayed an import this process has heard
+        # about, & its older data mustn't be cached under the newer version
+        if check_version and cache is not None and (version or 0) < cache.version(test_id):
+            return None
+
+        # Calculate the document & serialize it once for the cache
+        with phase_timer(phase or namespace):
+            document = calculate(test_id)
+        with phase_timer('serialize'):
+            body = current_app.json.dumps(document).encode('utf-8')
+        return body, etag, last_modified
+
+    def compute():
+        computed = calculate_body(check_version=True)
+        if computed is None:
+            with primary_reads():
+                computed = calculate_body(check_version=False)
+        return computed
+
+    cache = get_aggregate_cache()
+    cached = cache.peek(test_id, namespace) if cache is not None else None
+
+    # Answer revalidations from the cache, or from a primary key lookup
+    if request.if_none_match or request.if_modified_since:
+        etag, last_modified = cached[1:] if cached is not None else load_validators()[1:]
+        if etag is not None and _is_not_modified(etag, last_modified):
+            return _set_validators(Response(status=304), etag, last_modified)
+
+    if cached is None:
+        cached = cache.get_or_compute(test_id, compute, namespace) if cache is not None else compute()
+    body, etag, last_modified = cached
+
+    return _set_validators(Response(body, status=200, mimetype='application/json'), etag, last_modified)
 
 @api_bp.route('/results/<test_id>/aggregate', methods=['GET'])
+@_read_from_replica
 def get_aggregate_results(test_id):
     """ Get the aggregate results for a test
     
-    Return a JSON object with the mean, count, p25, p50, p75 values
+    Return a JSON object with the mean, count, p25, p50, p75 values.
+    Conditional requests matching the test's ETag or Last-Modified get a 304
+    without the aggregates being calculated.
     """
-
     try:
-        # Calculate aggregate statistics
-        aggregates = calculate_aggregates(test_id)
-
-        return jsonify(aggregates), 200
+        return _cached_test_response(test_id, 'aggregate', calculate_aggregates)
 
     except ZeroMarksError as e:
         # Return server error for zero marks
@@ -80,10 +346,265 @@ def get_aggregate_results(test_id):
         }), 500
     
 
+@api_bp.route('/results/<test_id>/items', methods=['GET'])
+@_read_from_replica
+def get_item_analysis(test_id):
+    """ Get per-question statistics for a test
+
+    Return a JSON object with the difficulty & discrimination of every question,
+    computed from the answers stored with each result. Cached & revalidated like
+    the aggregates.
+    """
+    try:
+        return _cached_test_response(test_id, 'items', calculate_item_analysis)
+
+    except ValueError as e:
+        # Return not found error
+        return jsonify({
+            'error': 'Not Found',
+            'message': f"{str(e)}"
+        }), 404
+
+    except Exception as e:
+        return jsonify({
+            'error': 'Internal Server Error',
+            'message': f"An error occured while calculating the item analysis: {str(e)}"
+        }), 500
+
+
+@api_bp.route('/results/<test_id>/distribution', methods=['GET'])
+@_read_from_replica
+def get_distribution(test_id):
+    """ Get the number of students per mark, or per percentage bucket, for a test
+
+    Counts are indexed by mark by default. With ?bucket=<width> they are per
+    bucket of that many percent of the max marks available, with the bucket
+    edges. Cached & revalidated like the aggregates.
+    """
+    bucket_width = request.args.get('bucket')
+    if bucket_width is not None:
+        try:
+            bucket_width = float(bucket_width)
+        except ValueError:
+            bucket_width = None
+        # The bucket count is bounded like the per-mark counts
+        if bucket_width is None or not min_bucket_width() <= bucket_width <= 100:
+            return jsonify({
+                'error': 'Bad Request',
+                'message': f"Expected a bucket width between {min_bucket_width():g} and 100 percent"
+            }), 400
+
+    try:
+        return _cached_test_response(
+            test_id, f"distribution:{bucket_width}",
+            lambda test_id: calculate_distribution(test_id, bucket_width), phase='distribution'
+        )
+
+    except ValidationError as e:
+        return jsonify({
+            'error': 'Bad Request',
+            'message': str(e)
+        }), 400
+
+    except ZeroMarksError as e:
+        # Return server error for zero marks
+        return jsonify({
+            'error': 'Internal Server Error',
+            'message': str(e)
+        }), 500
+
+    except ValueError as e:
+        # Return not found error
+        return jsonify({
+            'error': 'Not Found',
+            'message': f"{str(e)}"
+        }), 404
+
+    except Exception as e:
+        return jsonify({
+            'error': 'Internal Server Error',
+            'message': f"An error occured while calculating the distribution: {str(e)}"
+        }), 500
+
+
+def _requested_test_ids(max_setting, default):
+    """
+    Read the test IDs of a multi-test request from its JSON body
+
+    Args:
+        max_setting (str): Config setting holding the most test IDs allowed
+        default (int): Limit used when the setting is missing
+
+    Returns:
+        list: The distinct test IDs, in the requested order
+
+    Raises:
+        ValidationError: If the body has no list of string test_ids, or too many
+    """
+    payload = request.get_json(silent=True) or {}
+    test_ids = payload.get('test_ids')
+
+    if not isinstance(test_ids, list) or not test_ids \
+            or not all(isinstance(test_id, str) for test_id in test_ids):
+        raise ValidationError('Expected a JSON body with a non-empty list of string test_ids')
+
+    # Drop repeated IDs while keeping the requested order
+    test_ids = list(dict.fromkeys(test_ids))
+
+    max_tests = current_app.config.get(max_setting, default)
+    if len(test_ids) > max_tests:
+        raise ValidationError(f"At most {max_tests} test IDs can be requested at once")
+    return test_ids
+
+@api_bp.route('/results/aggregate', methods=['POST'])
+@_read_from_replica
+def get_batch_aggregate_results():
+    """ Get the aggregate results for many tests in one request
+
+    Expects a JSON body of the form {"test_ids": ["1234", "5678"]} and returns a
+    JSON object mapping each test ID to its aggregates, or to an error entry
+    """
+    try:
+        test_ids = _requested_test_ids('AGGREGATE_BATCH_MAX_TESTS', 1000)
+    except ValidationError as e:
+        return jsonify({
+            'error': 'Bad Request',
+            'message': str(e)
+        }), 400
+
+    try:
+        return jsonify(calculate_aggregates_batch(test_ids)), 200
+    except Exception as e:
+        return jsonify({
+            'error': 'Internal Server Error',
+            'message': f"An error occured while calculating aggregates: {str(e)}"
+        }), 500
+
+
+@api_bp.route('/results/rollup', methods=['POST'])
+@_read_from_replica
+def get_rollup_results():
+    """ Get aggregate results over the students of many tests together
+
+    Expects a JSON body of the form {"test_ids": ["1234", "5678"]}, e.g. every
+    test of a subject, and returns one set of aggregates for all their students
+    along with the error bound of the percentiles
+    """
+    try:
+        test_ids = _requested_test_ids('AGGREGATE_ROLLUP_MAX_TESTS', 10000)
+    except ValidationError as e:
+        return jsonify({
+            'error': 'Bad Request',
+            'message': str(e)
+        }), 400
+
+    try:
+        with phase_timer('aggregate'):
+            rollup = calculate_rollup(test_ids)
+        return jsonify(rollup), 200
+    except ValueError as e:
+        return jsonify({
+            'error': 'Not Found',
+            'message': str(e)
+        }), 404
+    except Exception as e:
+        return jsonify({
+            'error': 'Internal Server Error',
+            'message': f"An error occured while calculating aggregates: {str(e)}"
+        }), 500
+
+
+def _parse_timestamp_arg(name):
+    """Read an ISO 8601 query parameter as a UTC-aware datetime (naive values are UTC)"""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValidationError(f"Invalid '{name}' timestamp: {value}")
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+def _parse_after_id_arg():
+    """Read the result ID an export resumes after, rejecting anything but a non-negative integer"""
+    value = request.args.get('after_id')
+    if value is None:
+        return 0
+    if not value.isdecimal():
+        raise ValidationError(f"Invalid 'after_id': {value}")
+    return int(value)
+
+@api_bp.route('/results/export', methods=['GET'])
+def export_results():
+    """ Stream the raw results of a test or a scan date range
+
+    Takes test_id and/or from & to (ISO 8601 bounds on the scan time, to being
+    exclusive), an optional after_id to resume from, & format=ndjson (default) or
+    csv (also chosen by Accept: text/csv). The response is sent in chunks as the
+    results are read page by page, so memory use doesn't depend on its size.
+    """
+    try:
+        test_id = request.args.get('test_id')
+        scanned_from = _parse_timestamp_arg('from')
+        scanned_to = _parse_timestamp_arg('to')
+        after_id = _parse_after_id_arg()
+    except ValidationError as e:
+        return jsonify({
+            'error': 'Bad Request',
+            'message': str(e)
+        }), 400
+
+    if test_id is None and scanned_from is None and scanned_to is None:
+        return jsonify({
+            'error': 'Bad Request',
+            'message': "Expected a 'test_id' and/or a 'from'/'to' scan date range"
+        }), 400
+
+    export_format = request.args.get('format')
+    if export_format is None:
+        export_format = 'csv' if request.accept_mimetypes.best_match(
+            ['application/x-ndjson', 'text/csv']) == 'text/csv' else 'ndjson'
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({
+            'error': 'Bad Request',
+            'message': f"Supported formats: {', '.join(EXPORT_FORMATS)}"
+        }), 400
+
+    page_size = current_app.config.get('EXPORT_PAGE_SIZE', 5000)
+    min_lsn = request.headers.get('X-Min-LSN')
+
+    def generate():
+        if export_format == 'csv':
+            yield format_csv([], header=True)
+
+        # The body is produced after the view returns, so choose the replica here
+        with replica_reads(min_lsn):
+            exported = 0
+            try:
+                for rows in iter_result_pages(test_id, scanned_from, scanned_to, after_id, page_size):
+                    exported += len(rows)
+                    yield format_csv(rows) if export_format == 'csv' else format_ndjson(rows)
+            except Exception as e:
+                # Too late for an error status; the client sees a truncated body
+                logger.error(f"Export failed after {exported} results: {str(e)}")
+                raise
+
+    return Response(stream_with_context(generate()), status=200, mimetype=EXPORT_FORMATS[export_format])
+
+
 @api_bp.route('/health', methods=['GET'])
 def health_check():
     """Basic health check endpoint"""
     return jsonify({"message": "OK"})
 
-    
-    
\ No newline at end of file
+
+@api_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Request, phase & import row metrics in the Prometheus text format"""
+    return Response(REGISTRY.render(), status=200, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@api_bp.route('/health/pool', methods=['GET'])
+def pool_diagnostics():
+    """Connection pool diagnostics for this worker process"""
+    return jsonify({"pools": get_pool_stats()})
@@ -0,0 +1,4 @@
+"""WSGI entry point for production servers (e.g. gunicorn)"""
+from markr_app.app import create_app
+
+app = create_app()